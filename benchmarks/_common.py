@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Helpers shared by the benchmark scripts, which import this module from
+# the same directory (e.g., `python benchmarks/shared_predicates.py`).
+
+###############################################################################
+# Imports
+###############################################################################
+
+from builtins import object
+import sys
+import types
+
+
+###############################################################################
+# Messages
+###############################################################################
+
+class Msg(object):
+    # a message with any fields, e.g., `Msg(x=1.0, header=Msg(seq=1))`
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Point(object):
+    # like `geometry_msgs/Point`, the message type of generated nodes
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+###############################################################################
+# Placeholder ROS Modules
+###############################################################################
+
+class _Anything(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def publish(self, *args):
+        pass
+
+
+def _install_fake_ros():
+    # `rospy` and the message packages of generated nodes, so that nodes
+    # run without ROS
+    rospy = types.ModuleType('rospy')
+    rospy.Publisher = _Anything
+    rospy.Subscriber = _Anything
+    rospy.get_time = lambda: 1.0
+    sys.modules['rospy'] = rospy
+    for pkg in ('std_msgs', 'geometry_msgs'):
+        mod = types.ModuleType(pkg)
+        sys.modules[pkg] = mod
+        msg = types.ModuleType(pkg + '.msg')
+        msg.Bool = msg.Point = _Anything
+        sys.modules[pkg + '.msg'] = msg
+        mod.msg = msg
+
+
+def new_node(code):
+    # executes the code of a node and launches its monitors, as `run()`
+    # does, but without the timer loop
+    namespace = {'__name__': 'hplrv_node'}
+    exec(compile(code, '<node>', 'exec'), namespace)
+    node = namespace['HplMonitorNode']()
+    for mon in node.monitors:
+        mon.on_launch(0.0)
+    return node
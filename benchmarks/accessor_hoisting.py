@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of one message callback for geometry-heavy properties,
+# with and without binding repeated message field chains to locals.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Msg
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+PROPERTIES = (
+    # roll/pitch/yaw expand to four field chains each, several times over
+    ('globally: no /odom {abs(roll(pose.pose.orientation)) > 0.5'
+     ' or abs(pitch(pose.pose.orientation)) > 0.5}'),
+    ('globally: /odom {yaw(pose.pose.orientation) > 3.0}'
+     ' causes /cmd within 1 s'),
+    ('after /odom {pose.pose.position.z > 10}: no /odom'
+     ' {pose.pose.position.x * pose.pose.position.x'
+     ' + pose.pose.position.y * pose.pose.position.y > 10000}'),
+    ('globally: /cmd as C forbids /odom {pose.pose.position.x > @C.x'
+     ' and pose.pose.position.y > @C.y} within 1 s'),
+)
+
+RUNS = 5
+NUMBER = 20000
+
+
+###############################################################################
+# Messages
+###############################################################################
+
+def odometry():
+    position = Msg(x=1.0, y=2.0, z=0.5)
+    orientation = Msg(x=0.0, y=0.0, z=0.1, w=0.99)
+    return Msg(pose=Msg(pose=Msg(position=position, orientation=orientation)))
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def per_message(cls, pending=0):
+    m = cls()
+    m.on_launch(0.0)
+    for i in range(pending):
+        m.on_msg__cmd(Msg(x=100.0 + i, y=100.0), 0.0)
+    msg = odometry()
+    def run():
+        m.on_msg__odom(msg, 0.5)
+    t = min(timeit.repeat(run, number=NUMBER, repeat=RUNS))
+    assert m.verdict is None
+    return t / NUMBER
+
+def main():
+    p = property_parser()
+    r = TemplateRenderer(preload=True)
+    hoisted = CodeOptions(hoist_accessors=True)
+    print('Per-message cost of /odom callbacks')
+    for text in PROPERTIES:
+        hp = p.parse(text)
+        pending = 100 if hp.pattern.is_prevention else 0
+        base = per_message(r.build_monitor_class(hp), pending=pending)
+        t = per_message(r.build_monitor_class(hp, options=hoisted),
+                        pending=pending)
+        print('  {}...'.format(text[:60]))
+        print('    inline chains: {:8.2f} us'.format(base * 1e6))
+        print('    hoisted:       {:8.2f} us ({:.2f}x)'.format(
+            t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of draining a backlog of messages of one topic, by
+# calling `on_msg_<topic>` for each message, and with a single call to
+# `on_msgs_<topic>` (the `batch_callbacks` code option).
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Point
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+# none of these decide a verdict for the benchmark messages
+PROPERTIES = (
+    'globally: no /odom {x > 1000}',
+    'globally: /odom as A {x > 1} causes /cmd {x > @A.x} within 1000 s',
+)
+
+NUM_MESSAGES = 1000
+
+RUNS = 5
+NUMBER = 20
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+
+def per_message(fun):
+    t = min(timeit.repeat(fun, number=NUMBER, repeat=RUNS))
+    return t / NUMBER / NUM_MESSAGES
+
+def main():
+    p = property_parser()
+    r = TemplateRenderer(preload=True)
+    msgs = [Point(0.5, 0.0) for _ in range(NUM_MESSAGES)]
+    stamps = [0.001 * i for i in range(NUM_MESSAGES)]
+    for text in PROPERTIES:
+        hp = p.parse(text)
+        print(text)
+        for level in (0, 3):
+            options = CodeOptions.from_level(level, batch_callbacks=True)
+            monitor = r.build_monitor_class(hp, options=options)()
+            monitor.on_launch(0.0)
+
+            def one_by_one():
+                cb = monitor.on_msg__odom
+                for i in range(NUM_MESSAGES):
+                    cb(msgs[i], stamps[i])
+
+            def batched():
+                monitor.on_msgs__odom(msgs, stamps)
+
+            base = per_message(one_by_one)
+            t = per_message(batched)
+            print('  -O{}: on_msg {:6.3f} us/msg, on_msgs {:6.3f} us/msg'
+                  ' ({:.2f}x)'.format(level, base * 1e6, t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
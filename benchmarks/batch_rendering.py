@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures how `TemplateRenderer.render_many` scales with the number of
+# worker processes, for a batch of a few hundred properties.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import range
+from multiprocessing import cpu_count
+import sys
+import time
+
+from hpl.parser import property_parser
+
+from hplrv.rendering import TemplateRenderer
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+TEMPLATES = (
+    'globally: no /b{i} {{data > {i}}} within 100 ms',
+    'after /p{i}: some /b {{data > {i}}} within 100 ms',
+    'globally: /b as B requires /a{i} {{data < @B.data + {i}}} within 1 s',
+    'after /p until /q: /a{i} as A causes /b {{x < @A.x}} within 100 ms',
+    'globally: /a{i} as A forbids /b {{x = @A.x}} within 100 ms',
+)
+
+NUM_PROPERTIES = 500
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def properties(n):
+    p = property_parser()
+    hps = []
+    for i in range(n):
+        text = TEMPLATES[i % len(TEMPLATES)].format(i=i)
+        hps.append(p.parse(text))
+    return hps
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PROPERTIES
+    hps = properties(n)
+    r = TemplateRenderer(preload=True)
+    print('Rendering {} properties'.format(n))
+    jobs = 1
+    base = None
+    while jobs <= cpu_count():
+        t0 = time.time()
+        results = r.render_many(hps, jobs=jobs)
+        t = time.time() - t0
+        assert all(result.error is None for result in results)
+        base = base or t
+        print('  jobs = {:3}: {:8.2f} ms (speedup {:.2f}x)'.format(
+            jobs, t * 1000, base / t))
+        jobs *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the memory held by a monitor with many pending triggers, whose
+# messages carry a large payload (e.g., an image), with whole messages and
+# with field projection. Requires Python 3 (tracemalloc).
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import gc
+import sys
+import tracemalloc
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Msg
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+PROPERTIES = (
+    'globally: /image as A causes /ack {seq = @A.header.seq} within 60 s',
+    'globally: /ack as B requires /image {header.seq = @B.seq} within 60 s',
+)
+
+PENDING = 1000
+PAYLOAD = 64 * 1024 # bytes
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def image(i):
+    return Msg(header=Msg(seq=i, stamp=float(i)), width=128, height=128,
+               data=bytearray(PAYLOAD))
+
+def retained(cls, n):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    m = cls()
+    m.on_launch(0.0)
+    for i in range(n):
+        m.on_msg__image(image(i), 1.0 + i * 0.001)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(m._pool) == n
+    return after - before
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else PENDING
+    p = property_parser()
+    r = TemplateRenderer(preload=True)
+    options = CodeOptions(project_fields=True)
+    print('Memory held by {} pending triggers of {} KiB each'.format(
+        n, PAYLOAD // 1024))
+    for text in PROPERTIES:
+        hp = p.parse(text)
+        base = retained(r.build_monitor_class(hp), n)
+        t = retained(r.build_monitor_class(hp, options=options), n)
+        print('  {}'.format(text))
+        print('    whole messages: {:10.1f} KiB'.format(base / 1024.0))
+        print('    projected:      {:10.1f} KiB ({:.0f}x less)'.format(
+            t / 1024.0, base / float(t)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of one /odom message in a generated ROS node where every
+# property consumes /odom, with one monitor class per property vs. a single
+# fused class (`fuse_monitors`), at optimization levels 0 and 3.
+# ROS is not needed: `rospy` and the message packages are replaced by
+# minimal placeholder modules before the node code is executed.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import range
+import sys
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Point, _install_fake_ros, new_node
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+# none of these hold for the benchmark message, so monitors stay active
+TEMPLATES = (
+    'globally: no /odom {{x > {i}}}',
+    'globally: no /odom {{sqrt(x * x + y * y) > {i}}} within 10 s',
+    'globally: /odom {{x > {i}}} causes /ack within 10 s',
+    'globally: some /odom {{x > {i} and y > {i}}}',
+)
+
+NUM_PROPERTIES = 100
+
+RUNS = 5
+NUMBER = 2000
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def properties(n):
+    p = property_parser()
+    return [p.parse(TEMPLATES[i % len(TEMPLATES)].format(i=1000 + i))
+            for i in range(n)]
+
+def per_message(node):
+    msg = Point(1.0, 2.0)
+    cb = node.on_msg__odom
+    t = min(timeit.repeat(lambda: cb(msg), number=NUMBER, repeat=RUNS))
+    return t / NUMBER
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PROPERTIES
+    _install_fake_ros()
+    hps = properties(n)
+    topic_types = {'/odom': 'geometry_msgs/Point',
+                   '/ack': 'geometry_msgs/Point'}
+    r = TemplateRenderer(preload=True)
+    print('Node with {} properties on /odom'.format(n))
+    base = None
+    for level in (0, 3):
+        options = CodeOptions.from_level(level, hoist_accessors=level > 0)
+        for fuse in (False, True):
+            code = r.render_rospy_node(hps, topic_types, options=options,
+                                       fuse_monitors=fuse)
+            t = per_message(new_node(code))
+            base = base or t
+            print('  -O{} fuse_monitors = {!s:5}: {:8.2f} us/msg'
+                  ' ({:.2f}x)'.format(level, fuse, t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Compares interpreted monitors (`hplrv.generic_monitor`) with generated
+# monitor classes: the cost of getting ready-to-use monitors for many
+# properties from scratch, and the cost of one message.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import sys
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.generic_monitor import MonitorProgram, StateMachineMonitor
+from hplrv.rendering import TemplateRenderer
+
+from _common import Point
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+TEMPLATES = (
+    'globally: no /odom {{x > {i}}}',
+    'after /odom {{x > 1}}: some /odom {{x > {i} and y > {i}}} within 2 s',
+    'globally: /odom as A {{x > 1}} causes /cmd {{x > @A.x + {i}}} within 1 s',
+    'globally: /odom {{x > 1}} forbids /cmd {{y > {i}}}',
+)
+
+NUM_PROPERTIES = 100
+
+RUNS = 5
+NUMBER = 2000
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+
+def properties(n):
+    p = property_parser()
+    return [p.parse(TEMPLATES[i % len(TEMPLATES)].format(i=1000 + i))
+            for i in range(n)]
+
+def startup(hps, make):
+    t = min(timeit.repeat(lambda: [make(hp) for hp in hps],
+                          number=1, repeat=RUNS))
+    return t
+
+def per_message(monitors):
+    msg = Point(2.0, 3.0)
+    callbacks = [m.cb_map['/odom'] for m in monitors]
+    def run():
+        for cb in callbacks:
+            cb(msg, 1.0)
+    t = min(timeit.repeat(run, number=NUMBER, repeat=RUNS))
+    return t / NUMBER / len(monitors)
+
+def launched(monitor):
+    monitor.on_launch(0.0)
+    return monitor
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PROPERTIES
+    hps = properties(n)
+    print('{} properties on /odom'.format(n))
+
+    def generated(hp):
+        # a new renderer each time, so that nothing is memoized
+        return TemplateRenderer().build_monitor_class(hp)()
+
+    def interpreted(hp):
+        return StateMachineMonitor(MonitorProgram.from_property(hp))
+
+    base = startup(hps, generated)
+    t = startup(hps, interpreted)
+    print('startup, per property')
+    print('  generated class:   {:10.2f} us'.format(base / n * 1e6))
+    print('  interpreted:       {:10.2f} us ({:.1f}x)'.format(
+        t / n * 1e6, base / t))
+
+    r = TemplateRenderer(preload=True)
+    base = per_message([launched(r.build_monitor_class(hp)()) for hp in hps])
+    t = per_message([launched(interpreted(hp)) for hp in hps])
+    print('message, per monitor')
+    print('  generated class:   {:10.2f} us'.format(base * 1e6))
+    print('  interpreted:       {:10.2f} us ({:.1f}x slower)'.format(
+        t * 1e6, t / base))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of one behaviour message in a response monitor whose
+# behaviour refers to its trigger by an equality join, for several numbers
+# of pending triggers, with and without a hash index on the pool.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Msg
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+PROPERTY = 'globally: /goal as G causes /result {id = @G.id}'
+
+POOL_SIZES = (10, 1000, 100000)
+
+RUNS = 5
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def per_message(cls, n):
+    # each run answers one pending goal, and then issues it again
+    m = cls()
+    m.on_launch(0.0)
+    for i in range(n):
+        m.on_msg__goal(Msg(id=i), 0.0)
+    state = {'i': 0, 't': 1.0}
+    def run():
+        i = state['i']
+        state['t'] += 0.001
+        m.on_msg__result(Msg(id=i), state['t'])
+        m.on_msg__goal(Msg(id=i), state['t'])
+        state['i'] = (i + 1) % n
+    number = max(10, min(10000, 10000000 // n))
+    t = min(timeit.repeat(run, number=number, repeat=RUNS))
+    assert m.verdict is None and len(m._pool) == n
+    return t / number
+
+def main():
+    p = property_parser()
+    r = TemplateRenderer(preload=True)
+    hp = p.parse(PROPERTY)
+    plain = r.build_monitor_class(hp)
+    indexed = r.build_monitor_class(
+        hp, options=CodeOptions(join_indices=True))
+    print('Per-message cost: ' + PROPERTY)
+    for n in POOL_SIZES:
+        base = per_message(plain, n)
+        t = per_message(indexed, n)
+        print('  {:6} pending: scan {:10.2f} us, index {:6.2f} us ({:.1f}x)'
+              .format(n, base * 1e6, t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Compares the cost of obtaining a ready-to-use monitor object by executing
+# rendered code by hand versus `TemplateRenderer.build_monitor_class`,
+# without and with its memoized classes.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.caching import RenderCache
+from hplrv.rendering import TemplateRenderer
+from hplrv.runtime import monitor_globals
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+PROPERTY = ('after /p as P until /q: /a as A {x > @P.x} '
+            'causes /b {x < @A.x} within 100 ms')
+
+RUNS = 1000
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def main():
+    hp = property_parser().parse(PROPERTY)
+    r = TemplateRenderer(preload=True)
+
+    def exec_rendered():
+        namespace = monitor_globals()
+        exec(compile(r.render_monitor(hp), '<string>', 'exec'), namespace)
+        return namespace['PropertyMonitor']()
+
+    # renderers that keep no classes, so that every call builds one
+    rb = TemplateRenderer(preload=True, max_classes=0)
+
+    def build_class():
+        return rb.build_monitor_class(hp)()
+
+    rc = TemplateRenderer(render_cache=RenderCache(), max_classes=0)
+
+    def build_class_cached():
+        return rc.build_monitor_class(hp)()
+
+    def build_class_memoized():
+        return r.build_monitor_class(hp)()
+
+    cls = r.build_monitor_class(hp)
+
+    def instantiate():
+        return cls()
+
+    print('Creating one monitor object (average of {} runs)'.format(RUNS))
+    for name, fun in (('render + compile + exec', exec_rendered),
+                      ('build_monitor_class', build_class),
+                      ('... with RenderCache', build_class_cached),
+                      ('... memoized class', build_class_memoized),
+                      ('instantiate class', instantiate)):
+        t = timeit.timeit(fun, number=RUNS) / RUNS
+        print('  {:24} {:10.2f} us'.format(name, t * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of feeding a stream of messages on several topics to
+# many monitors, by looking up the `cb_map` of every monitor for every
+# message, and with `MonitorSet.dispatch` and `MonitorSet.dispatch_batch`.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import sys
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.dispatch import MonitorSet
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Point
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+# none of these decide a verdict for the benchmark messages
+TEMPLATES = (
+    'globally: no /t{j} {{x > {i}}}',
+    'after /t{j} {{x > {i}}}: some /odom {{x > {i}}}',
+    'globally: /t{j} {{x > {i}}} causes /odom {{y > {i}}} within 1 s',
+)
+
+NUM_PROPERTIES = 100
+NUM_TOPICS = 20
+NUM_EVENTS = 1000
+
+RUNS = 5
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+
+def properties(n):
+    p = property_parser()
+    return [p.parse(TEMPLATES[i % len(TEMPLATES)].format(
+        i=1000 + i, j=i % NUM_TOPICS)) for i in range(n)]
+
+def events():
+    msg = Point(2.0, 3.0)
+    topics = ['/t{}'.format(j) for j in range(NUM_TOPICS)] + ['/odom']
+    return [(topics[i % len(topics)], msg, 1.0) for i in range(NUM_EVENTS)]
+
+def per_event(fun):
+    t = min(timeit.repeat(fun, number=1, repeat=RUNS))
+    return t / NUM_EVENTS
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PROPERTIES
+    r = TemplateRenderer(preload=True)
+    options = CodeOptions.from_level(3)
+    monitors = [r.build_monitor_class(hp, options=options)()
+                for hp in properties(n)]
+    ms = MonitorSet(monitors)
+    ms.on_launch(0.0)
+    stream = events()
+
+    def by_hand():
+        for topic, msg, stamp in stream:
+            for m in monitors:
+                cb = m.cb_map.get(topic)
+                if cb is not None:
+                    cb(msg, stamp)
+
+    def dispatch():
+        for topic, msg, stamp in stream:
+            ms.dispatch(topic, msg, stamp)
+
+    def dispatch_batch():
+        ms.dispatch_batch(stream)
+
+    print('{} properties, {} topics (-O3)'.format(n, NUM_TOPICS + 1))
+    base = per_event(by_hand)
+    print('  cb_map of every monitor: {:8.2f} us/msg'.format(base * 1e6))
+    for name, fun in (('dispatch', dispatch),
+                      ('dispatch_batch', dispatch_batch)):
+        t = per_event(fun)
+        print('  {:24}  {:8.2f} us/msg ({:.1f}x)'.format(
+            name + ':', t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
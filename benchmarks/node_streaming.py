@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Compares the peak memory used to generate a ROS node for an increasing
+# number of properties, rendering to a string versus streaming to a file.
+# Requires Python 3 (tracemalloc).
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+import os
+import tempfile
+import tracemalloc
+
+from hpl.parser import property_parser
+
+from hplrv.rendering import TemplateRenderer
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+TEMPLATES = (
+    'globally: no /b {{data > {i}}} within 100 ms',
+    'after /p: some /b {{data > {i}}} within 100 ms',
+    'globally: /b as B requires /a {{data < @B.data + {i}}} within 1 s',
+    'after /p until /q: /a as A causes /b {{data < @A.data}} within 100 ms',
+    'globally: /a as A forbids /b {{data = @A.data + {i}}} within 100 ms',
+)
+
+TOPICS = {
+    '/a': 'std_msgs/Int32',
+    '/b': 'std_msgs/Int32',
+    '/p': 'std_msgs/Empty',
+    '/q': 'std_msgs/Empty',
+}
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def properties(n):
+    p = property_parser()
+    return [p.parse(TEMPLATES[i % len(TEMPLATES)].format(i=i))
+            for i in range(n)]
+
+def peak_memory(fun, *args):
+    tracemalloc.start()
+    fun(*args)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def render(r, hps, path):
+    code = r.render_rospy_node(hps, TOPICS)
+    with open(path, 'w') as f:
+        f.write(code)
+
+def stream(r, hps, path):
+    with open(path, 'w') as f:
+        r.stream_rospy_node(hps, TOPICS, f)
+
+def main():
+    r = TemplateRenderer(preload=True)
+    fd, path = tempfile.mkstemp(suffix='.py')
+    os.close(fd)
+    try:
+        print('Peak memory (KiB) to generate a node:')
+        print('  {:>6} {:>10} {:>10}'.format('props', 'render', 'stream'))
+        for n in (10, 100, 500, 1000):
+            hps = properties(n)
+            a = peak_memory(render, r, hps, path)
+            b = peak_memory(stream, r, hps, path)
+            print('  {:6} {:10.1f} {:10.1f}'.format(n, a / 1024, b / 1024))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of one message callback for properties that quantify
+# over a LaserScan-like array, with generators and with NumPy.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Msg
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+PROPERTIES = (
+    'globally: no /scan {forall i in ranges: ranges[@i] > 0.1}',
+    ('globally: no /scan'
+     ' {exists i in ranges: abs(ranges[@i] - range_max) < 0.01}'),
+    ('globally: no /scan {forall i in ranges:'
+     ' (ranges[@i] >= range_min and ranges[@i] <= range_max)}'),
+)
+
+SIZES = (10, 100, 1000, 10000)
+
+RUNS = 5
+
+
+###############################################################################
+# Messages
+###############################################################################
+
+def laser_scan(n):
+    # none of the properties above are violated by this message
+    ranges = tuple(0.5 + (i % 100) * 0.05 for i in range(n))
+    ranges = ranges[:-1] + (0.05,)
+    return Msg(ranges=ranges, range_min=0.1, range_max=30.0)
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def per_message(cls, msg):
+    m = cls()
+    m.on_launch(0.0)
+    number = max(10, 100000 // len(msg.ranges))
+    def run():
+        m.on_msg__scan(msg, 0.5)
+    t = min(timeit.repeat(run, number=number, repeat=RUNS))
+    assert m.verdict is None
+    return t / number
+
+def main():
+    p = property_parser()
+    r = TemplateRenderer(preload=True)
+    vectorized = CodeOptions(numpy_quantifiers=True)
+    print('Per-message cost of /scan callbacks')
+    for text in PROPERTIES:
+        hp = p.parse(text)
+        base_cls = r.build_monitor_class(hp)
+        np_cls = r.build_monitor_class(hp, options=vectorized)
+        print('  {}...'.format(text[:60]))
+        for n in SIZES:
+            msg = laser_scan(n)
+            base = per_message(base_cls, msg)
+            t = per_message(np_cls, msg)
+            print('    {:6} elements: {:10.2f} us -> {:8.2f} us ({:.2f}x)'
+                  .format(n, base * 1e6, t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of one message callback at each optimization level
+# (see CodeOptions.from_level), over a cycle of messages that enters and
+# exits the scope of each property. Level 2 declares the scope hooks unused.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions, OPT_LEVELS
+from hplrv.rendering import TemplateRenderer
+
+from _common import Msg
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+# (property, cycle of topics); no verdict is ever reached
+PROPERTIES = (
+    ('after /p until /q: no /a {x > 100}',
+     ('/p', '/a', '/a', '/q')),
+    ('after /p as P until /q: /a {x > @P.x} causes /b within 10 s',
+     ('/p', '/a', '/b', '/q')),
+    ('after /p until /q: /b as B requires /a {x = @B.x}',
+     ('/p', '/a', '/b', '/q')),
+    ('after /p until /q: /a as A forbids /b {x > @A.x + 1} within 10 s',
+     ('/p', '/a', '/b', '/q')),
+)
+
+UNUSED_HOOKS = ('on_enter_scope', 'on_exit_scope')
+
+RUNS = 5
+NUMBER = 5000
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def per_message(cls, cycle):
+    m = cls()
+    m.on_launch(0.0)
+    msg = Msg(x=1.0)
+    callbacks = [m.cb_map[topic] for topic in cycle]
+    def run():
+        t = 1.0
+        for cb in callbacks:
+            cb(msg, t)
+            t += 0.001
+    t = min(timeit.repeat(run, number=NUMBER, repeat=RUNS))
+    assert m.verdict is None
+    return t / (NUMBER * len(callbacks))
+
+def main():
+    p = property_parser()
+    r = TemplateRenderer(preload=True)
+    print('Per-message cost at each optimization level')
+    for text, cycle in PROPERTIES:
+        hp = p.parse(text)
+        print('  {}'.format(text))
+        base = None
+        for level in OPT_LEVELS:
+            options = CodeOptions.from_level(level, unused_hooks=UNUSED_HOOKS)
+            t = per_message(r.build_monitor_class(hp, options=options), cycle)
+            base = base or t
+            print('    -O{}: {:6.3f} us ({:.2f}x)'.format(
+                level, t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of one behaviour message in monitors that search their
+# pool of triggers for a match, for several numbers of buffered triggers,
+# with a linear scan and with pool indices.
+# Covers `requires` properties and `forbids` properties with references.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import sys
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Msg
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+# (property, trigger topic, behaviour topic, behaviour message factory)
+# triggers have ids 0 to n-1 and x = id; behaviour messages match a trigger
+# near the end of the pool (the worst case for a scan), or none at all;
+# prevention monitors must not match, or they would stop at a violation
+PROPERTIES = (
+    ('globally: /b as B requires /a {id = @B.id}',
+     '/a', '/b', lambda n: Msg(id=n - 1, x=0)),
+    ('globally: /b as B requires /a {x > @B.x}',
+     '/a', '/b', lambda n: Msg(id=0, x=n - 2)),
+    ('globally: /b as B requires /a {(x >= @B.x and id = @B.id)}',
+     '/a', '/b', lambda n: Msg(id=n - 1, x=n - 1)),
+    ('globally: /a as A forbids /b {id = @A.id}',
+     '/a', '/b', lambda n: Msg(id=n, x=0)),
+    ('globally: /a as A forbids /b {x < @A.x}',
+     '/a', '/b', lambda n: Msg(id=0, x=n)),
+    ('globally: /a as A forbids /b {(x > @A.x and id = @A.id)}',
+     '/a', '/b', lambda n: Msg(id=n - 1, x=0)),
+)
+
+POOL_SIZES = (10, 1000, 100000)
+
+RUNS = 5
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def per_message(cls, trigger, behaviour, msg, n):
+    m = cls()
+    m.on_launch(0.0)
+    on_trigger = m.cb_map[trigger]
+    for i in range(n):
+        on_trigger(Msg(id=i, x=i), 0.0)
+    on_behaviour = m.cb_map[behaviour]
+    def run():
+        on_behaviour(msg, 1.0)
+    number = max(10, min(10000, 1000000 // n))
+    t = min(timeit.repeat(run, number=number, repeat=RUNS))
+    assert m.verdict is None
+    return t / number
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or POOL_SIZES
+    p = property_parser()
+    r = TemplateRenderer(preload=True)
+    options = CodeOptions(join_indices=True)
+    for text, trigger, behaviour, factory in PROPERTIES:
+        hp = p.parse(text)
+        plain = r.build_monitor_class(hp)
+        indexed = r.build_monitor_class(hp, options=options)
+        print(text)
+        for n in sizes:
+            msg = factory(n)
+            base = per_message(plain, trigger, behaviour, msg, n)
+            t = per_message(indexed, trigger, behaviour, msg, n)
+            print('  {:6} triggers: scan {:10.2f} us, index {:6.2f} us'
+                  ' ({:.1f}x)'.format(n, base * 1e6, t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
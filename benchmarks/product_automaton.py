@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of one /odom message when many reference-free properties
+# consume /odom, with one monitor class per property, a single fused class
+# (`render_fused_monitor`), and a single product automaton class
+# (`render_product_monitor`).
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import sys
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Point
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+# none of these decide a verdict for the benchmark message
+TEMPLATES = (
+    'globally: no /odom {{x > {i}}}',
+    'globally: some /odom {{x > {i} and y > {i}}}',
+    'after /odom {{x > 1}}: no /odom {{sqrt(x * x + y * y) > {i}}}',
+    'globally: /odom {{x > 1}} forbids /odom {{y > {i}}}',
+)
+
+NUM_PROPERTIES = 100
+
+RUNS = 5
+NUMBER = 2000
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+
+def properties(n):
+    p = property_parser()
+    return [p.parse(TEMPLATES[i % len(TEMPLATES)].format(i=1000 + i))
+            for i in range(n)]
+
+def per_message(callbacks):
+    msg = Point(2.0, 3.0)
+    def run():
+        for cb in callbacks:
+            cb(msg, 1.0)
+    t = min(timeit.repeat(run, number=NUMBER, repeat=RUNS))
+    return t / NUMBER
+
+def launched(cls):
+    monitor = cls()
+    monitor.on_launch(0.0)
+    return monitor
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PROPERTIES
+    hps = properties(n)
+    r = TemplateRenderer(preload=True)
+    options = CodeOptions.from_level(3, hoist_accessors=True)
+    print('{} reference-free properties on /odom'.format(n))
+    monitors = [launched(r.build_monitor_class(hp, options=options))
+                for hp in hps]
+    base = per_message([m.on_msg__odom for m in monitors])
+    print('  separate classes (-O3): {:8.2f} us/msg'.format(base * 1e6))
+    fused = launched(r.build_fused_monitor_class(hps, options=options))
+    t = per_message([fused.on_msg__odom])
+    print('  fused class (-O3):      {:8.2f} us/msg ({:.2f}x)'.format(
+        t * 1e6, base / t))
+    product = launched(r.build_product_monitor_class(hps))
+    t = per_message([product.on_msg__odom])
+    print('  product automaton:      {:8.2f} us/msg ({:.2f}x),'
+          ' {} product states'.format(t * 1e6, base / t,
+                                      product.num_product_states))
+
+
+if __name__ == '__main__':
+    main()
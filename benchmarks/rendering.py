@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures how long it takes to render the first monitor of each pattern,
+# starting from a fresh process, with and without the template bytecode cache,
+# and compares it against rendering with an already warm renderer.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import range
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+PROPERTIES = (
+    'globally: no /b {data > 0} within 100 ms',
+    'after /p: some /b {data > 0} within 100 ms',
+    'globally: /b as B requires /a {data < @B.data} within 100 ms',
+    'globally: /b requires /a within 100 ms',
+    'after /p until /q: /a as A causes /b {x < @A.x} within 100 ms',
+    'globally: /a forbids /b within 100 ms',
+)
+
+COLD_START = r'''
+import sys, time
+t0 = time.time()
+from hpl.parser import property_parser
+from hplrv.rendering import TemplateRenderer
+p = property_parser()
+hps = [p.parse(text) for text in {properties!r}]
+t1 = time.time()
+r = TemplateRenderer(bytecode_cache_dir={cache_dir!r}, preload={preload!r})
+for hp in hps:
+    r.render_monitor(hp)
+t2 = time.time()
+sys.stdout.write('{{}}'.format(t2 - t1))
+'''
+
+RUNS = 10
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def cold_start(cache_dir=None, preload=False):
+    code = COLD_START.format(properties=PROPERTIES, cache_dir=cache_dir,
+                             preload=preload)
+    times = []
+    for _ in range(RUNS):
+        out = subprocess.check_output([sys.executable, '-c', code])
+        times.append(float(out))
+    return min(times)
+
+def warm_render():
+    from hpl.parser import property_parser
+    from hplrv.rendering import TemplateRenderer
+    p = property_parser()
+    hps = [p.parse(text) for text in PROPERTIES]
+    r = TemplateRenderer(preload=True)
+    def run():
+        for hp in hps:
+            r.render_monitor(hp)
+    return min(timeit.repeat(run, number=1, repeat=RUNS))
+
+def main():
+    cache_dir = tempfile.mkdtemp(prefix='hplrv-bench-')
+    try:
+        print('Rendering {} monitors (best of {} runs)'.format(
+            len(PROPERTIES), RUNS))
+        t = cold_start()
+        print('  cold start, no cache:           {:8.2f} ms'.format(t * 1000))
+        cold_start(cache_dir=cache_dir) # populate the cache
+        t = cold_start(cache_dir=cache_dir)
+        print('  cold start, bytecode cache:     {:8.2f} ms'.format(t * 1000))
+        t = cold_start(cache_dir=cache_dir, preload=True)
+        print('  cold start, cache + preloading: {:8.2f} ms'.format(t * 1000))
+        t = warm_render()
+        print('  warm renderer:                  {:8.2f} ms'.format(t * 1000))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of one message callback in a generated ROS node with many
+# properties over a few topics, with and without shared predicates.
+# ROS is not needed: `rospy` and the message packages are replaced by
+# minimal placeholder modules (see `_common.py`) before the node code is
+# executed.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import sys
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.rendering import TemplateRenderer
+
+from _common import Point, _install_fake_ros, new_node
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+TOPICS = ('/odom', '/scan', '/cmd', '/status')
+
+# none of these hold for the benchmark message, so monitors stay active
+PREDICATES = (
+    '{x > 0 and y < 10}',
+    '{sqrt(x * x + y * y) < 50}',
+    '{abs(x - y) < 5 or x > 100}',
+    '{cos(x) * y < -70}',
+)
+
+TEMPLATES = (
+    'globally: no {t} {p}',
+    'after {t} {p}: some /status within 10 s',
+    'globally: {t} {p} causes /cmd within 10 s',
+    'after /status until {t} {p}: no /cmd {{x < 0}}',
+)
+
+NUM_PROPERTIES = 80
+
+RUNS = 5
+NUMBER = 2000
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def properties(n):
+    p = property_parser()
+    hps = []
+    for i in range(n):
+        text = TEMPLATES[i % len(TEMPLATES)].format(
+            t=TOPICS[i % len(TOPICS)],
+            p=PREDICATES[(i // len(TEMPLATES)) % len(PREDICATES)])
+        hps.append(p.parse(text))
+    return hps
+
+def per_message(node):
+    msg = Point(-1.0, 60.0)
+    callbacks = [getattr(node, 'on_msg_' + t.replace('/', '_'))
+                 for t in TOPICS]
+    def run():
+        for cb in callbacks:
+            cb(msg)
+    t = min(timeit.repeat(run, number=NUMBER, repeat=RUNS))
+    return t / (NUMBER * len(callbacks))
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PROPERTIES
+    _install_fake_ros()
+    hps = properties(n)
+    topic_types = {t: 'geometry_msgs/Point' for t in TOPICS}
+    r = TemplateRenderer(preload=True)
+    print('Node with {} properties over {} topics'.format(n, len(TOPICS)))
+    base = None
+    for share in (False, True):
+        code = r.render_rospy_node(hps, topic_types, share_predicates=share)
+        t = per_message(new_node(code))
+        base = base or t
+        print('  share_predicates = {!s:5}: {:8.2f} us/msg ({:.2f}x)'.format(
+            share, t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
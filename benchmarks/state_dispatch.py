@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of one message callback with a chain of state tests vs.
+# one handler method per state (`state_dispatch`), for properties whose
+# scope and pattern events all share the same topic, with and without
+# the lock of the monitor.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import sys
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Msg
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+# (property, events of the cycle); each event is followed by IDLE messages
+# that do not change the state, and no verdict is ever reached
+PROPERTIES = (
+    ('after /p {x = 1} until /p {x = 4}: no /p {x > 100}',
+     (1, 4)),
+    ('after /p {x = 1} until /p {x = 4}: /p {x = 2} causes /p {x = 3}',
+     (1, 2, 3, 4)),
+    ('after /p {x = 1} until /p {x = 4}: /p {x = 3} requires /p {x = 2}',
+     (1, 2, 3, 4)),
+    ('after /p {x = 1} until /p {x = 4}: /p {x = 2} forbids /p {x > 100}',
+     (1, 2, 4)),
+)
+
+IDLE = 100
+
+RUNS = 5
+NUMBER = 1000
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def per_message(cls, cycle, idle):
+    m = cls()
+    m.on_launch(0.0)
+    msgs = []
+    for x in cycle:
+        msgs.append(Msg(x=x))
+        msgs.extend(Msg(x=0) for _ in range(idle))
+    def run():
+        # the callback changes with the state, it must be looked up
+        t = 1.0
+        for msg in msgs:
+            m.on_msg__p(msg, t)
+            t += 0.001
+    t = min(timeit.repeat(run, number=NUMBER, repeat=RUNS))
+    assert m.verdict is None
+    return t / (NUMBER * len(msgs))
+
+def main():
+    idle = int(sys.argv[1]) if len(sys.argv) > 1 else IDLE
+    p = property_parser()
+    r = TemplateRenderer(preload=True)
+    print('Per-message cost with state tests and with state handlers'
+          ' ({} idle messages per transition)'.format(idle))
+    for text, cycle in PROPERTIES:
+        hp = p.parse(text)
+        print('  {}'.format(text))
+        for elide_lock in (True, False):
+            plain = CodeOptions(elide_lock=elide_lock)
+            options = plain._replace(state_dispatch=True)
+            base = per_message(r.build_monitor_class(hp, options=plain),
+                               cycle, idle)
+            t = per_message(r.build_monitor_class(hp, options=options),
+                            cycle, idle)
+            lock = 'without lock' if elide_lock else 'with lock'
+            print('    {:<32} {:6.3f} us'.format(
+                'state tests, {}:'.format(lock), base * 1e6))
+            print('    {:<32} {:6.3f} us ({:.2f}x)'.format(
+                'state handlers, {}:'.format(lock), t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
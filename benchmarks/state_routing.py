@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of one message callback in a generated ROS node where
+# most monitors do not care about the message in their current state:
+# after-scopes that were never activated, and properties that already have
+# a verdict. Compares calling every monitor of the topic with calling only
+# those routed to it by their state (`state_routing`).
+# ROS is not needed: `rospy` and the message packages are replaced by
+# minimal placeholder modules before the node code is executed.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import sys
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Point, _install_fake_ros
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+# one of every four properties consumes /odom; the others wait for an
+# activator that never comes, or are falsified by a timeout
+TEMPLATES = (
+    'globally: no /odom {{x > {i}}}',
+    'after /start{i}: no /odom {{x > {i}}}',
+    'after /start{i}: /odom {{x > {i}}} causes /ack within 10 s',
+    'globally: some /ack{i} within 1 s',
+)
+
+NUM_PROPERTIES = 100
+
+RUNS = 5
+NUMBER = 2000
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def properties(n):
+    p = property_parser()
+    return [p.parse(TEMPLATES[i % len(TEMPLATES)].format(i=1000 + i))
+            for i in range(n)]
+
+def new_node(code):
+    namespace = {'__name__': 'hplrv_node'}
+    exec(compile(code, '<node>', 'exec'), namespace)
+    rospy = sys.modules['rospy']
+    rospy.get_time = lambda: 0.0
+    node = namespace['HplMonitorNode']()
+    # launch as `run()` does, but without the timer loop
+    for mon in node.monitors:
+        mon.on_launch(0.0)
+    if hasattr(node, '_reroute'):
+        for i in range(len(node.monitors)):
+            node._reroute(i)
+    # timeouts of `some /ack` properties expire
+    rospy.get_time = lambda: 5.0
+    for i in getattr(node, 'timers', range(len(node.monitors))):
+        mon = node.monitors[i]
+        mon.on_timer(5.0)
+        if hasattr(node, '_reroute'):
+            node._reroute(i)
+    return node
+
+def per_message(node):
+    msg = Point(-1.0, 0.0)
+    cb = node.on_msg__odom
+    t = min(timeit.repeat(lambda: cb(msg), number=NUMBER, repeat=RUNS))
+    return t / NUMBER
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PROPERTIES
+    _install_fake_ros()
+    hps = properties(n)
+    topic_types = {}
+    for hp in hps:
+        for event in hp.events():
+            for e in event.simple_events():
+                topic_types[e.topic] = 'geometry_msgs/Point'
+    r = TemplateRenderer(preload=True)
+    print('Node with {} properties, {} of them on /odom'.format(
+        n, sum(1 for i in range(n) if i % len(TEMPLATES) < 3)))
+    base = None
+    for routing in (False, True):
+        options = CodeOptions(state_routing=routing)
+        code = r.render_rospy_node(hps, topic_types, options=options)
+        t = per_message(new_node(code))
+        base = base or t
+        print('  state_routing = {!s:5}: {:8.2f} us/msg ({:.2f}x)'.format(
+            routing, t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
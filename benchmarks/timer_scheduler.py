@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures the cost of one timer tick over many monitor instances, polling
+# `on_timer` on every monitor vs. firing only the expired deadlines with a
+# TimerScheduler. Each instance has its own trigger time, so that a few
+# deadlines expire on each tick.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import sys
+import timeit
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+from hplrv.timers import TimerScheduler
+
+from _common import Msg
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+PROPERTY = 'globally: /a causes /b within 1 s'
+
+NUM_MONITORS = (1000, 10000, 100000)
+
+# ticks are 1 ms apart; triggers are spread over 10 s
+TICK = 0.001
+SPREAD = 10.0
+TICKS = 200
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def new_monitors(cls, n):
+    msg = Msg()
+    monitors = []
+    for i in range(n):
+        m = cls()
+        m.on_launch(0.0)
+        m.on_msg__a(msg, SPREAD * i / n)
+        monitors.append(m)
+    return monitors
+
+def polling(cls, n):
+    monitors = new_monitors(cls, n)
+    ticks = [1.0 + j * TICK for j in range(TICKS)]
+    def run():
+        for t in ticks:
+            for m in monitors:
+                m.on_timer(t)
+    return min(timeit.repeat(run, number=1, repeat=1)) / TICKS
+
+def scheduled(cls, n):
+    monitors = new_monitors(cls, n)
+    scheduler = TimerScheduler()
+    for m in monitors:
+        scheduler.add(m)
+    ticks = [1.0 + j * TICK for j in range(TICKS)]
+    fired = [0]
+    def run():
+        for t in ticks:
+            fired[0] += scheduler.tick(t)
+    t = min(timeit.repeat(run, number=1, repeat=1)) / TICKS
+    return t, fired[0] / float(TICKS)
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or NUM_MONITORS
+    hp = property_parser().parse(PROPERTY)
+    r = TemplateRenderer(preload=True)
+    plain = r.build_monitor_class(hp)
+    timed = r.build_monitor_class(hp, options=CodeOptions(next_deadline=True))
+    print(PROPERTY)
+    for n in sizes:
+        base = polling(plain, n)
+        t, fired = scheduled(timed, n)
+        print('  {:6} monitors ({:5.1f} expire per tick): poll {:10.2f} us,'
+              ' scheduler {:8.2f} us ({:.1f}x)'.format(
+                  n, fired, base * 1e6, t * 1e6, base / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Measures how the record pool of a monitor copes with 10^5 pending triggers:
+# buffering them (in order and out of order), then expiring them with the
+# timer, with the default `deque` and with `TimestampPool`.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+import random
+import sys
+import time
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from _common import Msg
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+# prevention monitors with references keep an unbounded pool
+PROPERTY = 'globally: /a as A forbids /b {x = @A.x} within 1000 s'
+
+NUM_TRIGGERS = 100000
+
+# out of order triggers arrive up to this many seconds late
+JITTER = 10.0
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+def stamps(n, jitter):
+    rng = random.Random(42)
+    return [i * 0.01 - rng.uniform(0.0, jitter) if jitter else i * 0.01
+            for i in range(n)]
+
+def run(cls, ts):
+    m = cls()
+    m.on_launch(0.0)
+    msgs = [Msg(x=i) for i in range(len(ts))]
+    t0 = time.time()
+    for msg, t in zip(msgs, ts):
+        m.on_msg__a(msg, t)
+    t1 = time.time()
+    # the first tick expires half of the pool, the second one the rest
+    m.on_timer(ts[len(ts) // 2] + 1000.0)
+    m.on_timer(max(ts) + 1000.0)
+    t2 = time.time()
+    assert m.verdict is None and m.is_safe_state
+    return t1 - t0, t2 - t1
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_TRIGGERS
+    p = property_parser()
+    r = TemplateRenderer(preload=True)
+    hp = p.parse(PROPERTY)
+    classes = (
+        ('deque', r.build_monitor_class(hp)),
+        ('TimestampPool', r.build_monitor_class(
+            hp, options=CodeOptions(timestamp_pool=True))),
+    )
+    print('{} pending triggers: {}'.format(n, PROPERTY))
+    for label, jitter in (('in order', 0.0), ('out of order', JITTER)):
+        ts = stamps(n, jitter)
+        print('  {}'.format(label))
+        for name, cls in classes:
+            insert, expire = run(cls, ts)
+            print('    {:14} insert {:8.3f} s   expire {:8.3f} s'.format(
+                name, insert, expire))
+
+
+if __name__ == '__main__':
+    main()
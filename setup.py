@@ -64,6 +64,6 @@ setup(
     #entry_points     = {"console_scripts": ["hplc = hpl.hplc:main"]},
     python_requires  = ">=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, !=3.4.*",
     install_requires = requirements,
-    extras_require   = {},
+    extras_require   = {"numpy": ["numpy"]},
     zip_safe         = False
 )
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, str
+from collections import OrderedDict
+import errno
+import hashlib
+import io
+import marshal
+import os
+import sys
+import tempfile
+from threading import Lock
+
+from . import __version__
+
+
+###############################################################################
+# Cache Keys
+###############################################################################
+
+def property_digest(hpl_property):
+    # Canonical description of everything in a property that can affect
+    # the rendered code: its text, metadata and (refined) message types.
+    parts = [str(hpl_property)]
+    for key in ('id', 'title', 'description'):
+        parts.append('{}={}'.format(key, hpl_property.metadata.get(key)))
+    for event in hpl_property.events():
+        for e in event.simple_events():
+            type_name = getattr(e.msg_type, 'type_name', None)
+            parts.append('{}:{}'.format(e.topic, type_name))
+    return _digest(parts)
+
+def templates_digest(jinja_env):
+    parts = [__version__]
+    for template_file in sorted(jinja_env.list_templates(extensions='jinja')):
+        source, _filename, _uptodate = jinja_env.loader.get_source(
+            jinja_env, template_file)
+        parts.append(template_file)
+        parts.append(source)
+    return _digest(parts)
+
+def render_key(*parts):
+    return _digest(str(part) for part in parts)
+
+def _digest(parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+###############################################################################
+# Rendered Code Cache
+###############################################################################
+
+class RenderCache(object):
+    # Two-tier cache of rendered code, indexed by content-based keys.
+    # The first tier is an in-memory LRU cache, the second tier is optional
+    # and stores one file per key in `cache_dir`, named after the key and
+    # the `suffix` of its kind of text (e.g., '.json' for IR).
+
+    def __init__(self, max_size=1024, cache_dir=None):
+        # max_size: int, maximum number of entries kept in memory
+        # cache_dir: str|None, where to store rendered code
+        if max_size < 1:
+            raise ValueError('max_size must be positive: ' + str(max_size))
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        if cache_dir is not None:
+            _make_dirs(cache_dir)
+
+    def get(self, key, suffix='.py'):
+        with self._lock:
+            text = self._entries.pop(key, None)
+            if text is not None:
+                self._entries[key] = text # most recently used
+                self.hits += 1
+                return text
+        text = self._read_file(key, suffix)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._store(key, text)
+        return text
+
+    def put(self, key, text, suffix='.py'):
+        with self._lock:
+            self._store(key, text)
+        self._write_file(key, text, suffix)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key):
+        return self.contains(key)
+
+    def contains(self, key, suffix='.py'):
+        # `key in cache` only looks for '.py' files in `cache_dir`
+        with self._lock:
+            if key in self._entries:
+                return True
+        return (self.cache_dir is not None
+                and os.path.isfile(self._path(key, suffix)))
+
+    def _store(self, key, text):
+        self._entries.pop(key, None)
+        self._entries[key] = text
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _path(self, key, suffix='.py'):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def _read_file(self, key, suffix):
+        if self.cache_dir is None:
+            return None
+        data = _read_bytes(self._path(key, suffix))
+        return None if data is None else data.decode('utf-8')
+
+    def _write_file(self, key, text, suffix):
+        if self.cache_dir is not None:
+            _write_bytes(self.cache_dir, self._path(key, suffix),
+                         text.encode('utf-8'))
+
+
+###############################################################################
+# Compiled Code Cache
+###############################################################################
+
+class CodeCache(object):
+    # Memoizes the code objects compiled from generated source code,
+    # in an in-memory LRU cache.
+    # Code objects can also be stored in `cache_dir` with `marshal`;
+    # entries are specific to the Python version that compiled them.
+
+    def __init__(self, max_size=1024, cache_dir=None):
+        # max_size: int, maximum number of entries kept in memory
+        # cache_dir: str|None, where to store compiled code
+        if max_size < 1:
+            raise ValueError('max_size must be positive: ' + str(max_size))
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        if cache_dir is not None:
+            _make_dirs(cache_dir)
+
+    def compile(self, source, filename='<hplrv>'):
+        key = _digest((sys.version, filename, source))
+        with self._lock:
+            code = self._entries.pop(key, None)
+            if code is not None:
+                self._entries[key] = code # most recently used
+                return code
+        code = self._read_file(key)
+        if code is None:
+            code = compile(source, filename, 'exec')
+            self._write_file(key, code)
+        with self._lock:
+            self._entries[key] = code
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return code
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.marshal')
+
+    def _read_file(self, key):
+        if self.cache_dir is None:
+            return None
+        data = _read_bytes(self._path(key))
+        if data is None:
+            return None
+        try:
+            return marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return None # corrupted entry, will be overwritten
+
+    def _write_file(self, key, code):
+        if self.cache_dir is not None:
+            _write_bytes(self.cache_dir, self._path(key), marshal.dumps(code))
+
+
+###############################################################################
+# Helper Functions
+###############################################################################
+
+def _read_bytes(path):
+    try:
+        with io.open(path, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+def _write_bytes(dir_path, path, data):
+    # write to a temporary file first, so that concurrent processes
+    # never see a partially written entry
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix='.tmp')
+    try:
+        with io.open(fd, 'wb') as f:
+            f.write(data)
+        _replace(tmp_path, path)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _replace(src, dst):
+    # os.replace, for Python 2; os.rename does not overwrite on Windows,
+    # so other processes may briefly miss the entry there
+    replace = getattr(os, 'replace', None)
+    if replace is not None:
+        return replace(src, dst)
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+def _make_dirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Fan-out of messages and timer ticks to many monitors, for event sources
+# other than ROS (e.g., local queues, simulators or log files).
+# Works with anything that has a `cb_map`: generated monitor classes, fused
+# and product monitors, and interpreted monitors (`hplrv.generic_monitor`).
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object
+from threading import Lock
+
+
+###############################################################################
+# Monitor Set
+###############################################################################
+
+class MonitorSet(object):
+    # Monitors, and a table from each topic to the callbacks of the monitors
+    # that consume it, built from their `cb_map` when monitors are added or
+    # removed. Messages of topics that no monitor consumes cost one lookup.
+    # Monitors generated with `state_dispatch` replace their callbacks on
+    # every state transition, so their `cb_map` is read on every message,
+    # after the callbacks of the other monitors.
+    # Tables are replaced, never modified, so `dispatch` does not need the
+    # lock of the set; monitors still rely on their own locks, if any.
+    # Time is whatever the monitors are fed with: wall-clock or simulated.
+
+    def __init__(self, monitors=()):
+        self._lock = Lock()
+        self.monitors = ()
+        self._routes = {}   # topic -> ((callback,), (cb_map,))
+        self._timed = ()    # monitors with `next_deadline`
+        self._polled = ()   # monitors without `next_deadline`
+        self.add(*monitors)
+
+    @property
+    def topics(self):
+        return tuple(self._routes)
+
+    def add(self, *monitors):
+        with self._lock:
+            self._build(self.monitors + monitors)
+
+    def remove(self, monitor):
+        with self._lock:
+            if monitor not in self.monitors:
+                raise ValueError('monitor is not in the set')
+            self._build(tuple(m for m in self.monitors if m is not monitor))
+
+    def on_launch(self, stamp):
+        for monitor in self.monitors:
+            monitor.on_launch(stamp)
+        return True
+
+    def on_shutdown(self, stamp):
+        for monitor in self.monitors:
+            monitor.on_shutdown(stamp)
+        return True
+
+    def dispatch(self, topic, msg, stamp):
+        # returns the number of monitors that received the message
+        route = self._routes.get(topic)
+        if route is None:
+            return 0
+        callbacks, cb_maps = route
+        for cb in callbacks:
+            cb(msg, stamp)
+        for cb_map in cb_maps:
+            cb_map[topic](msg, stamp)
+        return len(callbacks) + len(cb_maps)
+
+    def dispatch_batch(self, events):
+        # events: iterable of (topic, msg, stamp), in order
+        # returns the number of callback calls
+        routes = self._routes
+        n = 0
+        for topic, msg, stamp in events:
+            route = routes.get(topic)
+            if route is None:
+                continue
+            callbacks, cb_maps = route
+            for cb in callbacks:
+                cb(msg, stamp)
+            for cb_map in cb_maps:
+                cb_map[topic](msg, stamp)
+            n += len(callbacks) + len(cb_maps)
+        return n
+
+    def tick(self, stamp):
+        # calls `on_timer(stamp)` on the monitors without `next_deadline`,
+        # and on those whose deadline expired; returns the number of calls
+        # (see `hplrv.timers.TimerScheduler` for very large sets)
+        polled = self._polled
+        for monitor in polled:
+            monitor.on_timer(stamp)
+        n = len(polled)
+        for monitor in self._timed:
+            deadline = monitor.next_deadline
+            if deadline is not None and deadline <= stamp:
+                monitor.on_timer(stamp)
+                n += 1
+        return n
+
+    def __len__(self):
+        return len(self.monitors)
+
+    def __iter__(self):
+        return iter(self.monitors)
+
+    def __contains__(self, monitor):
+        return monitor in self.monitors
+
+    def _build(self, monitors):
+        callbacks = {}
+        cb_maps = {}
+        for monitor in monitors:
+            # with state_dispatch, the callbacks are slots of the monitor
+            volatile = any(name.startswith('on_msg_') for name in
+                           getattr(type(monitor), '__slots__', ()))
+            for topic, cb in monitor.cb_map.items():
+                callbacks.setdefault(topic, [])
+                cb_maps.setdefault(topic, [])
+                if volatile:
+                    cb_maps[topic].append(monitor.cb_map)
+                else:
+                    callbacks[topic].append(cb)
+        self._routes = {topic: (tuple(callbacks[topic]),
+                                tuple(cb_maps[topic]))
+                        for topic in callbacks}
+        self._timed = tuple(m for m in monitors
+                            if hasattr(type(m), 'next_deadline'))
+        self._polled = tuple(m for m in monitors
+                             if not hasattr(type(m), 'next_deadline'))
+        self.monitors = monitors
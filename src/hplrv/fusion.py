@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Fusion of the monitor classes of many properties into a single class,
+# with one lock and one message callback per topic.
+# Each property keeps its own state, pool and witness, renamed with a
+# `_p<i>` suffix. The message callbacks of all properties are inlined,
+# one after the other, into the fused callback of their topic; since
+# there is no method to return from, their `return` statements are
+# replaced with `else` branches (and `break`, within loops).
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, range, str
+import re
+
+
+###############################################################################
+# Class Parsing
+###############################################################################
+
+# slots that the fused class has only once, for all properties
+_SHARED_SLOTS = frozenset(('_lock', 'on_enter_scope', 'on_exit_scope',
+                           'on_violation', 'on_success', 'cb_map'))
+
+# methods that the fused class has of its own, or takes over renamed;
+# any other method of a monitor class cannot be fused
+_KNOWN_METHODS = frozenset(('__init__', 'verdict', 'is_online_state',
+                            'is_inactive_state', 'is_active_state',
+                            'is_safe_state', 'is_falsifiable_state',
+                            'next_deadline', 'on_launch', 'on_shutdown',
+                            'on_timer', '_reset', '_pool_insert', '_noop'))
+
+_SLOT = re.compile(r"^\s*'(\w+)',")
+_CONSTANT = re.compile(r'^    (\w+) = ')
+_METHOD = re.compile(r'^    def (\w+)\(self(.*)\):$')
+_CALLBACK = re.compile(r"^\s*'([^']*)': self\.(\w+),$")
+_HOOK = re.compile(r'\bself\.(on_enter_scope|on_exit_scope|on_violation|'
+                   r'on_success)\(')
+
+
+class MonitorClass(object):
+    # The parts of a rendered monitor class, as lists of lines.
+    __slots__ = ('slots', 'constants', 'methods', 'topics')
+
+    def __init__(self, text):
+        self.slots = []
+        self.constants = [] # [(name, lines)]
+        self.methods = {}   # name -> (args, body lines)
+        self.topics = []    # [(topic, method name)], from `cb_map`
+        lines = text.split('\n')
+        i = 1 # skip the class statement
+        while i < len(lines):
+            line = lines[i]
+            i += 1
+            if not line.strip() or line == '    @property':
+                continue
+            if line == '    __slots__ = (':
+                while lines[i] != '    )':
+                    match = _SLOT.match(lines[i])
+                    if match:
+                        self.slots.append(match.group(1))
+                    i += 1
+                i += 1
+                continue
+            match = _METHOD.match(line)
+            if match:
+                body = []
+                while i < len(lines) and (not lines[i].strip()
+                                          or lines[i].startswith(' ' * 8)):
+                    body.append(lines[i])
+                    i += 1
+                while body and not body[-1].strip():
+                    body.pop()
+                self.methods[match.group(1)] = (match.group(2), body)
+                continue
+            match = _CONSTANT.match(line)
+            if match:
+                # constants may span lines within triple-quoted strings
+                chunk = [line]
+                while sum(s.count("'''") for s in chunk) % 2 == 1:
+                    chunk.append(lines[i])
+                    i += 1
+                self.constants.append((match.group(1), chunk))
+                continue
+            raise ValueError('unexpected line in monitor class: ' + line)
+        for line in self.methods['__init__'][1]:
+            match = _CALLBACK.match(line)
+            if match:
+                self.topics.append(match.groups())
+
+
+###############################################################################
+# Fused Properties
+###############################################################################
+
+class FusedProperty(object):
+    # The members of one property within a fused class, renamed.
+    # index: int, position of the property in the fused class
+    # slots: [str], instance attributes
+    # constants: str, class attributes, indented by 4
+    # init: str, statements of `__init__`, indented by 8
+    # methods: str, helper methods (`_reset_p<i>`, `_on_launch_p<i>`, ...)
+    # timed: bool, whether `on_timer` does something
+    # callbacks: {topic: str}, inlined message callbacks, not indented
+    # members: [str], the state and the pool, which batch callbacks read
+    #   from locals
+    __slots__ = ('index', 'slots', 'constants', 'init', 'methods', 'timed',
+                 'callbacks', 'members')
+
+    def __init__(self, index, text):
+        self.index = index
+        cls = MonitorClass(text)
+        suffix = '_p{}'.format(index)
+        own = [name for name in cls.slots if name not in _SHARED_SLOTS]
+        helpers = [name for name in ('_reset', '_pool_insert')
+                   if name in cls.methods]
+        names = own + helpers + [name for name, _ in cls.constants]
+        member = re.compile(r'\bself\.({})\b'.format(
+            '|'.join(sorted(names, key=len, reverse=True))))
+        hook = 'self.\\g<1>({}, '.format(index)
+        def rename(line):
+            return _HOOK.sub(hook, member.sub('self.\\g<1>' + suffix, line))
+        self.slots = [name + suffix for name in own]
+        self.members = [name + suffix for name in ('_state', '_pool')
+                        if name in own]
+        self.constants = '\n'.join(
+            line.replace(' = ', suffix + ' = ', 1) if j == 0 else line
+            for _, chunk in cls.constants for j, line in enumerate(chunk))
+        self.init = '\n'.join(rename(line)
+            for line in _init_lines(cls.methods['__init__'][1]))
+        timer = cls.methods['on_timer'][1][:-1] # drops `return True`
+        self.timed = bool(timer)
+        methods = [('_on_launch', 'on_launch'), ('_on_shutdown', 'on_shutdown')]
+        if self.timed:
+            methods.append(('_on_timer', 'on_timer'))
+            if 'next_deadline' in cls.methods:
+                methods.append(('_next_deadline', 'next_deadline'))
+        methods.extend((name, name) for name in helpers)
+        chunks = []
+        for new_name, name in methods:
+            args, body = cls.methods[name]
+            chunk = ['    def {}{}(self{}):'.format(new_name, suffix, args)]
+            chunk.extend(rename(line) for line in body)
+            chunks.append('\n'.join(chunk))
+        self.methods = '\n\n'.join(chunks)
+        callbacks = set(name for _, name in cls.topics)
+        for name in cls.methods:
+            if name not in _KNOWN_METHODS and name not in callbacks:
+                raise ValueError('cannot fuse method ' + name)
+        self.callbacks = {}
+        for topic, name in cls.topics:
+            args, body = cls.methods[name]
+            if args != ', msg, stamp':
+                raise ValueError('cannot fuse {}(self{})'.format(name, args))
+            if body[:len(timer)] != timer:
+                raise ValueError('unexpected timer code in ' + name)
+            code = [rename(line) for line in timer]
+            code.extend(inline_callback([rename(line)
+                                         for line in body[len(timer):]]))
+            self.callbacks[topic] = '\n'.join(line[8:] for line in code)
+
+
+def _init_lines(body):
+    # the statements of `__init__` that concern the property alone
+    in_map = False
+    for line in body:
+        code = line.strip()
+        if in_map:
+            in_map = code != '}'
+        elif code.startswith('self.cb_map = '):
+            in_map = code.endswith('{')
+        elif not code.startswith(('self._lock = ', 'self.on_')):
+            yield line
+
+
+###############################################################################
+# Return Elimination
+###############################################################################
+
+# what falling off the end of a transformed block means in the original
+# code: it did not return (NEVER), it returned (ALWAYS), or either
+NEVER = 0
+SOMETIMES = 1
+ALWAYS = 2
+
+_HEADER = re.compile(r'^(if|elif|else|for|while)\b.*:(\s*#.*)?$')
+_STATE_TEST = re.compile(r'^if self\._state(?:_p\d+)? == -?\d+:$')
+
+
+class _Statement(object):
+    __slots__ = ('code', 'body')
+
+    def __init__(self, code, body=None):
+        self.code = code # str, without indentation
+        self.body = body # [_Statement]|None, for block openers
+
+
+def inline_callback(lines):
+    # lines: the body of a message callback, after the timer code,
+    #   indented by 8, ending with `return False`
+    # Returns the same code without `return` statements.
+    # The callback tests the state once per branch, and each branch
+    # returns after a transition, so at most one branch runs; they are
+    # turned into an `elif` chain, which also skips the remaining tests.
+    block = _parse(lines)
+    first = True
+    for stmt in block:
+        if _STATE_TEST.match(stmt.code):
+            if not first:
+                stmt.code = 'el' + stmt.code
+            first = False
+        elif not stmt.code.startswith('#'):
+            first = True
+    block, _ = _eliminate(block, False)
+    result = []
+    _unparse(block, 8, result)
+    return result
+
+
+def inline_returns(text):
+    # Jinja filter, `inline_callback` for a block of text
+    lines = inline_callback(text.split('\n'))
+    if text.endswith('\n'):
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def _parse(lines):
+    block = []
+    stack = [(-1, block)]
+    for line in lines:
+        code = line.lstrip()
+        if not code:
+            continue
+        indent = len(line) - len(code)
+        while indent <= stack[-1][0]:
+            stack.pop()
+        if _HEADER.match(code):
+            stmt = _Statement(code, [])
+            stack[-1][1].append(stmt)
+            stack.append((indent, stmt.body))
+        else:
+            stack[-1][1].append(_Statement(code))
+    return block
+
+
+def _unparse(block, indent, result):
+    for stmt in block:
+        result.append(' ' * indent + stmt.code)
+        if stmt.body is not None:
+            _unparse(stmt.body, indent + 4, result)
+            if not _has_code(stmt.body):
+                result.append(' ' * (indent + 4) + 'pass')
+
+
+def _has_code(block):
+    for stmt in block:
+        code = stmt.code
+        if not (code.startswith('#') or code == 'pass'
+                or code.startswith(('pass ', 'pass#'))):
+            return True
+    return False
+
+
+def _is_return(code):
+    return code == 'return' or code.startswith(('return ', 'return#'))
+
+
+def _merge(statuses):
+    if all(s == ALWAYS for s in statuses):
+        return ALWAYS
+    if all(s == NEVER for s in statuses):
+        return NEVER
+    return SOMETIMES
+
+
+def _eliminate(block, in_loop):
+    # Returns the transformed block and its status.
+    # Within a loop, `return` becomes `break`, and the statements that
+    # follow the loop move into its `else` branch.
+    # Elsewhere, the statements that follow a branching statement move
+    # into the branches that did not return; this requires that at most
+    # one branch does not return, or that nothing follows.
+    result = []
+    breaks = NEVER
+    i = 0
+    while i < len(block):
+        stmt = block[i]
+        i += 1
+        if _is_return(stmt.code):
+            if in_loop:
+                result.append(_Statement('break'))
+            return result, ALWAYS # anything after it is dead code
+        if stmt.body is None:
+            result.append(stmt)
+            continue
+        if stmt.code.startswith(('for ', 'while ')):
+            body, status = _eliminate(stmt.body, True)
+            result.append(_Statement(stmt.code, body))
+            if status == NEVER:
+                continue
+            if in_loop:
+                raise ValueError('cannot fuse nested loops with returns')
+            rest, status = _eliminate(block[i:], False)
+            if _has_code(rest):
+                result.append(_Statement('else:', rest))
+            return result, _merge((ALWAYS, status))
+        # if-elif-else chain; comments between branches go to the former
+        chain = [_Statement(stmt.code, list(stmt.body))]
+        j = i
+        while j < len(block):
+            code = block[j].code
+            if code.startswith('#'):
+                j += 1
+            elif code.startswith(('elif ', 'else:')):
+                chain[-1].body.extend(block[i:j])
+                chain.append(_Statement(code, list(block[j].body)))
+                i = j = j + 1
+            else:
+                break
+        branches = [_eliminate(s.body, in_loop) for s in chain]
+        statuses = [status for _, status in branches]
+        if not chain[-1].code.startswith('else:'):
+            statuses.append(NEVER)
+        chain = [_Statement(s.code, body)
+                 for s, (body, _) in zip(chain, branches)]
+        # conditions have no side effects
+        empty = not any(_has_code(s.body) for s in chain)
+        if in_loop or all(s == NEVER for s in statuses):
+            if not empty:
+                result.extend(chain)
+            breaks = _merge((breaks, _merge(statuses)))
+            continue
+        rest, status = _eliminate(block[i:], False)
+        if not _has_code(rest):
+            if not empty:
+                result.extend(chain)
+            return result, _merge([status if s == NEVER else s
+                                   for s in statuses])
+        if SOMETIMES in statuses or statuses.count(NEVER) != 1:
+            raise ValueError('cannot fuse code with complex returns')
+        j = statuses.index(NEVER)
+        if j == len(chain):
+            chain.append(_Statement('else:', rest))
+        else:
+            chain[j].body.extend(rest)
+        result.extend(chain)
+        return result, _merge((ALWAYS, status))
+    return result, breaks
@@ -0,0 +1,629 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# A monitor engine that interprets the IR of a property (see `hplrv.ir`)
+# instead of rendering and executing Python code for it.
+# `MonitorProgram` compiles the IR once, turning expressions into closures,
+# and can be shared by any number of `StateMachineMonitor` instances. The
+# monitors have the same interface and behaviour as the generated classes,
+# without assertions. They are slower per message, but much faster to
+# create, since there is no template to render and no code to compile.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, range, str
+from collections import deque
+from functools import partial
+from math import asin, atan2, log10
+from operator import attrgetter
+import operator
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+from .constants import (
+    STATE_ACTIVE, STATE_FALSE, STATE_INACTIVE, STATE_OFF, STATE_SAFE,
+    STATE_TRUE
+)
+from .ir import check_version
+from .monitors import build_ir
+from .runtime import Lock, MsgRecord, TimestampPool, monitor_globals
+
+
+###############################################################################
+# Expressions
+###############################################################################
+
+# every expression compiles to a function of the current message and of a
+# dict with the values of variables (aliases and quantified variables)
+
+_INFIX = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': getattr(operator, 'div', operator.truediv),
+    '**': operator.pow,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '!=': operator.ne,
+    '=': operator.eq,
+    'in': lambda a, b: a in b,
+    'iff': operator.is_,
+}
+
+_RENAMED_FUNCTIONS = {'deg': 'degrees', 'rad': 'radians'}
+
+# field chains of the x, y and z functions, by message type
+_POSITION = {
+    'geometry_msgs/PointStamped': 'point.',
+    'geometry_msgs/Pose': 'position.',
+    'geometry_msgs/PoseStamped': 'pose.position.',
+    'geometry_msgs/PoseWithCovariance': 'pose.position.',
+    'geometry_msgs/PoseWithCovarianceStamped': 'pose.pose.position.',
+    'geometry_msgs/QuaternionStamped': 'quaternion.',
+    'geometry_msgs/Transform': 'translation.',
+    'geometry_msgs/TransformStamped': 'transform.translation.',
+}
+
+# field chains of the roll, pitch and yaw functions, by message type
+_ORIENTATION = {
+    'geometry_msgs/Pose': 'orientation.',
+    'geometry_msgs/PoseStamped': 'pose.orientation.',
+    'geometry_msgs/PoseWithCovariance': 'pose.orientation.',
+    'geometry_msgs/PoseWithCovarianceStamped': 'pose.pose.orientation.',
+    'geometry_msgs/QuaternionStamped': 'quaternion.',
+    'geometry_msgs/Transform': 'rotation.',
+    'geometry_msgs/TransformStamped': 'transform.rotation.',
+}
+
+_ROTATIONS = {
+    'roll': lambda w, x, y, z: atan2(2.0 * (z * y + w * x),
+                                     1.0 - 2.0 * (x * x + y * y)),
+    'pitch': lambda w, x, y, z: asin(2.0 * (y * w - z * x)),
+    'yaw': lambda w, x, y, z: atan2(2.0 * (z * w + x * y),
+                                    -1.0 + 2.0 * (w * w + x * x)),
+}
+
+_GLOBALS = monitor_globals()
+
+
+def compile_expression(expr):
+    # expr: Expression IR
+    # returns a function (msg, env) -> value
+    kind = expr['kind']
+    if kind == 'literal':
+        value = expr['value']
+        return lambda m, e: value
+    if kind == 'this':
+        return lambda m, e: m
+    if kind == 'var':
+        name = expr['name']
+        return lambda m, e: e[name]
+    if kind == 'field':
+        return _compile_field(expr)
+    if kind == 'index':
+        array = compile_expression(expr['array'])
+        index = expr['index']
+        if index['kind'] == 'literal':
+            i = index['value']
+            return lambda m, e: array(m, e)[i]
+        index = compile_expression(index)
+        return lambda m, e: array(m, e)[index(m, e)]
+    if kind == 'set':
+        values = [compile_expression(v) for v in expr['values']]
+        return lambda m, e: tuple(f(m, e) for f in values)
+    if kind == 'range':
+        lo = compile_expression(expr['min'])
+        hi = compile_expression(expr['max'])
+        a = 1 if expr['exclude_min'] else 0
+        b = 0 if expr['exclude_max'] else 1
+        return lambda m, e: range(int(lo(m, e)) + a, int(hi(m, e)) + b)
+    if kind == 'unary':
+        return _compile_unary(expr)
+    if kind == 'binary':
+        return _compile_binary(expr)
+    if kind == 'call':
+        return _compile_call(expr)
+    if kind == 'quantifier':
+        return _compile_quantifier(expr)
+    raise ValueError('unsupported expression: ' + str(kind))
+
+def _compile_field(expr):
+    # chains of fields over the message are read with a single attrgetter
+    fields = []
+    while expr['kind'] == 'field':
+        fields.append(expr['field'])
+        expr = expr['object']
+    getter = attrgetter('.'.join(reversed(fields)))
+    if expr['kind'] == 'this':
+        return lambda m, e: getter(m)
+    obj = compile_expression(expr)
+    return lambda m, e: getter(obj(m, e))
+
+def _compile_unary(expr):
+    op = expr['operator']
+    a = compile_expression(expr['operand'])
+    if op == '-':
+        return lambda m, e: -a(m, e)
+    if op == 'not':
+        return lambda m, e: not a(m, e)
+    raise ValueError('unsupported operator: ' + op)
+
+def _compile_binary(expr):
+    op = expr['operator']
+    x, y = expr['operands']
+    a = compile_expression(x)
+    if op == 'in' and y['kind'] == 'range':
+        lo = compile_expression(y['min'])
+        hi = compile_expression(y['max'])
+        lop = operator.gt if y['exclude_min'] else operator.ge
+        hop = operator.lt if y['exclude_max'] else operator.le
+        def in_range(m, e):
+            v = a(m, e)
+            return lop(v, lo(m, e)) and hop(v, hi(m, e))
+        return in_range
+    b = compile_expression(y)
+    if op == 'and':
+        return lambda m, e: a(m, e) and b(m, e)
+    if op == 'or':
+        return lambda m, e: a(m, e) or b(m, e)
+    if op == 'implies':
+        return lambda m, e: not a(m, e) or b(m, e)
+    f = _INFIX.get(op) if expr['infix'] else _function(op)
+    if f is None:
+        raise ValueError('unsupported operator: ' + op)
+    if y['kind'] == 'literal':
+        c = y['value']
+        return lambda m, e: f(a(m, e), c)
+    return lambda m, e: f(a(m, e), b(m, e))
+
+def _compile_call(expr):
+    name = expr['function']
+    args = expr['arguments']
+    if name in ('x', 'y', 'z'):
+        prefix = _POSITION.get(args[0].get('ros_type'), '')
+        return _compile_path(args[0], prefix + name)
+    if name in _ROTATIONS:
+        rotation = _ROTATIONS[name]
+        if len(args) == 1:
+            prefix = _ORIENTATION.get(args[0].get('ros_type'), '')
+            w, x, y, z = (_compile_path(args[0], prefix + c) for c in 'wxyz')
+        else:
+            w, x, y, z = (compile_expression(arg) for arg in args)
+        return lambda m, e: rotation(w(m, e), x(m, e), y(m, e), z(m, e))
+    if name == 'log':
+        base = args[1]
+        a = compile_expression(args[0])
+        if base['kind'] == 'literal' and base['value'] == 10:
+            return lambda m, e: log10(a(m, e))
+    f = _function(_RENAMED_FUNCTIONS.get(name, name))
+    if f is None:
+        raise ValueError('unsupported function: ' + name)
+    fs = [compile_expression(arg) for arg in args]
+    if len(fs) == 1:
+        a = fs[0]
+        return lambda m, e: f(a(m, e))
+    return lambda m, e: f(*[g(m, e) for g in fs])
+
+def _compile_path(expr, path):
+    getter = attrgetter(path)
+    obj = compile_expression(expr)
+    return lambda m, e: getter(obj(m, e))
+
+def _compile_quantifier(expr):
+    var = expr['variable']
+    domain = compile_expression(expr['domain'])
+    condition = compile_expression(expr['condition'])
+    check = all if expr['quantifier'] == 'forall' else any
+    array = expr['array']
+    def quantifier(m, e):
+        values = domain(m, e)
+        if array:
+            values = range(len(values))
+        e = dict(e)
+        def holds(v):
+            e[var] = v
+            return condition(m, e)
+        return check(holds(v) for v in values)
+    return quantifier
+
+def _function(name):
+    f = _GLOBALS.get(name)
+    if f is None:
+        f = getattr(builtins, name, None)
+    return f if callable(f) else None
+
+
+###############################################################################
+# Compiled Programs
+###############################################################################
+
+_VERDICTS = {STATE_TRUE: True, STATE_FALSE: False}
+
+
+class Transition(object):
+    # A compiled IR transition (see `hplrv.ir`).
+    __slots__ = ('predicate', 'activator', 'trigger', 'pool', 'dependent',
+                 'actions', 'target', 'scope')
+
+    def __init__(self, data):
+        self.predicate = _compile_predicate(data['predicate'])
+        self.activator = data['activator']
+        self.trigger = data['trigger']
+        self.pool = data['pool']
+        self.dependent = {topic: compile_expression(phi)
+                          for topic, phi in data['dependent'].items()}
+        self.actions = tuple(_ACTIONS[a] for a in data['actions'])
+        self.target = data['target']
+        self.scope = data['scope']
+
+
+class Timer(object):
+    # A compiled IR timer (see `hplrv.ir`).
+    __slots__ = ('state', 'clock', 'actions', 'target', 'when_empty')
+
+    def __init__(self, data):
+        self.state = data['state']
+        self.clock = data['clock']
+        self.actions = tuple(_ACTIONS[a] for a in data['actions'])
+        self.target = data['target']
+        self.when_empty = data['when_empty']
+
+
+class MonitorProgram(object):
+    # The IR of a property, compiled for `StateMachineMonitor`.
+    # on_msg: {topic: {state: (Transition,)}}
+    __slots__ = ('prop_id', 'prop_title', 'prop_desc', 'hpl_property',
+                 'initial_state', 'launch_enters_scope', 'timeout',
+                 'pool_size', 'on_msg', 'on_timer', 'topics')
+
+    def __init__(self, ir):
+        check_version(ir)
+        prop = ir['property']
+        self.prop_id = str(prop['id'])
+        self.prop_title = prop['title'] or 'HPL Property'
+        self.prop_desc = prop['description'] or ''
+        self.hpl_property = prop['text']
+        self.initial_state = ir['initial_state']
+        self.launch_enters_scope = ir['launch_enters_scope']
+        self.timeout = ir['timeout']
+        self.pool_size = ir['pool']['size']
+        self.on_msg = {}
+        for topic, handlers in ir['on_msg'].items():
+            self.on_msg[topic] = {
+                h['state']: tuple(Transition(t) for t in h['transitions'])
+                for h in handlers}
+        self.on_timer = tuple(Timer(t) for t in ir['on_timer'])
+        self.topics = tuple(ir['on_msg'])
+
+    @classmethod
+    def from_property(cls, hpl_property, cache=None):
+        # cache: RenderCache|None, for the IR (see `build_ir`)
+        return cls(build_ir(hpl_property, cache=cache))
+
+    def new_pool(self):
+        if self.pool_size < 0:
+            return TimestampPool()
+        return deque((), self.pool_size)
+
+
+def _compile_predicate(data):
+    if data['kind'] == 'literal':
+        return bool(data['value']) # always or never fires
+    return compile_expression(data)
+
+
+###############################################################################
+# Actions
+###############################################################################
+
+# functions of (monitor, topic, stamp, msg, matched record)
+
+def _witness_append(mon, topic, stamp, msg, rec):
+    mon.witness.append(MsgRecord(topic, stamp, msg))
+
+def _witness_clear(mon, topic, stamp, msg, rec):
+    mon.witness = []
+
+def _pool_add(mon, topic, stamp, msg, rec):
+    rec = MsgRecord(topic, stamp, msg)
+    if mon._program.pool_size < 0:
+        mon._pool.add(rec)
+    else:
+        mon._pool.append(rec)
+
+def _pool_clear(mon, topic, stamp, msg, rec):
+    mon._pool.clear()
+
+def _pool_to_witness(mon, topic, stamp, msg, rec):
+    mon.witness.extend(mon._pool)
+    mon._pool.clear()
+
+def _match_to_witness(mon, topic, stamp, msg, rec):
+    mon.witness.append(rec)
+
+def _pool_drop_head(mon, topic, stamp, msg, rec):
+    mon._pool.popleft()
+
+def _pool_head_to_witness(mon, topic, stamp, msg, rec):
+    mon.witness.append(mon._pool.popleft())
+
+def _pool_expire(mon, topic, stamp, msg, rec):
+    pool = mon._pool
+    timeout = mon._program.timeout
+    if isinstance(pool, TimestampPool):
+        pool.expire(stamp, timeout)
+    else:
+        while pool and (stamp - pool[0].timestamp) >= timeout:
+            pool.popleft()
+
+_ACTIONS = {
+    'witness_append': _witness_append,
+    'witness_clear': _witness_clear,
+    'pool_add': _pool_add,
+    'pool_clear': _pool_clear,
+    'pool_to_witness': _pool_to_witness,
+    'match_to_witness': _match_to_witness,
+    'pool_drop_head': _pool_drop_head,
+    'pool_head_to_witness': _pool_head_to_witness,
+    'pool_expire': _pool_expire,
+}
+
+
+###############################################################################
+# Monitor
+###############################################################################
+
+# results of trying a transition: it did not fire, and the next one is
+# tried (None); it fired (True); or processing stops without firing (False)
+
+class StateMachineMonitor(object):
+    __slots__ = (
+        '_lock',          # concurrency control
+        '_state',         # currently active state
+        '_pool',          # MsgRecord pool to hold temporary records
+        '_program',       # MonitorProgram
+        'witness',        # MsgRecord list of observed events
+        'on_enter_scope', # callback upon entering the scope
+        'on_exit_scope',  # callback upon exiting the scope
+        'on_violation',   # callback upon verdict of False
+        'on_success',     # callback upon verdict of True
+        'time_launch',    # when was the monitor launched
+        'time_shutdown',  # when was the monitor shutdown
+        'time_state',     # when did the last state transition occur
+        'cb_map',         # mapping of topic names to callback functions
+    )
+
+    def __init__(self, program):
+        # program: MonitorProgram, or IR to compile
+        if not isinstance(program, MonitorProgram):
+            program = MonitorProgram(program)
+        self._program = program
+        self._lock = Lock()
+        self._reset()
+        self.on_enter_scope = self._noop
+        self.on_exit_scope = self._noop
+        self.on_violation = self._noop
+        self.on_success = self._noop
+        self._state = STATE_OFF
+        self.cb_map = {topic: partial(self.on_msg, topic)
+                       for topic in program.topics}
+
+    @classmethod
+    def from_property(cls, hpl_property):
+        return cls(MonitorProgram.from_property(hpl_property))
+
+    @property
+    def PROP_ID(self):
+        return self._program.prop_id
+
+    @property
+    def PROP_TITLE(self):
+        return self._program.prop_title
+
+    @property
+    def PROP_DESC(self):
+        return self._program.prop_desc
+
+    @property
+    def HPL_PROPERTY(self):
+        return self._program.hpl_property
+
+    @property
+    def verdict(self):
+        # with self._lock:
+        return _VERDICTS.get(self._state)
+
+    @property
+    def is_online_state(self):
+        # with self._lock:
+        return self._state != STATE_OFF
+
+    @property
+    def is_inactive_state(self):
+        # with self._lock:
+        return self._state == STATE_INACTIVE
+
+    @property
+    def is_active_state(self):
+        # with self._lock:
+        return self._state == STATE_ACTIVE
+
+    @property
+    def is_safe_state(self):
+        # with self._lock:
+        return self._state == STATE_SAFE
+
+    @property
+    def is_falsifiable_state(self):
+        # with self._lock:
+        return self._state == STATE_ACTIVE
+
+    @property
+    def next_deadline(self):
+        # earliest stamp at which on_timer may change something, or None
+        with self._lock:
+            for timer in self._program.on_timer:
+                if self._state != timer.state:
+                    continue
+                if timer.clock == 'state':
+                    return self.time_state + self._program.timeout
+                if self._pool:
+                    return self._pool[0].timestamp + self._program.timeout
+        return None
+
+    def on_launch(self, stamp):
+        with self._lock:
+            if self._state != STATE_OFF:
+                raise RuntimeError('monitor is already turned on')
+            self._reset()
+            self.time_launch = stamp
+            self._state = self._program.initial_state
+            self.time_state = stamp
+            if self._program.launch_enters_scope:
+                self.on_enter_scope(stamp)
+        return True
+
+    def on_shutdown(self, stamp):
+        with self._lock:
+            if self._state == STATE_OFF:
+                raise RuntimeError('monitor is already turned off')
+            self.time_shutdown = stamp
+            self._state = STATE_OFF
+            self.time_state = stamp
+        return True
+
+    def on_timer(self, stamp):
+        if self._program.on_timer:
+            with self._lock:
+                self._check_timers(stamp)
+        return True
+
+    def on_msg(self, topic, msg, stamp):
+        with self._lock:
+            program = self._program
+            if program.on_timer:
+                self._check_timers(stamp)
+            transitions = program.on_msg[topic].get(self._state)
+            if transitions is None:
+                return False
+            env = {}
+            for t in transitions:
+                fired = self._try(t, topic, msg, stamp, env)
+                if fired is not None:
+                    return fired
+        return False
+
+    def _try(self, t, topic, msg, stamp, env):
+        if t.activator:
+            env[t.activator] = self.witness[0].msg
+        rec = None
+        pool = t.pool
+        if pool is None:
+            phi = t.predicate
+            if not (phi if phi is True or phi is False else phi(msg, env)):
+                return None
+        elif pool == 'first':
+            if not self._pool:
+                return None
+            rec = self._pool[0]
+            if t.trigger:
+                env[t.trigger] = rec.msg
+            phi = t.predicate
+            if not (phi if phi is True or phi is False else phi(msg, env)):
+                return None
+        elif pool == 'any':
+            phi = t.predicate
+            for r in self._pool:
+                env[t.trigger] = r.msg
+                if phi is True or (phi is not False and phi(msg, env)):
+                    rec = r
+                    break
+            else:
+                return None
+        elif pool == 'remove':
+            return self._remove(t, msg, stamp, env)
+        elif pool == 'none':
+            phi = t.predicate
+            if not (phi if phi is True or phi is False else phi(msg, env)):
+                return None
+            for r in self._pool:
+                psi = t.dependent.get(r.topic)
+                if psi is not None:
+                    env[t.trigger] = r.msg
+                    if psi(msg, env):
+                        return False
+        else:
+            raise ValueError('unknown pool mode: ' + str(pool))
+        for action in t.actions:
+            action(self, topic, stamp, msg, rec)
+        if t.target is not None:
+            self._change_state(t.target, stamp, t.scope)
+        return True
+
+    def _remove(self, t, msg, stamp, env):
+        # removes the pool records that satisfy the predicate
+        phi = t.predicate
+        kept = []
+        n = 0
+        for r in self._pool:
+            n += 1
+            env[t.trigger] = r.msg
+            if not (phi if phi is True or phi is False else phi(msg, env)):
+                kept.append(r)
+        self._pool = TimestampPool(kept)
+        if not kept:
+            self._change_state(t.target, stamp, t.scope)
+            return True
+        if len(kept) != n:
+            return True
+        return None
+
+    def _check_timers(self, stamp):
+        timeout = self._program.timeout
+        for timer in self._program.on_timer:
+            if self._state != timer.state:
+                continue
+            if timer.clock == 'state':
+                if (stamp - self.time_state) < timeout:
+                    continue
+            elif not self._pool or (stamp - self._pool[0].timestamp) < timeout:
+                continue
+            for action in timer.actions:
+                action(self, None, stamp, None, None)
+            if timer.target is not None:
+                if not timer.when_empty or not self._pool:
+                    self._change_state(timer.target, stamp, None)
+
+    def _change_state(self, state, stamp, scope):
+        self._state = state
+        self.time_state = stamp
+        if scope == 'enter':
+            self.on_enter_scope(stamp)
+        elif scope == 'exit':
+            self.on_exit_scope(stamp)
+        if state == STATE_TRUE:
+            self.on_success(stamp, self.witness)
+        elif state == STATE_FALSE:
+            self.on_violation(stamp, self.witness)
+
+    def _reset(self):
+        self.witness = []
+        if self._program.pool_size != 0:
+            # like generated classes, monitors without a pool have no `_pool`
+            self._pool = self._program.new_pool()
+        self.time_launch = -1
+        self.time_shutdown = -1
+        self.time_state = -1
+
+    def _noop(self, *args):
+        pass
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Intermediate representation (IR) of the state machines produced by the
+# builders in `hplrv.monitors`. The IR is made only of dicts, lists, strings,
+# numbers, booleans and None, so that it can be stored as JSON and consumed
+# by other backends without the `hpl` AST objects.
+#
+# Monitor:
+#   version: int, IR_VERSION
+#   pattern: 'absence'|'existence'|'requirement'|'response'|'prevention'
+#   property: {id, title, description, text}
+#   initial_state: int
+#   launch_enters_scope: bool
+#   reentrant_scope: bool
+#   timeout: float, -1 if there is none
+#   pool: {size: int}, -1 for unbounded (sorted by timestamp), 0 for no pool
+#   topics: {<topic>: <message type name>|None}
+#   states: [int], all states the monitor can be in (except STATE_OFF)
+#   on_msg: {<topic>: [{state: int, transitions: [Transition]}]}
+#   on_timer: [Timer], checked on timer calls and before every message
+#
+# Transition (evaluated in order, the first one to fire consumes the msg):
+#   event: 'activator'|'terminator'|'behaviour'|'trigger'
+#   predicate: Expression, evaluated on the current message
+#   activator: str|None, alias bound to `witness[0].msg`
+#   trigger: str|None, alias bound to the `msg` of pool records
+#   pool: None, the predicate alone decides whether the transition fires
+#         'first', binds the first record of the pool as the matched record
+#         'any', fires if the predicate holds for any record of the pool;
+#                that record becomes the matched record
+#         'remove', removes all records for which the predicate holds;
+#                   fires if some record was removed, but only moves to
+#                   `target` if the pool becomes empty
+#         'none', fires if no record of the pool satisfies the `dependent`
+#                 predicate of its topic; otherwise, message processing
+#                 stops without firing
+#   dependent: {<topic>: Expression}, for pool 'none'
+#   actions: [str], applied in order when firing (see ACTIONS)
+#   target: int|None, state to move to when firing, None to stay
+#   scope: 'enter'|'exit'|None, hook to call when firing
+#
+# Timer (fires at most once per call, in the given state):
+#   state: int
+#   clock: 'state', fires if `timeout` has elapsed since the last transition
+#          'pool', fires if `timeout` has elapsed since the first pool record
+#   actions: [str], applied in order when firing (see ACTIONS)
+#   target: int|None, state to move to when firing, None to stay
+#   when_empty: bool, only move to `target` if the pool is empty
+#
+# Expression:
+#   {kind: 'literal', value}
+#   {kind: 'set', values: [Expression]}
+#   {kind: 'range', min: Expression, max: Expression,
+#    exclude_min: bool, exclude_max: bool}
+#   {kind: 'this', ros_type: str|None}
+#   {kind: 'var', name: str, ros_type: str|None}
+#   {kind: 'field', object: Expression, field: str, ros_type: str|None}
+#   {kind: 'index', array: Expression, index: Expression,
+#    ros_type: str|None}
+#   {kind: 'unary', operator: str, operand: Expression}
+#   {kind: 'binary', operator: str, operands: [Expression], infix: bool}
+#   {kind: 'call', function: str, arguments: [Expression]}
+#   {kind: 'quantifier', quantifier: 'forall'|'exists', variable: str,
+#    domain: Expression, array: bool, condition: Expression}
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from ast import literal_eval
+from builtins import str
+import io
+import json
+
+
+###############################################################################
+# Constants
+###############################################################################
+
+IR_VERSION = 1
+
+ACTIONS = (
+    'witness_append',       # append the current message to the witness
+    'witness_clear',        # discard the witness
+    'pool_add',             # add the current message to the pool
+    'pool_clear',           # discard all pool records
+    'pool_to_witness',      # move all pool records to the witness
+    'match_to_witness',     # append the matched pool record to the witness
+    'pool_drop_head',       # discard the first pool record
+    'pool_head_to_witness', # move the first pool record to the witness
+    'pool_expire',          # discard all pool records older than `timeout`
+)
+
+POOL_ACTIONS = frozenset(a for a in ACTIONS if a.startswith('pool_')
+                         or a == 'match_to_witness')
+
+TRUE = {'kind': 'literal', 'value': True}
+FALSE = {'kind': 'literal', 'value': False}
+
+
+###############################################################################
+# Predicates
+###############################################################################
+
+def predicate_to_ir(phi):
+    # phi: HplPredicate|HplVacuousTruth|HplContradiction
+    if phi.is_vacuous:
+        return dict(TRUE) if phi.is_true else dict(FALSE)
+    return expression_to_ir(phi.condition)
+
+def expression_to_ir(expr):
+    # expr: HplExpression
+    if expr.is_value:
+        if expr.is_literal:
+            return {'kind': 'literal', 'value': _literal_value(expr.value)}
+        if expr.is_set:
+            return {'kind': 'set',
+                    'values': [expression_to_ir(v) for v in expr.values]}
+        if expr.is_range:
+            return {
+                'kind': 'range',
+                'min': expression_to_ir(expr.min_value),
+                'max': expression_to_ir(expr.max_value),
+                'exclude_min': expr.exclude_min,
+                'exclude_max': expr.exclude_max,
+            }
+        if expr.is_this_msg:
+            return {'kind': 'this', 'ros_type': _type_name(expr.ros_type)}
+        if expr.is_variable:
+            return {'kind': 'var', 'name': expr.name,
+                    'ros_type': _type_name(expr.ros_type)}
+    elif expr.is_accessor:
+        if expr.is_field:
+            return {
+                'kind': 'field',
+                'object': expression_to_ir(expr.message),
+                'field': expr.field,
+                'ros_type': _type_name(expr.ros_type),
+            }
+        if expr.is_indexed:
+            return {
+                'kind': 'index',
+                'array': expression_to_ir(expr.array),
+                'index': expression_to_ir(expr.index),
+                'ros_type': _type_name(expr.ros_type),
+            }
+    elif expr.is_operator:
+        if expr.arity == 1:
+            return {'kind': 'unary', 'operator': expr.operator,
+                    'operand': expression_to_ir(expr.operand)}
+        if expr.arity == 2:
+            return {
+                'kind': 'binary',
+                'operator': expr.operator,
+                'operands': [expression_to_ir(expr.operand1),
+                             expression_to_ir(expr.operand2)],
+                'infix': expr.infix,
+            }
+    elif expr.is_function_call:
+        return {'kind': 'call', 'function': expr.function,
+                'arguments': [expression_to_ir(a) for a in expr.arguments]}
+    elif expr.is_quantifier:
+        return {
+            'kind': 'quantifier',
+            'quantifier': expr.quantifier,
+            'variable': expr.variable,
+            'domain': expression_to_ir(expr.domain),
+            'array': expr.domain.can_be_array,
+            'condition': expression_to_ir(expr.condition),
+        }
+    raise ValueError('unsupported expression: ' + str(expr))
+
+def _literal_value(value):
+    if isinstance(value, (bool, int, float)):
+        return value
+    # string literals keep their quotes in the AST
+    return literal_eval(str(value))
+
+def _type_name(ros_type):
+    return None if ros_type is None else ros_type.type_name
+
+
+###############################################################################
+# Serialization
+###############################################################################
+
+def dumps(ir):
+    return json.dumps(ir, sort_keys=True)
+
+def loads(text):
+    return check_version(json.loads(text))
+
+def save(ir, path):
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(dumps(ir))
+
+def load(path):
+    with io.open(path, 'r', encoding='utf-8') as f:
+        return loads(f.read())
+
+def check_version(ir):
+    version = ir.get('version')
+    if version != IR_VERSION:
+        raise ValueError('unsupported IR version: {} (expected {})'.format(
+            version, IR_VERSION))
+    return ir
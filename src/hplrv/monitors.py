@@ -8,7 +8,7 @@
 ###############################################################################
 
 from __future__ import unicode_literals
-from builtins import object, str
+from builtins import object, range, str
 from collections import defaultdict, namedtuple
 
 from hpl.ast import HplVacuousTruth
@@ -16,7 +16,14 @@ from hpl.logic import (
     refactor_reference, replace_var_with_this, replace_this_with_var
 )
 
+from . import __version__
+from .caching import property_digest, render_key
 from .constants import *
+from .ir import IR_VERSION, POOL_ACTIONS, dumps, loads, predicate_to_ir
+from .optimization import (
+    INDEX_HASH, INDEX_SORTED, CodeOptions, IndexQuery, PoolIndex,
+    comparison_join, equality_join
+)
 
 
 ###############################################################################
@@ -62,11 +69,23 @@ def _default_dict_of_lists():
     return defaultdict(list)
 
 
+_EVENT_NAMES = {
+    EVENT_ACTIVATOR: 'activator',
+    EVENT_TERMINATOR: 'terminator',
+    EVENT_BEHAVIOUR: 'behaviour',
+    EVENT_TRIGGER: 'trigger',
+}
+
+def _str_or_none(value):
+    return None if value is None else str(value)
+
+
 ###############################################################################
 # State Machine Builder
 ###############################################################################
 
 class PatternBasedBuilder(object):
+    #pattern: str
     #initial_state: int
     #timeout: float
     #reentrant_scope: bool
@@ -76,6 +95,9 @@ class PatternBasedBuilder(object):
     #        <state>:
     #            - <event>
 
+    # state entered upon an activator event
+    activated_state = STATE_ACTIVE
+
     def __init__(self, hpl_property, s0):
         self.property_id = hpl_property.metadata.get('id')
         self.property_title = hpl_property.metadata.get('title')
@@ -95,8 +117,27 @@ class PatternBasedBuilder(object):
         event = hpl_property.pattern.trigger
         if event is not None and event.is_simple_event:
             self._trigger = event.alias
+        # variable to which the pooled records are bound
+        self.pool_alias = self._trigger
         self.pool_size = self.calc_pool_size(hpl_property)
+        self.topic_types = {}
+        for event in hpl_property.events():
+            for e in event.simple_events():
+                self.topic_types[e.topic] = getattr(e.msg_type, 'type_name',
+                                                    None)
         self.on_msg = defaultdict(_default_dict_of_lists)
+        # topics whose callbacks receive precomputed predicates
+        self.shared_topics = ()
+        self.options = CodeOptions()
+        # topic -> (namedtuple name|None, field chains), see project_records
+        self.record_fields = {}
+        # equality join between trigger and behaviour, if any
+        self.trigger_key = None   # HplExpression over the trigger
+        self.behaviour_keys = {}  # topic -> HplExpression over behaviour
+        # indices of the pool of triggers, if any
+        self.pool_indices = []    # [PoolIndex]
+        self.index_keys = {}      # trigger topic -> (HplExpression|None)
+        self.index_queries = {}   # topic -> IndexQuery
         if hpl_property.scope.is_global:
             self.initial_state = s0
         elif hpl_property.scope.is_after:
@@ -116,6 +157,113 @@ class PatternBasedBuilder(object):
         if hpl_property.pattern.trigger is not None:
             self.add_trigger(hpl_property.pattern.trigger)
 
+    @property
+    def timestamp_pool(self):
+        # whether the generated code keeps its records in a TimestampPool
+        return (self.pool_size < 0 and self.options.timestamp_pool
+                and not self.join_index and not self.indexed_pool)
+
+    @property
+    def join_index(self):
+        # whether the generated code keeps its records in a KeyedPool
+        return (self.pool_size < 0 and self.options.join_indices
+                and self.trigger_key is not None)
+
+    @property
+    def indexed_pool(self):
+        # whether the generated code keeps its records in an IndexedPool
+        return (self.pool_size < 0 and self.options.join_indices
+                and bool(self.pool_indices))
+
+    @property
+    def custom_pool(self):
+        # whether the pool is one of the runtime classes, instead of a deque
+        return self.timestamp_pool or self.join_index or self.indexed_pool
+
+    @property
+    def record_aliases(self):
+        # topic -> aliases under which its stored records are read back,
+        # for the topics whose records outlive their callback
+        return self._stored_aliases(True)
+
+    @property
+    def pooled_aliases(self):
+        # like record_aliases, but only for the records kept in the pool
+        return self._stored_aliases(False)
+
+    @property
+    def record_classes(self):
+        # (namedtuple name, field chains) of the projected records
+        return [self.record_fields[topic] for topic in sorted(self.record_fields)
+                if self.record_fields[topic][0] is not None]
+
+    def _stored_aliases(self, activators):
+        aliases = {}
+        for topic, states in self.on_msg.items():
+            for events in states.values():
+                for event in events:
+                    if event.event_type == EVENT_ACTIVATOR and activators:
+                        alias = self._activator
+                    elif (event.event_type == EVENT_TRIGGER
+                            and self.pool_size != 0):
+                        alias = self.pool_alias
+                    else:
+                        continue
+                    names = aliases.setdefault(topic, set())
+                    if alias:
+                        names.add(alias)
+        return aliases
+
+    @property
+    def state_topics(self):
+        # state -> sorted list of the topics that have events in that state
+        topics = {}
+        for topic, states in self.on_msg.items():
+            for state, events in states.items():
+                if events:
+                    topics.setdefault(state, []).append(topic)
+        for names in topics.values():
+            names.sort()
+        return topics
+
+    def _add_pool_index(self, join, alias):
+        # join: (operator, key over `alias`, bound), see comparison_join
+        op, key, bound = join
+        key = key.clone()
+        replace_var_with_this(key, alias)
+        kind = INDEX_HASH if op == '=' else INDEX_SORTED
+        index = PoolIndex(kind, key)
+        for i in range(len(self.pool_indices)):
+            if (self.pool_indices[i].kind == kind
+                    and str(self.pool_indices[i].key) == str(key)):
+                return IndexQuery(i, op, bound)
+        self.pool_indices.append(index)
+        return IndexQuery(len(self.pool_indices) - 1, op, bound)
+
+    def _add_join_keys(self, hpl_property):
+        # all behaviour events that refer to the trigger must join
+        # on the same trigger field(s)
+        trigger_key = None
+        keys = {}
+        for e in hpl_property.pattern.behaviour.simple_events():
+            if not e.contains_reference(self._trigger):
+                continue
+            join = equality_join(e.predicate, self._trigger)
+            if join is None:
+                return
+            key = join[1].clone()
+            replace_var_with_this(key, self._trigger)
+            if trigger_key is None:
+                trigger_key = key
+            elif str(key) != str(trigger_key):
+                return
+            if e.topic in keys and str(keys[e.topic]) != str(join[0]):
+                return
+            keys[e.topic] = join[0]
+        if trigger_key is not None:
+            self.trigger_key = trigger_key
+            self.behaviour_keys = keys
+
     def add_activator(self, event):
         # must be called before all others
         # assuming only disjunctions or simple events
@@ -135,12 +283,121 @@ class PatternBasedBuilder(object):
     def calc_pool_size(self, hpl_property):
         raise NotImplementedError()
 
+    def to_ir(self):
+        # see `hplrv.ir` for a description of the returned structure
+        states = {self.initial_state}
+        on_msg = {}
+        for topic, handlers in self.on_msg.items():
+            on_msg[topic] = []
+            for state, events in handlers.items():
+                states.add(state)
+                transitions = []
+                for event in events:
+                    transition = self._ir_transition(event, topic, state)
+                    if transition is not None:
+                        transitions.append(transition)
+                on_msg[topic].append({
+                    'state': state,
+                    'transitions': transitions,
+                })
+        timers = self._ir_timers() if self.timeout > 0.0 else []
+        for t in self._ir_all_transitions(on_msg, timers):
+            if t['target'] is not None:
+                states.add(t['target'])
+        return {
+            'version': IR_VERSION,
+            'pattern': self.pattern,
+            'property': {
+                'id': _str_or_none(self.property_id),
+                'title': _str_or_none(self.property_title),
+                'description': _str_or_none(self.property_desc),
+                'text': self.property_text,
+            },
+            'initial_state': self.initial_state,
+            'launch_enters_scope': self.launch_enters_scope,
+            'reentrant_scope': self.reentrant_scope,
+            'timeout': float(self.timeout),
+            'pool': {'size': self.pool_size},
+            'topics': dict(self.topic_types),
+            'states': sorted(states),
+            'on_msg': on_msg,
+            'on_timer': timers,
+        }
+
+    def _ir_transition(self, event, topic, state):
+        if event.event_type == EVENT_ACTIVATOR:
+            return self._ir_event(event, self.activated_state,
+                                  ('witness_append',), scope='enter')
+        if event.event_type == EVENT_TERMINATOR:
+            if event.verdict is True:
+                target = STATE_TRUE
+                actions = ('pool_clear', 'witness_append')
+            elif event.verdict is False:
+                target = STATE_FALSE
+                actions = ('pool_to_witness', 'witness_append')
+            else:
+                target = STATE_INACTIVE
+                actions = ('pool_clear', 'witness_clear')
+            return self._ir_event(event, target, actions, scope='exit')
+        if event.event_type == EVENT_BEHAVIOUR:
+            return self._ir_behaviour(event, topic, state)
+        if event.event_type == EVENT_TRIGGER:
+            return self._ir_trigger(event, topic, state)
+        raise ValueError('unexpected event type: ' + str(event.event_type))
+
+    def _ir_behaviour(self, event, topic, state):
+        raise NotImplementedError()
+
+    def _ir_trigger(self, event, topic, state):
+        raise NotImplementedError()
+
+    def _ir_timers(self):
+        raise NotImplementedError()
+
+    def _ir_event(self, event, target, actions, pool=None, trigger=None,
+                  dependent=None, scope=None):
+        return {
+            'event': _EVENT_NAMES[event.event_type],
+            'predicate': predicate_to_ir(event.predicate),
+            'activator': getattr(event, 'activator', None),
+            'trigger': trigger or getattr(event, 'trigger', None),
+            'pool': pool,
+            'dependent': dependent or {},
+            'actions': self._ir_actions(actions),
+            'target': target,
+            'scope': scope,
+        }
+
+    def _ir_timer(self, state, clock, actions, target, when_empty=False):
+        return {
+            'state': state,
+            'clock': clock,
+            'actions': self._ir_actions(actions),
+            'target': target,
+            'when_empty': when_empty,
+        }
+
+    def _ir_actions(self, actions):
+        if self.pool_size == 0:
+            return [a for a in actions if a not in POOL_ACTIONS]
+        return list(actions)
+
+    def _ir_all_transitions(self, on_msg, timers):
+        for handlers in on_msg.values():
+            for handler in handlers:
+                for transition in handler['transitions']:
+                    yield transition
+        for timer in timers:
+            yield timer
+
 
 ###############################################################################
 # Absence State Machine
 ###############################################################################
 
 class AbsenceBuilder(PatternBasedBuilder):
+    pattern = 'absence'
+
     def __init__(self, hpl_property):
         super(AbsenceBuilder, self).__init__(hpl_property, STATE_ACTIVE)
 
@@ -173,12 +430,21 @@ class AbsenceBuilder(PatternBasedBuilder):
             datum = new_behaviour(e.predicate, alias, None)
             self.on_msg[e.topic][STATE_ACTIVE].append(datum)
 
+    def _ir_behaviour(self, event, topic, state):
+        return self._ir_event(event, STATE_FALSE, ('witness_append',))
+
+    def _ir_timers(self):
+        target = STATE_SAFE if self.reentrant_scope else STATE_TRUE
+        return [self._ir_timer(STATE_ACTIVE, 'state', (), target)]
+
 
 ###############################################################################
 # Existence State Machine
 ###############################################################################
 
 class ExistenceBuilder(PatternBasedBuilder):
+    pattern = 'existence'
+
     def __init__(self, hpl_property):
         super(ExistenceBuilder, self).__init__(hpl_property, STATE_ACTIVE)
 
@@ -207,12 +473,21 @@ class ExistenceBuilder(PatternBasedBuilder):
             datum = new_behaviour(e.predicate, alias, None)
             self.on_msg[e.topic][STATE_ACTIVE].append(datum)
 
+    def _ir_behaviour(self, event, topic, state):
+        target = STATE_SAFE if self.reentrant_scope else STATE_TRUE
+        return self._ir_event(event, target, ('witness_append',))
+
+    def _ir_timers(self):
+        return [self._ir_timer(STATE_ACTIVE, 'state', (), STATE_FALSE)]
+
 
 ###############################################################################
 # Requirement State Machine
 ###############################################################################
 
 class RequirementBuilder(PatternBasedBuilder):
+    pattern = 'requirement'
+
     def __init__(self, hpl_property):
         self.has_trigger_refs = False
         self.dependent_predicates = defaultdict(HplVacuousTruth)
@@ -227,6 +502,9 @@ class RequirementBuilder(PatternBasedBuilder):
                         self.has_trigger_refs = True
                         break
         super(RequirementBuilder, self).__init__(hpl_property, STATE_ACTIVE)
+        self.pool_alias = '1' # see dependent_predicates
+        if self.pool_size < 0:
+            self._add_dependent_indices(hpl_property)
 
     @property
     def has_safe_state(self):
@@ -263,6 +541,22 @@ class RequirementBuilder(PatternBasedBuilder):
             datum = new_behaviour(e.predicate, self._activator, None)
             self.on_msg[e.topic][STATE_ACTIVE].append(datum)
 
+    def _add_dependent_indices(self, hpl_property):
+        # one index per trigger topic, by its dependent predicate `psi`,
+        # in which `@1` stands for the trigger
+        for topic, psi in list(self.dependent_predicates.items()):
+            join = comparison_join(psi, '1')
+            if join is not None:
+                self.index_queries[topic] = self._add_pool_index(join, '1')
+        n = len(self.pool_indices)
+        for e in hpl_property.pattern.trigger.simple_events():
+            topic = e.topic
+            keys = [None] * n
+            query = self.index_queries.get(topic)
+            if query is not None:
+                keys[query.index] = self.pool_indices[query.index].key
+            self.index_keys[topic] = tuple(keys)
+
     def add_trigger(self, event):
         for e in event.simple_events():
             alias = None
@@ -283,14 +577,42 @@ class RequirementBuilder(PatternBasedBuilder):
             if self.has_safe_state:
                 states[STATE_SAFE].append(datum)
 
+    def _ir_behaviour(self, event, topic, state):
+        if not self.has_trigger_refs:
+            return self._ir_event(event, STATE_FALSE, ('witness_append',))
+        # dependent predicates refer to trigger records as '@1'
+        dependent = {t: predicate_to_ir(psi)
+                     for t, psi in self.dependent_predicates.items()}
+        return self._ir_event(event, STATE_FALSE, ('witness_append',),
+            pool='none', trigger='1', dependent=dependent)
+
+    def _ir_trigger(self, event, topic, state):
+        if self.has_trigger_refs or state == STATE_SAFE:
+            return self._ir_event(event, None, ('pool_add',))
+        if self.timeout > 0.0 or self.reentrant_scope:
+            return self._ir_event(event, STATE_SAFE, ('pool_add',))
+        return self._ir_event(event, STATE_TRUE, ('witness_append',))
+
+    def _ir_timers(self):
+        if self.has_trigger_refs:
+            return [self._ir_timer(STATE_ACTIVE, 'pool', ('pool_expire',),
+                                   None)]
+        return [self._ir_timer(STATE_SAFE, 'pool', ('pool_drop_head',),
+                               STATE_ACTIVE)]
+
 
 ###############################################################################
 # Response State Machine
 ###############################################################################
 
 class ResponseBuilder(PatternBasedBuilder):
+    pattern = 'response'
+    activated_state = STATE_SAFE
+
     def __init__(self, hpl_property):
         super(ResponseBuilder, self).__init__(hpl_property, STATE_SAFE)
+        if self.pool_size < 0:
+            self._add_join_keys(hpl_property)
 
     def calc_pool_size(self, hpl_property):
         if self._trigger:
@@ -338,14 +660,37 @@ class ResponseBuilder(PatternBasedBuilder):
                 states[STATE_ACTIVE].append(datum)
             states[STATE_SAFE].append(datum)
 
+    def _ir_behaviour(self, event, topic, state):
+        if event.trigger:
+            return self._ir_event(event, STATE_SAFE, (), pool='remove')
+        return self._ir_event(event, STATE_SAFE, ('pool_clear',))
+
+    def _ir_trigger(self, event, topic, state):
+        if state == STATE_SAFE:
+            if self.pool_size == 0:
+                return self._ir_event(event, STATE_ACTIVE, ('witness_append',))
+            return self._ir_event(event, STATE_ACTIVE, ('pool_add',))
+        if self.pool_size == 0 or self.pool_size == 1:
+            return None # nothing to do
+        return self._ir_event(event, None, ('pool_add',))
+
+    def _ir_timers(self):
+        return [self._ir_timer(STATE_ACTIVE, 'pool',
+                               ('pool_head_to_witness',), STATE_FALSE)]
+
 
 ###############################################################################
 # Prevention State Machine
 ###############################################################################
 
 class PreventionBuilder(PatternBasedBuilder):
+    pattern = 'prevention'
+    activated_state = STATE_SAFE
+
     def __init__(self, hpl_property):
         super(PreventionBuilder, self).__init__(hpl_property, STATE_SAFE)
+        if self.pool_size < 0:
+            self._add_behaviour_indices(hpl_property)
 
     def calc_pool_size(self, hpl_property):
         if self._trigger:
@@ -355,6 +700,21 @@ class PreventionBuilder(PatternBasedBuilder):
         # no alias, no refs
         return 1 # if self.timeout >= 0 else 0
 
+    def _add_behaviour_indices(self, hpl_property):
+        # one query per behaviour topic that refers to the trigger;
+        # the others keep scanning the whole pool
+        for e in hpl_property.pattern.behaviour.simple_events():
+            if not e.contains_reference(self._trigger):
+                continue
+            join = comparison_join(e.predicate, self._trigger)
+            if join is not None:
+                self.index_queries[e.topic] = self._add_pool_index(
+                    join, self._trigger)
+        # every trigger goes into every index
+        keys = tuple(index.key for index in self.pool_indices)
+        for e in hpl_property.pattern.trigger.simple_events():
+            self.index_keys[e.topic] = keys
+
     def add_terminator(self, event):
         # must be called before pattern events
         for e in event.simple_events():
@@ -390,3 +750,51 @@ class PreventionBuilder(PatternBasedBuilder):
             if self.pool_size != 0:
                 states[STATE_ACTIVE].append(datum)
             states[STATE_SAFE].append(datum)
+
+    def _ir_behaviour(self, event, topic, state):
+        actions = ('match_to_witness', 'witness_append', 'pool_clear')
+        pool = 'any' if event.trigger else 'first'
+        return self._ir_event(event, STATE_FALSE, actions, pool=pool)
+
+    def _ir_trigger(self, event, topic, state):
+        if state == STATE_SAFE:
+            return self._ir_event(event, STATE_ACTIVE, ('pool_add',))
+        if self.pool_size == 1 and self.timeout < 0:
+            return None # nothing to do
+        return self._ir_event(event, None, ('pool_add',))
+
+    def _ir_timers(self):
+        return [self._ir_timer(STATE_ACTIVE, 'pool', ('pool_expire',),
+                               STATE_SAFE, when_empty=True)]
+
+
+###############################################################################
+# Builder Selection
+###############################################################################
+
+def new_builder(hpl_property):
+    if hpl_property.pattern.is_absence:
+        return AbsenceBuilder(hpl_property)
+    if hpl_property.pattern.is_existence:
+        return ExistenceBuilder(hpl_property)
+    if hpl_property.pattern.is_requirement:
+        return RequirementBuilder(hpl_property)
+    if hpl_property.pattern.is_response:
+        return ResponseBuilder(hpl_property)
+    if hpl_property.pattern.is_prevention:
+        return PreventionBuilder(hpl_property)
+    raise ValueError('unknown pattern: ' + str(hpl_property.pattern))
+
+def build_ir(hpl_property, cache=None):
+    # cache: RenderCache|None, where to store the serialized IR
+    key = None
+    if cache is not None:
+        key = render_key('ir', IR_VERSION, __version__,
+                         property_digest(hpl_property))
+        text = cache.get(key, suffix='.json')
+        if text is not None:
+            return loads(text)
+    ir = new_builder(hpl_property).to_ir()
+    if key is not None:
+        cache.put(key, dumps(ir), suffix='.json')
+    return ir
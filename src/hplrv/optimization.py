@@ -0,0 +1,588 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Transformations of the builders' state machines that make the generated
+# code faster without changing its behaviour.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, range, str
+from collections import namedtuple
+import re
+
+
+###############################################################################
+# Code Generation Options
+###############################################################################
+
+class CodeOptions(namedtuple('CodeOptions',
+        ('hoist_accessors', 'numpy_quantifiers', 'timestamp_pool',
+         'join_indices', 'next_deadline', 'strip_asserts', 'unused_hooks',
+         'elide_lock', 'project_fields', 'state_dispatch',
+         'state_routing', 'subscription_grace', 'batch_callbacks',
+         'full_witness'))):
+    # Optional transformations of the generated monitor classes.
+    # All of them are disabled by default.
+    # hoist_accessors: bool, bind repeated message field chains to locals
+    # numpy_quantifiers: bool, evaluate quantifiers over numeric arrays
+    #   with NumPy, whenever possible (requires `numpy` at runtime)
+    # timestamp_pool: bool, use TimestampPool for unbounded record pools
+    # join_indices: bool, index pools of records by the keys of equality
+    #   joins between the trigger and the behaviour (e.g., `id = @A.id`)
+    # next_deadline: bool, give monitors a `next_deadline` property, and
+    #   have ROS nodes sleep until the earliest one instead of polling
+    # strip_asserts: bool, remove the runtime sanity checks of monitors
+    # unused_hooks: tuple of names from HOOKS, hooks that are never set,
+    #   whose calls are removed
+    # elide_lock: bool, do not lock monitors in their callbacks (for
+    #   single-threaded use; ROS nodes use a single lock of their own)
+    # project_fields: bool, keep only the message fields that are read
+    #   back from stored records, instead of whole messages
+    # state_dispatch: bool, give message callbacks one method per state,
+    #   chosen on state transitions, instead of a chain of state tests
+    # state_routing: bool, have ROS nodes call only the monitors whose
+    #   current state has events on the topic of a message (or a timeout)
+    # subscription_grace: float|None, with state_routing, have ROS nodes
+    #   subscribe to a topic only while some monitor state consumes it,
+    #   and unsubscribe after it has not been needed for this many seconds
+    # batch_callbacks: bool, give monitors an `on_msgs_<topic>` method per
+    #   topic, to process a sequence of messages under a single lock
+    # full_witness: bool, with project_fields, keep whole messages in the
+    #   records that go straight to the witness, and project only those
+    #   that are added to the pool
+    __slots__ = ()
+
+    def __new__(cls, hoist_accessors=False, numpy_quantifiers=False,
+                timestamp_pool=False, join_indices=False,
+                next_deadline=False, strip_asserts=False, unused_hooks=(),
+                elide_lock=False, project_fields=False,
+                state_dispatch=False, state_routing=False,
+                subscription_grace=None, batch_callbacks=False,
+                full_witness=False):
+        unused_hooks = tuple(sorted(set(unused_hooks)))
+        for name in unused_hooks:
+            if name not in HOOKS:
+                raise ValueError('unknown hook: ' + repr(name))
+        if subscription_grace is not None:
+            if not state_routing:
+                raise ValueError('subscription_grace requires state_routing')
+            if subscription_grace < 0:
+                raise ValueError('invalid subscription_grace: '
+                                 + repr(subscription_grace))
+        if full_witness and not project_fields:
+            raise ValueError('full_witness requires project_fields')
+        return super(CodeOptions, cls).__new__(cls, hoist_accessors,
+                                               numpy_quantifiers,
+                                               timestamp_pool, join_indices,
+                                               next_deadline, strip_asserts,
+                                               unused_hooks, elide_lock,
+                                               project_fields, state_dispatch,
+                                               state_routing,
+                                               subscription_grace,
+                                               batch_callbacks,
+                                               full_witness)
+
+    @classmethod
+    def from_level(cls, level, unused_hooks=(), **kwargs):
+        # Optimization levels, in the style of `-O`; each includes the
+        # previous ones. Other options can be given as keyword arguments.
+        # 0: no transformations, the default output
+        # 1: strip_asserts
+        # 2: drop the calls to `unused_hooks` (without them, the code is
+        #   the same as level 1, e.g., for `code_options(2)`)
+        # 3: elide_lock
+        if level not in OPT_LEVELS:
+            raise ValueError('invalid optimization level: ' + repr(level))
+        if level >= 1:
+            kwargs['strip_asserts'] = True
+        if level >= 2:
+            kwargs['unused_hooks'] = unused_hooks
+        if level >= 3:
+            kwargs['elide_lock'] = True
+        return cls(**kwargs)
+
+
+HOOKS = ('on_enter_scope', 'on_exit_scope', 'on_violation', 'on_success')
+
+OPT_LEVELS = (0, 1, 2, 3)
+
+def code_options(options):
+    # options: CodeOptions|int|None, where an int is an optimization level
+    if options is None or isinstance(options, CodeOptions):
+        return options
+    return CodeOptions.from_level(options)
+
+
+###############################################################################
+# Shared Predicates
+###############################################################################
+
+class SharedPredicate(object):
+    # Stands in for a HplPredicate in the builders' events. Its value is
+    # computed once per message by the ROS node, and passed to the monitor
+    # callbacks in the `preds` tuple, at position `shared_index`.
+    __slots__ = ('predicate', 'shared_index')
+
+    def __init__(self, predicate, shared_index):
+        self.predicate = predicate
+        self.shared_index = shared_index
+
+    @property
+    def is_vacuous(self):
+        return False
+
+    def external_references(self):
+        return set()
+
+    def __str__(self):
+        return str(self.predicate)
+
+
+def predicate_key(phi):
+    return str(phi)
+
+def is_shareable(phi):
+    # only predicates that depend on nothing but the current message
+    return not phi.is_vacuous and not phi.external_references()
+
+
+class PredicateTable(object):
+    # Hash-conses the predicates of many monitors, topic by topic.
+    # A predicate is shared when at least `min_users` monitors evaluate it.
+
+    def __init__(self, min_users=2):
+        self.min_users = min_users
+        self.indices = {}       # topic -> {predicate key -> index}
+        self.predicates = {}    # topic -> [HplPredicate]
+        self.callers = {}       # topic -> {monitor index}
+        self._users = {}        # (topic, key) -> {monitor index}
+        self._first = {}        # (topic, key) -> HplPredicate
+        self._order = []        # (topic, key), as first seen
+
+    def add(self, builder, monitor):
+        # builder: PatternBasedBuilder
+        # monitor: int, index of the monitor in the node
+        for topic, states in builder.on_msg.items():
+            for events in states.values():
+                for event in events:
+                    phi = event.predicate
+                    if not is_shareable(phi):
+                        continue
+                    k = (topic, predicate_key(phi))
+                    users = self._users.get(k)
+                    if users is None:
+                        users = self._users[k] = set()
+                        self._first[k] = phi
+                        self._order.append(k)
+                    users.add(monitor)
+
+    def finalize(self):
+        for k in self._order:
+            users = self._users[k]
+            if len(users) < self.min_users:
+                continue
+            topic, key = k
+            indices = self.indices.setdefault(topic, {})
+            indices[key] = len(indices)
+            self.predicates.setdefault(topic, []).append(self._first[k])
+            self.callers.setdefault(topic, set()).update(users)
+        self._users = self._first = self._order = None
+        return self
+
+
+def share_predicates(builder, indices):
+    # Replaces the builder's predicates found in `indices`
+    # (topic -> {predicate key -> index}) with SharedPredicate objects.
+    topics = set()
+    for topic, states in builder.on_msg.items():
+        shared = indices.get(topic)
+        if not shared:
+            continue
+        for events in states.values():
+            for i in range(len(events)):
+                event = events[i]
+                index = shared.get(predicate_key(event.predicate))
+                if index is not None:
+                    phi = SharedPredicate(event.predicate, index)
+                    events[i] = event._replace(predicate=phi)
+                    topics.add(topic)
+    builder.shared_topics = topics
+    return builder
+
+
+###############################################################################
+# Accessor Hoisting
+###############################################################################
+
+# string literals are matched only to skip them
+_ACCESSOR = re.compile(r"""(?P<str>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")"""
+                       r"|(?<![\w.])msg(?P<chain>(?:\.[A-Za-z_]\w*)+)")
+
+def hoist_accessors(text, enabled=True):
+    # Jinja filter for the body of a state branch in a message callback.
+    # Binds message field chains (e.g., `msg.pose.pose.orientation`) that
+    # are used more than once, or inside loops, to local variables at the
+    # top of the block. Field access has no side effects and never fails on
+    # ROS messages, so it is safe to do it eagerly. Array indexing and other
+    # sub-expressions, which may raise, are left where they are.
+    if not enabled:
+        return text
+    lines = text.split('\n')
+    uses = []   # (line, start, end, fields)
+    counts = {} # field chain prefix -> weighted number of uses
+    first = {}  # field chain prefix -> order of first use
+    base_indent = None
+    loops = []  # indentation of the enclosing loop statements
+    for i in range(len(lines)):
+        line = lines[i]
+        code = line.lstrip()
+        if not code:
+            continue
+        indent = len(line) - len(code)
+        if base_indent is None:
+            base_indent = line[:indent]
+        while loops and indent <= loops[-1]:
+            loops.pop()
+        # generator expressions come from quantifiers (`for v_x in ...`)
+        weight = 2 if loops or ' for v_' in code else 1
+        for match in _ACCESSOR.finditer(line):
+            if match.group('chain') is None:
+                continue
+            fields = tuple(match.group('chain').split('.')[1:])
+            uses.append((i, match.start(), match.end(), fields))
+            for j in range(1, len(fields) + 1):
+                prefix = fields[:j]
+                counts[prefix] = counts.get(prefix, 0) + weight
+                first.setdefault(prefix, len(first))
+        if code.startswith(('for ', 'while ')):
+            loops.append(indent)
+    hoisted = [p for p, n in counts.items() if n >= 2 and not any(
+        len(q) == len(p) + 1 and q[:-1] == p and counts[q] == n
+        for q in counts)]
+    if not hoisted:
+        return text
+    hoisted.sort(key=lambda p: (len(p), first[p]))
+    names = {}
+    bindings = []
+    for prefix in hoisted:
+        name = '_f{}'.format(len(names))
+        bindings.append('{}{} = {}'.format(base_indent, name,
+                                           _hoisted_chain(prefix, names)))
+        names[prefix] = name
+    for i, start, end, fields in reversed(uses):
+        line = lines[i]
+        chain = _hoisted_chain(fields, names, full=True)
+        lines[i] = line[:start] + chain + line[end:]
+    return '\n'.join(bindings + lines)
+
+def _hoisted_chain(fields, names, full=False):
+    # uses the longest hoisted prefix of `fields`
+    n = len(fields) if full else len(fields) - 1
+    for j in range(n, 0, -1):
+        name = names.get(fields[:j])
+        if name is not None:
+            return '.'.join((name,) + fields[j:])
+    return '.'.join(('msg',) + fields)
+
+
+###############################################################################
+# Batch Callbacks
+###############################################################################
+
+def hoist_members(text, names):
+    # Jinja filter for code that runs in a loop, after binding each member
+    # in `names` (e.g., `self._state`) to a local of the same name. Reads
+    # use the local, and assignments also set the member, so that hooks
+    # and helper methods see the new values.
+    if not names:
+        return text
+    names = '|'.join(sorted(names, key=len, reverse=True))
+    assign = re.compile(r'^(\s*)self\.({}) = '.format(names))
+    read = re.compile(r'\bself\.({})\b'.format(names))
+    lines = []
+    for line in text.split('\n'):
+        match = assign.match(line)
+        if match is None:
+            lines.append(read.sub('\\1', line))
+        else:
+            lines.append('{0}self.{1} = {1} = {2}'.format(match.group(1),
+                match.group(2), read.sub('\\1', line[match.end():])))
+    return '\n'.join(lines)
+
+
+###############################################################################
+# Field Projection
+###############################################################################
+
+def project_records(builder, pool_only=False):
+    # Makes the records of the topics in `record_aliases` (`pooled_aliases`
+    # if `pool_only`) hold a namedtuple with the field chains that are read
+    # through their aliases, or None if nothing is read, instead of the
+    # whole message. Field chains stop at indexing, so `@A.data[0].x` keeps
+    # all of `data`. The builder's predicates are replaced with copies that
+    # read the flattened fields (`@A.pose.x` becomes `@A.pose__x`).
+    # Sets `builder.record_fields`, see the `new_record` template macro.
+    aliases = builder.pooled_aliases if pool_only else builder.record_aliases
+    names = set()
+    for topic_aliases in aliases.values():
+        names.update(topic_aliases)
+    chains = {} # alias or (topic, alias) -> set of field chains
+    accesses = []
+    for states in builder.on_msg.values():
+        for events in states.values():
+            for i in range(len(events)):
+                event = events[i]
+                phi = _projected_copy(event.predicate, names)
+                if phi is not event.predicate:
+                    events[i] = event._replace(predicate=phi)
+                    accesses.extend(_field_chains(phi, names, None, chains))
+    dependent = getattr(builder, 'dependent_predicates', None)
+    if dependent:
+        for topic, psi in list(dependent.items()):
+            psi = _projected_copy(psi, names)
+            dependent[topic] = psi
+            accesses.extend(_field_chains(psi, names, topic, chains))
+    builder.record_fields = {}
+    n = 0
+    for topic in sorted(aliases):
+        fields = set()
+        for name in aliases[topic]:
+            fields.update(chains.get(name, ()))
+            fields.update(chains.get((topic, name), ()))
+        if fields:
+            builder.record_fields[topic] = ('_Fields{}'.format(n),
+                                            sorted(fields))
+            n += 1
+        else:
+            builder.record_fields[topic] = (None, [])
+    for expr, fields in accesses:
+        while expr.message.is_accessor:
+            expr.message = expr.message.message
+        expr.field = '__'.join(fields)
+    return builder
+
+def _projected_copy(phi, names):
+    # a copy of `phi` to rewrite, or `phi` itself if it reads no alias
+    if phi.is_vacuous or isinstance(phi, SharedPredicate):
+        return phi
+    if any(phi.contains_reference(name) for name in names):
+        return phi.clone()
+    return phi
+
+def _field_chains(phi, names, topic, chains):
+    # Collects the longest field chains over `names` in `chains`.
+    # Returns [(field access, fields)] of the chains with two or more fields.
+    if phi.is_vacuous or isinstance(phi, SharedPredicate):
+        return []
+    inner = set()
+    tops = []
+    for obj in phi.condition.iterate():
+        if obj.is_accessor and obj.is_field:
+            tops.append(obj)
+            if obj.message.is_accessor and obj.message.is_field:
+                inner.add(id(obj.message))
+    accesses = []
+    for obj in tops:
+        if id(obj) in inner:
+            continue
+        fields = []
+        expr = obj
+        while expr.is_accessor and expr.is_field:
+            fields.append(expr.field)
+            expr = expr.message
+        if not (expr.is_value and expr.is_variable and expr.name in names):
+            continue
+        fields.reverse()
+        key = expr.name if topic is None else (topic, expr.name)
+        chains.setdefault(key, set()).add('.'.join(fields))
+        if len(fields) > 1:
+            accesses.append((obj, fields))
+    return accesses
+
+
+###############################################################################
+# Vectorized Quantifiers
+###############################################################################
+
+# operators that have an element-wise NumPy counterpart
+_VECTOR_OPS = frozenset(('+', '-', '*', '/', '**', 'and', 'or',
+                         '=', '!=', '<', '<=', '>', '>='))
+
+# attributes that hold sub-expressions
+_CHILD_SLOTS = frozenset(('condition', 'operand', 'operand1', 'operand2',
+                          'message', 'array', 'index', 'domain',
+                          'min_value', 'max_value'))
+_CHILD_LISTS = frozenset(('arguments', 'values'))
+
+
+class VectorizedQuantifier(object):
+    # Stands in for a HplQuantifier over an array, whose condition only uses
+    # the quantified variable to index that array. The condition is rendered
+    # as NumPy operations over the whole array, instead of a generator.
+    __slots__ = ('quantifier',)
+
+    vectorized = True
+
+    def __init__(self, quantifier):
+        self.quantifier = quantifier
+
+    def __getattr__(self, name):
+        return getattr(self.quantifier, name)
+
+    def __str__(self):
+        return str(self.quantifier)
+
+
+def is_vectorizable(q):
+    # q: HplQuantifier
+    return (q.domain.can_be_array and q.domain.is_accessor
+            and _is_vector_expression(q.condition, q))
+
+def _is_vector_expression(expr, q):
+    if not expr.contains_reference(q.variable):
+        return True # scalar, broadcast by NumPy
+    if expr.is_accessor:
+        # the only vector is `array[@i]`
+        i = expr.index if expr.is_indexed else None
+        return (i is not None and i.is_value and i.is_variable
+                and i.name == q.variable and expr.array == q.domain)
+    if expr.is_operator:
+        if expr.arity == 1:
+            return (expr.operator in ('-', 'not')
+                    and _is_vector_expression(expr.operand, q))
+        return (expr.operator in _VECTOR_OPS
+                and _is_vector_expression(expr.operand1, q)
+                and _is_vector_expression(expr.operand2, q))
+    if expr.is_function_call:
+        return (expr.function == 'abs'
+                and _is_vector_expression(expr.arguments[0], q))
+    return False
+
+
+def vectorize_predicate(phi):
+    # Returns `phi` if it has no vectorizable quantifiers, or a copy of it
+    # in which those quantifiers are replaced by VectorizedQuantifier.
+    if phi.is_vacuous or isinstance(phi, SharedPredicate):
+        return phi
+    if not any(obj.is_quantifier and is_vectorizable(obj)
+               for obj in phi.condition.iterate()):
+        return phi
+    phi = phi.clone()
+    phi.condition = _vectorize(phi.condition)
+    return phi
+
+def _vectorize(expr):
+    if expr.is_quantifier and is_vectorizable(expr):
+        return VectorizedQuantifier(expr)
+    cls = type(expr)
+    for name in _CHILD_SLOTS:
+        if isinstance(getattr(cls, name, None), property):
+            continue # e.g., `message` is an alias of `array`
+        child = getattr(expr, name, None)
+        if child is not None:
+            setattr(expr, name, _vectorize(child))
+    for name in _CHILD_LISTS:
+        values = getattr(expr, name, None)
+        if values is not None:
+            setattr(expr, name, type(values)(_vectorize(v) for v in values))
+    return expr
+
+def vectorize_quantifiers(builder):
+    # Replaces the builder's predicates with vectorized copies, if possible.
+    # Quantifiers with unsupported bodies keep the generator form.
+    for states in builder.on_msg.values():
+        for events in states.values():
+            for i in range(len(events)):
+                event = events[i]
+                phi = vectorize_predicate(event.predicate)
+                if phi is not event.predicate:
+                    events[i] = event._replace(predicate=phi)
+    dependent = getattr(builder, 'dependent_predicates', None)
+    if dependent:
+        for topic, psi in list(dependent.items()):
+            dependent[topic] = vectorize_predicate(psi)
+    return builder
+
+
+###############################################################################
+# Join Indices
+###############################################################################
+
+# kinds of pool indices
+INDEX_HASH = 'hash'       # for `=`
+INDEX_SORTED = 'sorted'   # for `<`, `<=`, `>` and `>=`
+
+PoolIndex = namedtuple('PoolIndex', ('kind', 'key'))
+IndexQuery = namedtuple('IndexQuery', ('index', 'operator', 'bound'))
+
+# `a op b` is the same as `b flipped[op] a`
+_FLIPPED = {'=': '=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+
+def equality_join(phi, alias):
+    # Looks for a conjunct `f(this) = g(@alias)` in the predicate `phi`,
+    # in which each side refers to nothing else. Returns (f, g) or None.
+    for expr in _conjuncts(phi):
+        if expr.operator == '=':
+            a = expr.operand1
+            b = expr.operand2
+            if _references(a) == _THIS and _references(b) == set((alias,)):
+                return (a, b)
+            if _references(b) == _THIS and _references(a) == set((alias,)):
+                return (b, a)
+    return None
+
+def comparison_join(phi, alias):
+    # Looks for a conjunct `g(@alias) op f` in the predicate `phi`, in which
+    # `g` refers to nothing but `alias` and `f` does not refer to `alias`.
+    # Returns (op, g, f), flipping `op` if needed, or None.
+    # Equalities are preferred over inequalities.
+    found = None
+    only_alias = set((alias,))
+    for expr in _conjuncts(phi):
+        op = expr.operator
+        if op not in _FLIPPED:
+            continue
+        a = expr.operand1
+        b = expr.operand2
+        if _references(a) == only_alias and alias not in _references(b):
+            join = (op, a, b)
+        elif _references(b) == only_alias and alias not in _references(a):
+            join = (_FLIPPED[op], b, a)
+        else:
+            continue
+        if op == '=':
+            return join
+        if found is None:
+            found = join
+    return found
+
+def _conjuncts(phi):
+    # binary operators at the top of the `and` tree of `phi`
+    if phi.is_vacuous:
+        return
+    stack = [phi.condition]
+    while stack:
+        expr = stack.pop()
+        if not expr.is_operator or expr.arity != 2:
+            continue
+        if expr.operator == 'and':
+            stack.append(expr.operand2)
+            stack.append(expr.operand1)
+        else:
+            yield expr
+
+_THIS = set((None,))
+
+def _references(expr):
+    # None stands for `this` message
+    refs = set()
+    for obj in expr.iterate():
+        if obj.is_value and obj.is_reference:
+            refs.add(None if obj.is_this_msg else obj.name)
+    return refs
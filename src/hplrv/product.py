@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Compilation of many reference-free properties into a single automaton.
+# A property is reference-free when it has no time bound and none of its
+# predicates refers to other events, so that its monitor needs nothing but
+# its state: each message moves it according to which of its predicates
+# hold. The predicates of each topic are numbered, and a message becomes a
+# bitmask of the predicates that it satisfies. Each property yields a small
+# automaton over these bitmasks, which is minimized; their product is then
+# explored at runtime (see `hplrv.runtime.ProductAutomaton`).
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, range, str
+
+from .constants import INF, STATE_FALSE, STATE_TRUE
+from .monitors import new_builder
+from .optimization import predicate_key
+
+
+###############################################################################
+# Eligibility
+###############################################################################
+
+def is_reference_free(hpl_property):
+    if hpl_property.pattern.max_time != INF:
+        return False
+    for event in hpl_property.events():
+        for e in event.simple_events():
+            phi = e.predicate
+            if not phi.is_vacuous and phi.external_references():
+                return False
+    return True
+
+def reference_free_properties(hpl_properties):
+    # splits properties into those that can be compiled into a product
+    # automaton and the others
+    product = []
+    others = []
+    for p in hpl_properties:
+        if is_reference_free(p):
+            product.append(p)
+        else:
+            others.append(p)
+    return product, others
+
+
+###############################################################################
+# Component Automata
+###############################################################################
+
+# beyond this number of predicates per topic, a component is not minimized
+MAX_MINIMIZED_BITS = 10
+
+
+class ComponentAutomaton(object):
+    # The automaton of one property, over the predicate bitmasks of its
+    # topics. States are numbered from 0, `initial` being the first state.
+    # delta: [{state: [(bit, target, verdict)]}], one dict per topic index;
+    #   transitions are tried in order and the first whose bit is set in
+    #   the mask fires (a zero bit always fires); target is a state, and
+    #   verdict is True, False or None
+    __slots__ = ('initial', 'delta', 'num_states')
+
+    def __init__(self, builder, bits):
+        # bits: {topic: {predicate key: bit}}, extended with new predicates
+        # topic indices follow the insertion order of `bits`
+        for topic in builder.on_msg:
+            bits.setdefault(topic, {})
+        topics = list(bits)
+        states = [builder.initial_state]
+        numbers = {builder.initial_state: 0}
+        def number(s):
+            if s not in numbers:
+                numbers[s] = len(states)
+                states.append(s)
+            return numbers[s]
+        delta = [{} for _ in topics]
+        for topic, handlers in builder.on_msg.items():
+            table = delta[topics.index(topic)]
+            for state, events in handlers.items():
+                transitions = []
+                for event in events:
+                    phi = event.predicate
+                    if phi.is_vacuous and not phi.is_true:
+                        continue # never fires
+                    bit = 0
+                    if not phi.is_vacuous:
+                        keys = bits[topic]
+                        key = predicate_key(phi)
+                        if key not in keys:
+                            keys[key] = 1 << len(keys)
+                        bit = keys[key]
+                    ir = builder._ir_transition(event, topic, state)
+                    target = None if ir is None else ir['target']
+                    if target is None:
+                        target = state
+                    verdict = None
+                    if target == STATE_TRUE:
+                        verdict = True
+                    elif target == STATE_FALSE:
+                        verdict = False
+                    transitions.append((bit, number(target), verdict))
+                    if bit == 0:
+                        break # the others are unreachable
+                table[number(state)] = transitions
+        self.initial = 0
+        self.delta = delta
+        self.num_states = len(states)
+        self._minimize()
+
+    def step(self, topic, state, mask):
+        for bit, target, verdict in self.delta[topic].get(state, ()):
+            if mask & bit == bit:
+                return target, verdict
+        return state, None
+
+    def care(self, topic, state):
+        # the bits that may change what happens in `state`
+        mask = 0
+        for bit, _, _ in self.delta[topic].get(state, ()):
+            mask |= bit
+        return mask
+
+    def _minimize(self):
+        # Moore's partition refinement, for a machine with outputs on its
+        # transitions: two states are equivalent if they give the same
+        # verdicts for all sequences of masks. Verdict states have no
+        # transitions, so they end up in a single block.
+        alphabet = []
+        for topic in range(len(self.delta)):
+            used = 0
+            for s in range(self.num_states):
+                used |= self.care(topic, s)
+            singles = [1 << i for i in range(used.bit_length())
+                       if used & (1 << i)]
+            if len(singles) > MAX_MINIMIZED_BITS:
+                return
+            for n in range(1 << len(singles)):
+                mask = 0
+                for i in range(len(singles)):
+                    if n & (1 << i):
+                        mask |= singles[i]
+                alphabet.append((topic, mask))
+        blocks = [0] * self.num_states
+        num_blocks = 1
+        while True:
+            signatures = {}
+            new_blocks = []
+            for s in range(self.num_states):
+                sig = [blocks[s]]
+                for topic, mask in alphabet:
+                    target, verdict = self.step(topic, s, mask)
+                    sig.append((blocks[target], verdict))
+                new_blocks.append(signatures.setdefault(
+                    tuple(sig), len(signatures)))
+            blocks = new_blocks
+            if len(signatures) == num_blocks:
+                break
+            num_blocks = len(signatures)
+        if num_blocks == self.num_states:
+            return
+        # renumber, so that the block of the initial state is 0
+        order = {}
+        for s in range(self.num_states):
+            order.setdefault(blocks[s], len(order))
+        delta = []
+        for table in self.delta:
+            merged = {}
+            for s, transitions in table.items():
+                b = order[blocks[s]]
+                if b not in merged:
+                    merged[b] = [(bit, order[blocks[target]], verdict)
+                                 for bit, target, verdict in transitions]
+            delta.append(merged)
+        self.delta = delta
+        self.num_states = num_blocks
+
+
+###############################################################################
+# Product Automaton
+###############################################################################
+
+class ProductSpec(object):
+    # What the generated class needs to build its product automaton.
+    # predicates: [(topic, [HplPredicate])], the i-th predicate of a topic
+    #   being bit `1 << i` of its masks
+    # components: [[{state: ((bit, target, verdict),)}]], per property and
+    #   topic index, without no-op transitions at the end
+    # initial: (int,), the initial state of each component
+    __slots__ = ('predicates', 'components', 'initial')
+
+    def __init__(self, hpl_properties):
+        bits = {}
+        first = {} # (topic, key) -> HplPredicate
+        automata = []
+        for p in hpl_properties:
+            if not is_reference_free(p):
+                raise ValueError('not a reference-free property: ' + str(p))
+            builder = new_builder(p)
+            automata.append(ComponentAutomaton(builder, bits))
+            for topic, states in builder.on_msg.items():
+                for events in states.values():
+                    for event in events:
+                        if not event.predicate.is_vacuous:
+                            k = (topic, predicate_key(event.predicate))
+                            first.setdefault(k, event.predicate)
+        self.predicates = []
+        for topic, keys in bits.items():
+            phis = [None] * len(keys)
+            for key, bit in keys.items():
+                phis[bit.bit_length() - 1] = first[(topic, key)]
+            self.predicates.append((topic, phis))
+        self.components = []
+        for automaton in automata:
+            tables = []
+            for t in range(len(bits)):
+                table = {}
+                delta = automaton.delta[t] if t < len(automaton.delta) else {}
+                for state, transitions in sorted(delta.items()):
+                    transitions = list(transitions)
+                    while transitions and transitions[-1][1:] == (state, None):
+                        transitions.pop()
+                    if transitions:
+                        table[state] = tuple(transitions)
+                tables.append(table)
+            self.components.append(tables)
+        self.initial = tuple(a.initial for a in automata)
@@ -9,94 +9,513 @@
 ###############################################################################
 
 from __future__ import unicode_literals
-from builtins import object, str
+from builtins import object, range, str
+from collections import OrderedDict, namedtuple
+from multiprocessing import Pool, cpu_count
+import pickle
+from threading import Lock
 
-from jinja2 import Environment, PackageLoader
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
 
-from .monitors import (
-    AbsenceBuilder, ExistenceBuilder, RequirementBuilder, ResponseBuilder,
-    PreventionBuilder,
+from .caching import (
+    CodeCache, property_digest, render_key, templates_digest
 )
+from .fusion import FusedProperty, inline_returns
+from .monitors import new_builder
+from .optimization import (
+    CodeOptions, PredicateTable, code_options, hoist_accessors,
+    hoist_members, project_records, share_predicates, vectorize_predicate,
+    vectorize_quantifiers
+)
+from .product import ProductSpec
+from .runtime import monitor_globals, np, runtime_source
 
 
 ###############################################################################
-# Public Interface
+# Jinja Environments
 ###############################################################################
 
-class TemplateRenderer(object):
-    def __init__(self):
-        self.jinja_env = Environment(
+# Environments are shared by all renderers within the same process, so that
+# templates are only compiled once. They are keyed by bytecode cache directory.
+_environments = {}
+
+def _jinja_environment(bytecode_cache_dir=None):
+    env = _environments.get(bytecode_cache_dir)
+    if env is None:
+        bytecode_cache = None
+        if bytecode_cache_dir is not None:
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+        env = Environment(
             loader=PackageLoader('hplrv', 'templates'),
+            bytecode_cache=bytecode_cache,
+            auto_reload=False,
             line_statement_prefix=None,
             line_comment_prefix=None,
             trim_blocks=True,
             lstrip_blocks=True,
             autoescape=False
         )
+        env.filters['hoist_accessors'] = hoist_accessors
+        env.filters['hoist_members'] = hoist_members
+        env.filters['inline_returns'] = inline_returns
+        env = _environments.setdefault(bytecode_cache_dir, env)
+    return env
+
+
+###############################################################################
+# Parallel Rendering
+###############################################################################
+
+RenderResult = namedtuple('RenderResult', ('code', 'error'))
+
+# one renderer per worker process
+_worker_renderer = None
+
+def _init_worker(bytecode_cache_dir):
+    global _worker_renderer
+    _worker_renderer = TemplateRenderer(
+        bytecode_cache_dir=bytecode_cache_dir, preload=True)
+
+def _render_job(job):
+    return _worker_renderer._try_render_class(*job)
+
+def _picklable_error(e):
+    try:
+        pickle.dumps(e)
+        return e
+    except Exception:
+        return RuntimeError('{}: {}'.format(type(e).__name__, e))
+
+
+###############################################################################
+# Helper Functions
+###############################################################################
+
+def _write_stripped(chunks, sink, encoding=None):
+    # writes chunks of text to a file-like sink, as `text.strip()` would
+    started = False
+    pending = ''
+    for chunk in chunks:
+        if not started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                continue
+            started = True
+        text = chunk.rstrip()
+        if text:
+            tail = chunk[len(text):]
+            text = pending + text
+            pending = tail
+            sink.write(text if encoding is None else text.encode(encoding))
+        else:
+            pending += chunk
+
+
+###############################################################################
+# Public Interface
+###############################################################################
 
-    def render_rospy_node(self, hpl_properties, topic_types):
+class TemplateRenderer(object):
+    def __init__(self, bytecode_cache_dir=None, preload=False,
+                 render_cache=None, code_cache=None, max_classes=1024):
+        # bytecode_cache_dir: str|None, where to store compiled templates
+        # preload: bool, whether to compile all templates right away
+        # render_cache: RenderCache|None, where to store rendered monitors
+        # code_cache: CodeCache|None, where to store compiled monitors
+        # max_classes: int, maximum number of monitor classes kept by
+        #   `build_monitor_class` (least recently used first), 0 for none
+        if max_classes < 0:
+            raise ValueError('max_classes must not be negative: '
+                             + str(max_classes))
+        self.bytecode_cache_dir = bytecode_cache_dir
+        self.jinja_env = _jinja_environment(bytecode_cache_dir)
+        self.render_cache = render_cache
+        self.code_cache = code_cache if code_cache is not None else CodeCache()
+        self.max_classes = max_classes
+        self._templates_digest = None
+        self._lock = Lock()
+        self._classes = OrderedDict()
+        if preload:
+            self.preload_templates()
+
+    def preload_templates(self):
+        for template_file in self.jinja_env.list_templates(extensions='jinja'):
+            self.jinja_env.get_template(template_file)
+
+    def render_rospy_node(self, hpl_properties, topic_types, jobs=1,
+                          share_predicates=False, options=None,
+                          fuse_monitors=False):
+        # share_predicates: bool, whether to evaluate predicates that are
+        #   common to multiple monitors only once per message, in the node
+        # options: CodeOptions|int|None, applied to all monitor classes;
+        #   an int is an optimization level (see CodeOptions.from_level)
+        # fuse_monitors: bool, whether to generate a single monitor class
+        #   for all properties (see `render_fused_monitor`)
+        options = code_options(options)
+        if fuse_monitors and share_predicates:
+            raise ValueError('fused monitors do not share predicates')
+        data, builders = self._node_data(hpl_properties, topic_types,
+            share_predicates=share_predicates, options=options)
+        shared = data['shared_indices']
+        if fuse_monitors:
+            data['fused'] = True
+            data['class_names'] = ['FusedMonitor']
+            data['monitor_classes'] = [self._render_fused_class(
+                builders, 'FusedMonitor', options)]
+            data['callbacks'] = {topic: set((0,))
+                                 for topic in data['callbacks']}
+            data['timed_monitors'] = [0] if data['timed_monitors'] else []
+        elif jobs == 1:
+            data['monitor_classes'] = [self._render_monitor_class(
+                p, builder.class_name, builder=builder,
+                template_file=template_file, shared=shared, options=options)
+                for p, builder, template_file in builders]
+        else:
+            results = self._render_classes(
+                [(p, builder.class_name, shared, options)
+                 for p, builder, _ in builders], jobs)
+            for result in results:
+                if result.error is not None:
+                    raise result.error
+            data['monitor_classes'] = [result.code for result in results]
+        return self._render_template('node.python.jinja', data)
+
+    def stream_rospy_node(self, hpl_properties, topic_types, sink,
+                          encoding=None, share_predicates=False,
+                          options=None):
+        # Same as `render_rospy_node`, but writes the generated code to a
+        # file-like `sink` as it is produced, one monitor class at a time.
+        # builders are discarded after the first pass and built again later,
+        # so that only one of them is alive at any given time
+        options = code_options(options)
+        data, builders = self._node_data(hpl_properties, topic_types,
+            keep_builders=False, share_predicates=share_predicates,
+            options=options)
+        shared = data['shared_indices']
+        data['monitor_classes'] = (self._render_monitor_class(
+            p, class_name, shared=shared, options=options)
+            for p, class_name in builders)
+        template = self.jinja_env.get_template('node.python.jinja')
+        _write_stripped(template.generate(**data), sink, encoding=encoding)
+
+    def _node_data(self, hpl_properties, topic_types, keep_builders=True,
+                   share_predicates=False, options=None):
+        # the node publishes verdicts through these hooks
+        if options is not None and set(options.unused_hooks) & set(
+                ('on_success', 'on_violation')):
+            raise ValueError('ROS nodes use on_success and on_violation')
         class_names = []
         topics = {}
         callbacks = {}
-        monitor_classes = []
+        timed_monitors = []
+        routing = []
+        builders = []
+        table = PredicateTable() if share_predicates else None
         for p in hpl_properties:
-            builder, template_file = self._template(p, True)
+            builder, template_file = self._template(p)
             i = len(class_names)
             builder.class_name = 'Property{}Monitor'.format(i)
             class_names.append(builder.class_name)
+            if builder.timeout > 0.0:
+                timed_monitors.append(i)
+            routing.append(builder.state_topics)
             for name in builder.on_msg:
                 topics[name] = topic_types[name]
                 if name not in callbacks:
                     callbacks[name] = set()
                 callbacks[name].add(i)
-            data = {'state_machine': builder}
-            monitor_classes.append(self._render_template(template_file, data))
+            if table is not None:
+                table.add(builder, i)
+            if keep_builders:
+                builders.append((p, builder, template_file))
+            else:
+                builders.append((p, builder.class_name))
         ros_imports = {'std_msgs'}
         for name in topics.values():
             pkg, msg = name.split('/')
             ros_imports.add(pkg)
+        if table is None:
+            table = PredicateTable()
+        table.finalize()
+        if options is not None and options.numpy_quantifiers:
+            for predicates in table.predicates.values():
+                predicates[:] = [vectorize_predicate(p) for p in predicates]
+        options = options or CodeOptions()
+        if options.join_indices:
+            classes = ('TimestampPool', 'KeyedPool', 'IndexedPool')
+        elif options.timestamp_pool:
+            classes = ('TimestampPool',)
+        else:
+            classes = ()
+        if table.predicates:
+            classes += ('PredicateError',)
         data = {
             'class_names': class_names,
-            'monitor_classes': monitor_classes,
             'topics': topics,
-            'ros_imports': ros_imports,
+            'ros_imports': sorted(ros_imports),
             'callbacks': callbacks,
+            'timed_monitors': timed_monitors,
+            'routing': routing,
+            'shared_indices': table.indices,
+            'shared_predicates': table.predicates,
+            'shared_callers': table.callers,
+            'num_properties': len(class_names),
+            'fused': False,
+            'options': options,
+            'runtime_classes': runtime_source(classes),
         }
-        return self._render_template('node.python.jinja', data)
+        return data, builders
 
     def render_monitor(self, hpl_property, class_name=None, id_as_class=True,
-            encoding=None):
-        builder, template_file = self._template(hpl_property, id_as_class)
-        if class_name:
+            encoding=None, options=None):
+        options = code_options(options)
+        if not class_name:
+            class_name = self._class_name(hpl_property, id_as_class)
+        text = self._render_monitor_class(hpl_property, class_name,
+                                          options=options)
+        if encoding is None:
+            return text
+        return text.encode(encoding)
+
+    def build_monitor_class(self, hpl_property, class_name=None,
+                            id_as_class=True, options=None):
+        # Renders and executes a monitor class, returning the class object.
+        # Classes are memoized per property, class name and options, so
+        # that building the same class again returns the same object;
+        # compiled code is memoized in `self.code_cache`.
+        options = code_options(options)
+        if options is not None and options.numpy_quantifiers and np is None:
+            raise ImportError('numpy_quantifiers requires numpy')
+        if not class_name:
+            class_name = self._class_name(hpl_property, id_as_class)
+        key = None
+        if self.max_classes > 0:
+            key = self._class_key(hpl_property, class_name, options=options)
+            with self._lock:
+                cls = self._classes.pop(key, None)
+                if cls is not None:
+                    self._classes[key] = cls # most recently used
+                    return cls
+        text = self._render_monitor_class(hpl_property, class_name,
+                                          options=options)
+        code = self.code_cache.compile(text, '<hplrv:{}>'.format(class_name))
+        namespace = monitor_globals()
+        exec(code, namespace)
+        cls = namespace[class_name]
+        if key is not None:
+            with self._lock:
+                self._classes[key] = cls
+                while len(self._classes) > self.max_classes:
+                    self._classes.popitem(last=False)
+        return cls
+
+    def render_fused_monitor(self, hpl_properties, class_name='FusedMonitor',
+                             encoding=None, options=None):
+        # Renders a single monitor class for all properties, with one lock
+        # and one callback per topic. Verdicts and witnesses are tuples,
+        # in the order of the properties, and hooks get the index of the
+        # property as their first argument.
+        options = code_options(options)
+        builders = []
+        for p in hpl_properties:
+            builder, template_file = self._template(p)
+            builder.class_name = class_name
+            builders.append((p, builder, template_file))
+        text = self._render_fused_class(builders, class_name, options)
+        if encoding is None:
+            return text
+        return text.encode(encoding)
+
+    def build_fused_monitor_class(self, hpl_properties,
+                                  class_name='FusedMonitor', options=None):
+        # Same as `build_monitor_class`, for `render_fused_monitor`.
+        options = code_options(options)
+        if options is not None and options.numpy_quantifiers and np is None:
+            raise ImportError('numpy_quantifiers requires numpy')
+        text = self.render_fused_monitor(hpl_properties,
+            class_name=class_name, options=options)
+        code = self.code_cache.compile(text, '<hplrv:{}>'.format(class_name))
+        namespace = monitor_globals()
+        exec(code, namespace)
+        return namespace[class_name]
+
+    def render_product_monitor(self, hpl_properties,
+                               class_name='ProductMonitor', encoding=None):
+        # Renders a single table-driven monitor class for properties without
+        # time bounds nor references between events (see `hplrv.product`).
+        # Each message costs one predicate bitmask and one table lookup.
+        # Verdicts and witnesses are tuples, in the order of the properties,
+        # and hooks get the index of the property as their first argument.
+        # Witnesses hold only the message that decided the verdict.
+        spec = ProductSpec(hpl_properties)
+        data = {
+            'class_name': class_name,
+            'spec': spec,
+            'prop_ids': [p.metadata.get('id') for p in hpl_properties],
+        }
+        return self._render_template('product.python.jinja', data,
+                                     encoding=encoding)
+
+    def build_product_monitor_class(self, hpl_properties,
+                                    class_name='ProductMonitor'):
+        # Same as `build_monitor_class`, for `render_product_monitor`.
+        text = self.render_product_monitor(hpl_properties,
+                                           class_name=class_name)
+        code = self.code_cache.compile(text, '<hplrv:{}>'.format(class_name))
+        namespace = monitor_globals()
+        exec(code, namespace)
+        return namespace[class_name]
+
+    def render_many(self, hpl_properties, jobs=1, id_as_class=True,
+                    encoding=None, options=None):
+        # Renders a monitor class for each property, using `jobs` worker
+        # processes (all available CPUs if `jobs` is None or zero).
+        # Returns a list of RenderResult, in the same order as the input.
+        # Errors are reported per property, and do not stop the others.
+        options = code_options(options)
+        jobs_list = [(p, self._class_name(p, id_as_class), None, options)
+                     for p in hpl_properties]
+        results = self._render_classes(jobs_list, jobs)
+        if encoding is not None:
+            results = [RenderResult(r.code.encode(encoding), None)
+                       if r.error is None else r for r in results]
+        return results
+
+    def _render_classes(self, jobs_list, jobs):
+        results = [None] * len(jobs_list)
+        pending = []
+        for i in range(len(jobs_list)):
+            if self.render_cache is not None:
+                key = self._class_key(*jobs_list[i])
+                text = self.render_cache.get(key)
+                if text is not None:
+                    results[i] = RenderResult(text, None)
+                    continue
+            pending.append(i)
+        if not jobs:
+            jobs = cpu_count()
+        jobs = min(jobs, len(pending))
+        if jobs <= 1:
+            for i in pending:
+                results[i] = self._try_render_class(*jobs_list[i])
+        else:
+            chunksize = max(1, len(pending) // (jobs * 4))
+            pool = Pool(jobs, _init_worker, (self.bytecode_cache_dir,))
+            try:
+                rendered = pool.map(_render_job,
+                    [jobs_list[i] for i in pending], chunksize)
+            finally:
+                pool.close()
+                pool.join()
+            for i, result in zip(pending, rendered):
+                results[i] = result
+                if result.error is None and self.render_cache is not None:
+                    key = self._class_key(*jobs_list[i])
+                    self.render_cache.put(key, result.code)
+        return results
+
+    def _try_render_class(self, hpl_property, class_name, shared=None,
+                          options=None):
+        try:
+            code = self._render_monitor_class(hpl_property, class_name,
+                                              shared=shared, options=options)
+            return RenderResult(code, None)
+        except Exception as e:
+            return RenderResult(None, _picklable_error(e))
+
+    def _render_monitor_class(self, hpl_property, class_name, builder=None,
+                              template_file=None, shared=None, options=None):
+        # shared: dict|None, indices of predicates computed by the node
+        # options: CodeOptions|None, optional code transformations
+        key = None
+        if self.render_cache is not None:
+            key = self._class_key(hpl_property, class_name, shared, options)
+            text = self.render_cache.get(key)
+            if text is not None:
+                return text
+        if builder is None:
+            builder, template_file = self._template(hpl_property)
             builder.class_name = class_name
+        if shared:
+            share_predicates(builder, shared)
+        if options is not None:
+            builder.options = options
+            if options.project_fields:
+                project_records(builder, options.full_witness)
+            if options.numpy_quantifiers:
+                vectorize_quantifiers(builder)
         data = {'state_machine': builder}
-        return self._render_template(template_file, data, encoding=encoding)
-
-    def _template(self, hpl_property, id_as_class):
-        if hpl_property.pattern.is_absence:
-            builder = AbsenceBuilder(hpl_property)
-            template_file = 'absence.python.jinja'
-        elif hpl_property.pattern.is_existence:
-            builder = ExistenceBuilder(hpl_property)
-            template_file = 'existence.python.jinja'
-        elif hpl_property.pattern.is_requirement:
-            builder = RequirementBuilder(hpl_property)
-            if not builder.has_trigger_refs:
-                template_file = 'requirement-simple.python.jinja'
-            else:
-                template_file = 'requirement-refs.python.jinja'
-        elif hpl_property.pattern.is_response:
-            builder = ResponseBuilder(hpl_property)
-            template_file = 'response.python.jinja'
-        elif hpl_property.pattern.is_prevention:
-            builder = PreventionBuilder(hpl_property)
-            template_file = 'prevention.python.jinja'
+        text = self._render_template(template_file, data)
+        if key is not None:
+            self.render_cache.put(key, text)
+        return text
+
+    def _render_fused_class(self, builders, class_name, options):
+        # builders: [(HplProperty, builder, template file)]
+        # each property is rendered on its own, without lock, hoisting nor
+        # batch callbacks, and then its members are renamed and merged into
+        # the fused class, which has batch callbacks of its own
+        options = options or CodeOptions()
+        if options.state_dispatch or options.state_routing:
+            raise ValueError('fused monitors have no per-property dispatch')
+        per_property = options._replace(elide_lock=True,
+                                        hoist_accessors=False,
+                                        batch_callbacks=False)
+        properties = []
+        callbacks = {}
+        for p, builder, template_file in builders:
+            i = len(properties)
+            text = self._render_monitor_class(p, builder.class_name,
+                builder=builder, template_file=template_file,
+                options=per_property)
+            fused = FusedProperty(i, text)
+            properties.append(fused)
+            for topic in fused.callbacks:
+                callbacks.setdefault(topic, []).append(fused)
+        data = {
+            'class_name': class_name,
+            'properties': properties,
+            'callbacks': callbacks,
+            'options': options,
+        }
+        return self._render_template('fused.python.jinja', data)
+
+    def _class_key(self, hpl_property, class_name, shared=None,
+                   options=None):
+        parts = [class_name]
+        if options is not None and options != CodeOptions():
+            parts.append(repr(options))
+        if shared:
+            # only the shared predicates of this property's topics matter
+            topics = set(e.topic for event in hpl_property.events()
+                         for e in event.simple_events())
+            for topic in sorted(topics):
+                indices = shared.get(topic, {})
+                parts.extend('{}:{}:{}'.format(topic, k, i)
+                             for k, i in sorted(indices.items()))
+        return self._cache_key(hpl_property, *parts)
+
+    def _cache_key(self, hpl_property, *options):
+        if self._templates_digest is None:
+            self._templates_digest = templates_digest(self.jinja_env)
+        return render_key(self._templates_digest,
+                          property_digest(hpl_property), *options)
+
+    def _class_name(self, hpl_property, id_as_class):
+        if not id_as_class:
+            return 'PropertyMonitor'
+        name = hpl_property.metadata.get('id', 'Property')
+        name = ''.join(word.title() for word in name.split("_") if word)
+        return name + 'Monitor'
+
+    def _template(self, hpl_property):
+        builder = new_builder(hpl_property)
+        if builder.pattern != 'requirement':
+            template_file = builder.pattern + '.python.jinja'
+        elif not builder.has_trigger_refs:
+            template_file = 'requirement-simple.python.jinja'
         else:
-            raise ValueError('unknown pattern: ' + str(hpl_property.pattern))
-        if id_as_class:
-            name = hpl_property.metadata.get('id', 'Property')
-            name = ''.join(word.title() for word in name.split("_") if word)
-            builder.class_name = name + 'Monitor'
+            template_file = 'requirement-refs.python.jinja'
         return (builder, template_file)
 
     def _render_template(self, template_file, data, strip=True, encoding=None):
@@ -0,0 +1,558 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Global names that generated monitor classes expect to find when they are
+# executed. This mirrors the preamble of the generated ROS nodes.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from bisect import bisect_left, bisect_right
+from builtins import object, range, str
+from collections import deque, namedtuple
+from heapq import heappop, heappush
+import inspect
+from itertools import islice
+from math import pi as PI
+from math import e as E
+from math import (
+    ceil, floor, log, log10, sqrt,
+    acos, asin, atan, atan2, cos, sin, tan,
+    degrees, radians
+)
+from threading import Lock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+###############################################################################
+# Constants and Data Structures
+###############################################################################
+
+INF = float("inf")
+NAN = float("nan")
+
+MsgRecord = namedtuple('MsgRecord', ('topic', 'timestamp', 'msg'))
+
+
+class TimestampPool(object):
+    # Message records sorted by timestamp, for unbounded pools.
+    # Records usually arrive in order, and are appended to a sorted list, in
+    # amortized O(1). Records older than the newest one go to a heap instead,
+    # in O(log n). The oldest record is either at the head of the list or
+    # at the top of the heap, so it is found in O(1), and removed in O(log n)
+    # (amortized O(1) without late records). Removed records leave a gap at
+    # the head of the list, which is reclaimed once it grows larger than the
+    # live part. `expire` is O(log n) plus O(log n) per expired record.
+    # Equal timestamps keep their arrival order: late records are always
+    # older than the newest record of the list, and they are moved into the
+    # list whenever it empties or loses its newest record (`pop`).
+    __slots__ = ('_records', '_stamps', '_head', '_late', '_seq')
+
+    def __init__(self, records=()):
+        self._records = []
+        self._stamps = []
+        self._head = 0
+        self._late = [] # heap of (timestamp, arrival, MsgRecord)
+        self._seq = 0
+        for rec in records:
+            self.add(rec)
+
+    def add(self, rec):
+        stamp = rec.timestamp
+        stamps = self._stamps
+        if not stamps or stamp >= stamps[-1]:
+            self._records.append(rec)
+            stamps.append(stamp)
+        else:
+            self._seq += 1
+            heappush(self._late, (stamp, self._seq, rec))
+
+    def popleft(self):
+        if self._head >= len(self._records):
+            raise IndexError('pop from an empty pool')
+        late = self._late
+        if late and late[0][0] < self._stamps[self._head]:
+            return heappop(late)[2]
+        rec = self._records[self._head]
+        self._records[self._head] = None
+        self._head += 1
+        self._compact()
+        return rec
+
+    def pop(self):
+        if self._head >= len(self._records):
+            raise IndexError('pop from an empty pool')
+        if self._late:
+            self._merge_late()
+        self._stamps.pop()
+        rec = self._records.pop()
+        if self._head >= len(self._records):
+            self.clear()
+        return rec
+
+    def expire(self, stamp, timeout):
+        # drops all records for which `stamp - timestamp >= timeout`
+        return self._expire(stamp, timeout, False)
+
+    def _expire(self, stamp, timeout, keep):
+        # returns the dropped records if `keep`, or their number
+        late = self._late
+        expired = []
+        while late and (stamp - late[0][0]) >= timeout:
+            expired.append(heappop(late)[2])
+        lo = self._head
+        hi = len(self._stamps)
+        if lo >= hi or (stamp - self._stamps[lo]) < timeout:
+            return expired if keep else len(expired)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (stamp - self._stamps[mid]) >= timeout:
+                lo = mid + 1
+            else:
+                hi = mid
+        n = lo - self._head
+        if keep:
+            expired.extend(self._records[self._head:lo])
+        else:
+            n += len(expired)
+        self._records[self._head:lo] = [None] * (lo - self._head)
+        self._head = lo
+        self._compact()
+        return expired if keep else n
+
+    def clear(self):
+        self._records = []
+        self._stamps = []
+        self._head = 0
+        self._late = []
+
+    def _compact(self):
+        if self._head >= len(self._records):
+            if self._late:
+                self._merge_late()
+            else:
+                self.clear()
+        elif self._head > 32 and 2 * self._head > len(self._records):
+            del self._records[:self._head]
+            del self._stamps[:self._head]
+            self._head = 0
+
+    def _merge_late(self):
+        # moves the late records into the sorted list, in O(n)
+        records = list(self)
+        self.clear()
+        self._records = records
+        self._stamps = [rec.timestamp for rec in records]
+
+    def _oldest(self, stamp, ids):
+        # the first record in the pool, among those of `stamp` in `ids`
+        i = bisect_left(self._stamps, stamp, self._head)
+        while i < len(self._stamps) and self._stamps[i] == stamp:
+            if id(self._records[i]) in ids:
+                return self._records[i]
+            i += 1
+        return min(e for e in self._late if id(e[2]) in ids)[2]
+
+    def __len__(self):
+        return len(self._records) - self._head + len(self._late)
+
+    def __bool__(self):
+        return self._head < len(self._records)
+
+    __nonzero__ = __bool__
+
+    def __getitem__(self, i):
+        # the oldest and newest records are found in O(1), others in O(n)
+        # if there are late records
+        n = len(self)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError('pool index out of range')
+        if i == n - 1:
+            return self._records[-1]
+        late = self._late
+        if not late:
+            return self._records[self._head + i]
+        if i == 0:
+            if late[0][0] < self._stamps[self._head]:
+                return late[0][2]
+            return self._records[self._head]
+        return next(islice(self, i, None))
+
+    def __iter__(self):
+        if not self._late:
+            return islice(self._records, self._head, None)
+        return self._iter_merged()
+
+    def _iter_merged(self):
+        # on equal timestamps, records of the list come first
+        late = sorted(self._late)
+        j = 0
+        for i in range(self._head, len(self._records)):
+            stamp = self._stamps[i]
+            while j < len(late) and late[j][0] < stamp:
+                yield late[j][2]
+                j += 1
+            yield self._records[i]
+        for k in range(j, len(late)):
+            yield late[k][2]
+
+
+class KeyedPool(object):
+    # A TimestampPool with a hash index from join keys to records, so that
+    # the records that match a message are found without a scan.
+    # Records removed by key stay in the pool until they reach its head, or
+    # until they outnumber the live records, when the pool is rebuilt with
+    # only the live ones (amortized O(1) per removal).
+    __slots__ = ('_pool', '_index', '_keys')
+
+    def __init__(self):
+        self._pool = TimestampPool()
+        self._index = {} # join key -> [MsgRecord]
+        self._keys = {}  # id(MsgRecord) -> join key, for live records
+
+    def add(self, rec, key):
+        self._pool.add(rec)
+        bucket = self._index.get(key)
+        if bucket is None:
+            self._index[key] = [rec]
+        else:
+            bucket.append(rec)
+        self._keys[id(rec)] = key
+
+    def get(self, key):
+        return tuple(self._index.get(key, ()))
+
+    def discard(self, rec):
+        if id(rec) not in self._keys:
+            return
+        key = self._keys.pop(id(rec))
+        bucket = self._index[key]
+        for i in range(len(bucket)):
+            if bucket[i] is rec:
+                del bucket[i]
+                break
+        if not bucket:
+            del self._index[key]
+        while self._pool and id(self._pool[0]) not in self._keys:
+            self._pool.popleft()
+        dead = len(self._pool) - len(self._keys)
+        if dead > 32 and dead > len(self._keys):
+            keys = self._keys
+            self._pool = TimestampPool(r for r in self._pool if id(r) in keys)
+
+    def popleft(self):
+        rec = self._pool[0]
+        self.discard(rec)
+        return rec
+
+    def clear(self):
+        self._pool.clear()
+        self._index = {}
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __bool__(self):
+        return bool(self._keys)
+
+    __nonzero__ = __bool__
+
+    def __getitem__(self, i):
+        # only the oldest record is indexed; dead records never stay at the
+        # head of the pool, but they may be anywhere else
+        if i != 0 and i != -len(self._keys):
+            raise IndexError('only the oldest record of a KeyedPool is indexed')
+        return self._pool[0]
+
+    def __iter__(self):
+        keys = self._keys
+        return (rec for rec in self._pool if id(rec) in keys)
+
+
+class IndexedPool(object):
+    # A TimestampPool whose records are also kept in one or more indices,
+    # by keys computed when they are added. Hash indices answer `=` queries
+    # and sorted indices answer `<`, `<=`, `>` and `>=` queries.
+    # Records leave the indices when they leave the pool.
+    # Sorted indices are pairs of lists, searched in O(log n), but adding or
+    # removing a record shifts the lists, in O(n). Expiring many records at
+    # once rebuilds sorted indices in a single O(n) pass instead.
+    __slots__ = ('_pool', '_indices', '_keys')
+
+    # expiring more records than this rebuilds the sorted indices
+    BATCH_SIZE = 8
+
+    def __init__(self, kinds):
+        # kinds: sequence of 'hash' or 'sorted', one per index
+        self._pool = TimestampPool()
+        self._indices = tuple({} if kind == 'hash' else ([], [])
+                              for kind in kinds)
+        self._keys = {} # id(MsgRecord) -> keys
+
+    def add(self, rec, keys):
+        # keys: one per index, None if the record is not in that index
+        self._pool.add(rec)
+        self._keys[id(rec)] = keys
+        for index, key in zip(self._indices, keys):
+            if key is None or key != key:
+                continue # NaN is never equal to, or less than, anything
+            if isinstance(index, dict):
+                bucket = index.get(key)
+                if bucket is None:
+                    index[key] = [rec]
+                else:
+                    bucket.append(rec)
+            else:
+                i = bisect_right(index[0], key)
+                index[0].insert(i, key)
+                index[1].insert(i, rec)
+
+    def equal(self, i, key):
+        return self._indices[i].get(key, ())
+
+    def below(self, i, bound, inclusive=False):
+        # records whose key is less than (or equal to) `bound`
+        if bound != bound:
+            return ()
+        keys, recs = self._indices[i]
+        if inclusive:
+            j = bisect_right(keys, bound)
+        else:
+            j = bisect_left(keys, bound)
+        return (recs[k] for k in range(j))
+
+    def above(self, i, bound, inclusive=False):
+        # records whose key is greater than (or equal to) `bound`
+        if bound != bound:
+            return ()
+        keys, recs = self._indices[i]
+        if inclusive:
+            j = bisect_left(keys, bound)
+        else:
+            j = bisect_right(keys, bound)
+        return (recs[k] for k in range(len(recs) - 1, j - 1, -1))
+
+    def first(self, recs):
+        # the record of `recs` (a non-empty list) that comes first in the
+        # pool, i.e., the oldest one, or the oldest one inserted among ties
+        if len(recs) == 1:
+            return recs[0]
+        stamp = min(rec.timestamp for rec in recs)
+        ids = set(id(rec) for rec in recs if rec.timestamp == stamp)
+        if len(ids) == 1:
+            for rec in recs:
+                if rec.timestamp == stamp:
+                    return rec
+        return self._pool._oldest(stamp, ids)
+
+    def popleft(self):
+        rec = self._pool.popleft()
+        self._remove(rec)
+        return rec
+
+    def expire(self, stamp, timeout):
+        # drops all records for which `stamp - timestamp >= timeout`
+        expired = self._pool._expire(stamp, timeout, True)
+        if len(expired) <= self.BATCH_SIZE:
+            for rec in expired:
+                self._remove(rec)
+            return len(expired)
+        dead = set()
+        for rec in expired:
+            dead.add(id(rec))
+            keys = self._keys.pop(id(rec))
+            for index, key in zip(self._indices, keys):
+                if isinstance(index, dict) and key is not None and key == key:
+                    bucket = [r for r in index[key] if r is not rec]
+                    if bucket:
+                        index[key] = bucket
+                    else:
+                        del index[key]
+        for index in self._indices:
+            if not isinstance(index, dict):
+                live = [(key, rec) for key, rec in zip(*index)
+                        if id(rec) not in dead]
+                index[0][:] = [key for key, _ in live]
+                index[1][:] = [rec for _, rec in live]
+        return len(expired)
+
+    def clear(self):
+        self._pool.clear()
+        self._indices = tuple({} if isinstance(index, dict) else ([], [])
+                              for index in self._indices)
+        self._keys = {}
+
+    def _remove(self, rec):
+        keys = self._keys.pop(id(rec))
+        for index, key in zip(self._indices, keys):
+            if key is None or key != key:
+                continue
+            if isinstance(index, dict):
+                bucket = index[key]
+                for i in range(len(bucket)):
+                    if bucket[i] is rec:
+                        del bucket[i]
+                        break
+                if not bucket:
+                    del index[key]
+            else:
+                i = bisect_left(index[0], key)
+                while index[1][i] is not rec:
+                    i += 1
+                del index[0][i]
+                del index[1][i]
+
+    def __len__(self):
+        return len(self._pool)
+
+    def __bool__(self):
+        return bool(self._pool)
+
+    __nonzero__ = __bool__
+
+    def __getitem__(self, i):
+        return self._pool[i]
+
+    def __iter__(self):
+        return iter(self._pool)
+
+
+class ProductAutomaton(object):
+    # The product of the automata of many reference-free properties (see
+    # `hplrv.product`), built as it is explored. Product states are tuples
+    # of component states, numbered from 0 in order of discovery.
+    # Per topic index, `care[s]` tells which predicates matter in state `s`
+    # (a bool per bit, cheaper to test than bits of a long mask), and
+    # `delta` maps `(s, mask)`, with only those bits, to the next state and
+    # the verdicts `((property index, bool),)` of the transition.
+    # Monitors look up `delta` first, and call `step` on a miss.
+    __slots__ = ('components', 'widths', 'states', 'ids', 'care', 'delta',
+                 'initial', '_lock')
+
+    def __init__(self, components, initial, widths):
+        # components: [[{state: ((bit, target, verdict),)}]], per property
+        #   and topic index; the first transition whose bit is set in the
+        #   mask fires (a zero bit always fires)
+        # initial: (int,), the initial state of each component
+        # widths: (int,), the number of predicates of each topic index
+        self.components = components
+        self.widths = widths
+        self.states = []
+        self.ids = {}
+        self.care = [[] for _ in widths]
+        self.delta = [{} for _ in widths]
+        self._lock = Lock()
+        self.initial = self._intern(tuple(initial))
+
+    def step(self, topic, s, mask):
+        # topic: int, index of the topic
+        # mask: int, with only the bits in `care[topic][s]`
+        with self._lock:
+            key = (s, mask)
+            result = self.delta[topic].get(key)
+            if result is not None:
+                return result
+            state = self.states[s]
+            target = list(state)
+            verdicts = []
+            for i, component in enumerate(self.components):
+                transitions = component[topic].get(state[i])
+                if transitions is None:
+                    continue
+                for bit, t, verdict in transitions:
+                    if mask & bit == bit:
+                        target[i] = t
+                        if verdict is not None:
+                            verdicts.append((i, verdict))
+                        break
+            result = (self._intern(tuple(target)), tuple(verdicts))
+            self.delta[topic][key] = result
+            return result
+
+    def _intern(self, state):
+        s = self.ids.get(state)
+        if s is None:
+            s = len(self.states)
+            for t in range(len(self.care)):
+                mask = 0
+                for i, component in enumerate(self.components):
+                    for bit, _, _ in component[t].get(state[i], ()):
+                        mask |= bit
+                self.care[t].append(tuple(bool(mask & (1 << i))
+                                          for i in range(self.widths[t])))
+            self.states.append(state)
+            self.ids[state] = s
+        return s
+
+
+class PredicateError(object):
+    # Value of a shared predicate whose evaluation raised an exception
+    # (e.g., an index out of range). Testing it raises that exception,
+    # so that it reaches only the monitors that use the predicate, as if
+    # each had evaluated the predicate on its own.
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+    def __bool__(self):
+        raise self.error
+
+    __nonzero__ = __bool__ # Python 2
+
+
+###############################################################################
+# Helper Functions
+###############################################################################
+
+def prod(iterable):
+    x = 1
+    for y in iterable:
+        x = x * y
+        if x == 0:
+            return 0
+    return x
+
+def np_array(values):
+    # ROS `uint8[]` fields are byte strings, not sequences of numbers
+    if isinstance(values, (bytes, bytearray)):
+        return np.frombuffer(values, dtype=np.uint8)
+    return np.asarray(values)
+
+
+###############################################################################
+# Monitor Namespace
+###############################################################################
+
+MONITOR_GLOBALS = (
+    'object', 'range', 'str', 'deque', 'namedtuple', 'PI', 'E',
+    'ceil', 'floor', 'log', 'log10', 'sqrt',
+    'acos', 'asin', 'atan', 'atan2', 'cos', 'sin', 'tan',
+    'degrees', 'radians', 'Lock', 'INF', 'NAN', 'MsgRecord', 'prod',
+    'np', 'np_array', 'TimestampPool', 'KeyedPool', 'IndexedPool',
+    'ProductAutomaton',
+    'bisect_left', 'bisect_right', 'islice',
+)
+
+def monitor_globals():
+    # returns a fresh namespace in which to execute generated code
+    g = globals()
+    return {name: g[name] for name in MONITOR_GLOBALS}
+
+def runtime_source(names):
+    # source code of the given classes, for generated ROS nodes, which
+    # must run without `hplrv`; this module is their single definition
+    g = globals()
+    return '\n\n\n'.join(inspect.getsource(g[name]).rstrip()
+                          for name in names)
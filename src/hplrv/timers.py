@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Scheduling of `on_timer` calls for large numbers of monitors.
+# Monitors must be generated with `CodeOptions(next_deadline=True)`.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object
+from heapq import heappop, heappush
+from itertools import count
+from threading import Lock
+import time
+
+
+###############################################################################
+# Timer Scheduler
+###############################################################################
+
+class TimerScheduler(object):
+    # Min-heap of monitor deadlines. A tick pops only the expired entries,
+    # so its cost grows with the number of expirations, O(k log n), and not
+    # with the number of monitors.
+    # Entries are never removed from the middle of the heap; when a
+    # deadline changes, a new entry is pushed and the old one is discarded
+    # once it reaches the top (it no longer matches `_deadlines`).
+    # Time is whatever the monitors are fed with: wall-clock or simulated.
+
+    def __init__(self, clock=None):
+        # clock: callable that returns the current time, used by `tick()`
+        #   when no stamp is given (e.g., `rospy.get_time`)
+        self.clock = clock or time.time
+        self._lock = Lock()
+        self._heap = []
+        self._deadlines = {} # monitor -> deadline|None
+        self._counter = count() # breaks ties between equal deadlines
+
+    @property
+    def next_deadline(self):
+        # earliest pending deadline, or None
+        with self._lock:
+            heap = self._heap
+            while heap:
+                deadline, _, monitor = heap[0]
+                if self._deadlines.get(monitor) == deadline:
+                    return deadline
+                heappop(heap)
+        return None
+
+    def add(self, monitor):
+        with self._lock:
+            self._deadlines[monitor] = None
+            self._schedule(monitor)
+
+    def remove(self, monitor):
+        with self._lock:
+            del self._deadlines[monitor]
+
+    def update(self, monitor):
+        # must be called after the monitor's state or pool may have changed
+        # outside of `tick()`, e.g., after `on_launch` or message callbacks
+        with self._lock:
+            if monitor in self._deadlines:
+                self._schedule(monitor)
+
+    def tick(self, stamp=None):
+        # calls `on_timer(stamp)` on every monitor whose deadline expired;
+        # returns the number of calls
+        if stamp is None:
+            stamp = self.clock()
+        fired = []
+        with self._lock:
+            heap = self._heap
+            deadlines = self._deadlines
+            while heap and heap[0][0] <= stamp:
+                deadline, _, monitor = heappop(heap)
+                if deadlines.get(monitor) != deadline:
+                    continue # stale entry
+                deadlines[monitor] = None
+                monitor.on_timer(stamp)
+                fired.append(monitor)
+            # after the loop, so that a deadline that on_timer did not
+            # clear (e.g., a rounding error) does not fire again this tick
+            for monitor in fired:
+                self._schedule(monitor)
+        return len(fired)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, monitor):
+        return monitor in self._deadlines
+
+    def _schedule(self, monitor):
+        deadline = monitor.next_deadline
+        if deadline == self._deadlines[monitor]:
+            return
+        self._deadlines[monitor] = deadline
+        if deadline is not None:
+            heappush(self._heap, (deadline, next(self._counter), monitor))
@@ -8,7 +8,9 @@
 ###############################################################################
 
 from __future__ import unicode_literals
+from builtins import object, range
 from collections import namedtuple
+import random
 
 ###############################################################################
 # Constants
@@ -98,3 +100,54 @@ ARRAY_000 = Array((0, 0, 0))
 ARRAY_010 = Array((0, 1, 0))
 ARRAY_111 = Array((1, 1, 1))
 ARRAY_123 = Array((1, 2, 3))
+
+
+###############################################################################
+# Random Traces
+###############################################################################
+
+class Msg(object):
+    # a message with any fields, e.g., `Msg(x=1, y=2)`
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+# properties over TOPICS, with messages of random_trace
+PROPERTIES = (
+    'globally: no /a {x > 8}',
+    'after /p until /q: some /b {x > 5} within 2 s',
+    'after /p as P until /q: /b as B requires /a {x = @B.x} within 2 s',
+    'globally: /a as A causes /b {x > @A.x} within 1 s',
+    'after /p until /q: /a as A forbids /b {x > @A.x + 1} within 3 s',
+    'after /p as P until /p {x > 8}: /p {x > @P.x} causes /p {x < 2}',
+    'until /q {x > 5}: /b requires /a {x > 3}',
+)
+
+# properties with time bounds, and one without, for timers and deadlines
+TIMED_PROPERTIES = (
+    'globally: /a causes /b within 1 s',
+    'after /p until /q: no /a {x > 8} within 2 s',
+    'globally: /b as B requires /a {x = @B.x} within 1.5 s',
+    'globally: no /b {x > 8}',
+)
+
+TOPICS = ('/a', '/b', '/p', '/q')
+
+
+def new_msg(rng):
+    return Msg(x=rng.randint(0, 9))
+
+def random_trace(n, seed=0, topics=TOPICS, timers=0.1, new_msg=new_msg):
+    # returns [(topic, msg, stamp)], with `topic` None for timer events
+    # timers: float, probability of a timer event
+    # new_msg: function of a `random.Random`, returns a message
+    rng = random.Random(seed)
+    trace = []
+    t = 0.0
+    for i in range(n):
+        t += rng.choice((0.1, 0.5, 1.0))
+        if rng.random() < timers:
+            trace.append((None, None, t))
+        else:
+            trace.append((rng.choice(topics), new_msg(rng), t))
+    return trace
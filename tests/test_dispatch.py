@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, range
+import unittest
+
+from hpl.parser import property_parser
+
+from hplrv.dispatch import MonitorSet
+from hplrv.generic_monitor import StateMachineMonitor
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from .common_data import Msg, TIMED_PROPERTIES, TOPICS, random_trace
+
+###############################################################################
+# Test Cases
+###############################################################################
+
+class TestMonitorSet(unittest.TestCase):
+    def setUp(self):
+        p = property_parser()
+        self.hps = [p.parse(text) for text in TIMED_PROPERTIES]
+        r = TemplateRenderer()
+        self.classes = [r.build_monitor_class(hp) for hp in self.hps]
+        options = CodeOptions.from_level(3, state_dispatch=True,
+                                         next_deadline=True)
+        locked = CodeOptions(state_dispatch=True)
+        self.variants = [
+            lambda hp, cls: cls(),
+            lambda hp, cls: r.build_monitor_class(hp, options=options)(),
+            lambda hp, cls: r.build_monitor_class(hp, options=locked)(),
+            lambda hp, cls: StateMachineMonitor.from_property(hp),
+        ]
+
+    def test_same_behaviour(self):
+        # a MonitorSet vs. calling every monitor by hand
+        for seed in range(10):
+            expected = [cls() for cls in self.classes]
+            monitors = [make(hp, cls) for make in self.variants
+                        for hp, cls in zip(self.hps, self.classes)]
+            ms = MonitorSet(monitors)
+            assert len(ms) == len(monitors)
+            assert sorted(ms.topics) == ['/a', '/b', '/p', '/q']
+            for m in expected:
+                m.on_launch(0.0)
+            ms.on_launch(0.0)
+            # messages on an extra topic, which no monitor uses
+            events = random_trace(100, seed=seed, timers=0.0,
+                                  topics=TOPICS + ('/z',))
+            for i in range(0, len(events), 10):
+                batch = events[i:i+10]
+                for topic, msg, t in batch:
+                    for m in expected:
+                        cb = m.cb_map.get(topic)
+                        if cb is not None:
+                            cb(msg, t)
+                    for m in expected:
+                        m.on_timer(t)
+                if seed % 2:
+                    ms.dispatch_batch(batch)
+                else:
+                    for topic, msg, t in batch:
+                        n = ms.dispatch(topic, msg, t)
+                        assert n == sum(topic in m.cb_map for m in monitors)
+                ms.tick(batch[-1][2])
+                k = len(expected)
+                for j in range(len(monitors)):
+                    assert monitors[j].verdict == expected[j % k].verdict
+                    assert monitors[j].witness == expected[j % k].witness
+            ms.on_shutdown(100.0)
+
+    def test_membership(self):
+        m1 = self.classes[0]()
+        m2 = self.classes[3]()
+        ms = MonitorSet([m1])
+        ms.add(m2)
+        assert m1 in ms and m2 in ms
+        ms.on_launch(0.0)
+        assert ms.dispatch('/b', Msg(x=9), 0.5) == 2
+        assert m2.verdict is False
+        ms.remove(m2)
+        assert list(ms) == [m1]
+        assert ms.dispatch('/b', Msg(x=9), 0.6) == 1
+        assert ms.dispatch('/z', Msg(x=9), 0.7) == 0
+        with self.assertRaises(ValueError):
+            ms.remove(m2)
+
+    def test_tick(self):
+        r = TemplateRenderer()
+        timed = r.build_monitor_class(
+            self.hps[0], options=CodeOptions(next_deadline=True))()
+        polled = self.classes[0]()
+        ms = MonitorSet([timed, polled])
+        ms.on_launch(0.0)
+        # only monitors without `next_deadline` are called
+        assert ms.tick(0.5) == 1
+        ms.dispatch('/a', Msg(), 1.0)
+        assert ms.tick(1.5) == 1
+        assert ms.tick(2.0) == 2
+        assert timed.verdict is False and polled.verdict is False
+
+
+if __name__ == '__main__':
+    unittest.main()
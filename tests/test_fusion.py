@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, range
+import unittest
+
+from hpl.parser import property_parser
+
+from hplrv.fusion import FusedProperty, inline_callback
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from .common_data import E_TIMER, PROPERTIES, TOPICS, random_trace
+from .test_monitor_classes import all_types_of_property
+
+###############################################################################
+# Test Cases
+###############################################################################
+
+class TestFusedMonitor(unittest.TestCase):
+    def setUp(self):
+        p = property_parser()
+        self.renderer = TemplateRenderer()
+        self.hps = [p.parse(text) for text in PROPERTIES]
+
+    def test_inline_callback(self):
+        lines = [
+            '        if self._state_p0 == 2:',
+            '            for rec in self._pool_p0:',
+            '                if (rec.msg.x == msg.x):',
+            '                    return False',
+            '            self._state_p0 = -2',
+            '            return True',
+            '        if self._state_p0 == 3:',
+            '            if (msg.x > 2):',
+            '                self._state_p0 = 2',
+            '                return True',
+            '            self._pool_p0.clear()',
+            '            return True',
+            '        return False',
+        ]
+        expected = [
+            '        if self._state_p0 == 2:',
+            '            for rec in self._pool_p0:',
+            '                if (rec.msg.x == msg.x):',
+            '                    break',
+            '            else:',
+            '                self._state_p0 = -2',
+            '        elif self._state_p0 == 3:',
+            '            if (msg.x > 2):',
+            '                self._state_p0 = 2',
+            '            else:',
+            '                self._pool_p0.clear()',
+        ]
+        assert inline_callback(lines) == expected
+
+    def test_rendering(self):
+        code = self.renderer.render_fused_monitor(self.hps)
+        assert code.startswith('class FusedMonitor(object):')
+        # launch, shutdown, timer, and one per topic
+        assert code.count('        with self._lock:\n') == 3 + len(TOPICS)
+        assert code.count('    def on_msg_') == len(TOPICS)
+        assert 'return False' not in code
+        assert 'self.on_violation(3, stamp, self.witness_p3)' in code
+        code = self.renderer.render_fused_monitor(self.hps, options=3)
+        assert '        with self._lock:\n' not in code
+        with self.assertRaises(ValueError):
+            self.renderer.render_fused_monitor(
+                self.hps, options=CodeOptions(state_dispatch=True))
+
+    def test_same_behaviour(self):
+        # fused monitor vs. one monitor per property
+        for options in (CodeOptions(), CodeOptions(next_deadline=True),
+                        CodeOptions.from_level(3, hoist_accessors=True,
+                                               project_fields=True)):
+            classes = [self.renderer.build_monitor_class(hp, options=options)
+                       for hp in self.hps]
+            fused_class = self.renderer.build_fused_monitor_class(
+                self.hps, options=options)
+            for seed in range(10):
+                monitors = [cls() for cls in classes]
+                fused = fused_class()
+                log1 = []
+                log2 = []
+                for i in range(len(monitors)):
+                    monitors[i].on_violation = (lambda i: lambda stamp, w:
+                        log1.append((i, stamp, list(w))))(i)
+                    monitors[i].on_launch(0.0)
+                fused.on_violation = lambda i, stamp, w: log2.append(
+                    (i, stamp, list(w)))
+                fused.on_launch(0.0)
+                for topic, msg, t in random_trace(200, seed=seed):
+                    if topic is None:
+                        for m in monitors:
+                            m.on_timer(t)
+                        fused.on_timer(t)
+                        continue
+                    for m in monitors:
+                        cb = m.cb_map.get(topic)
+                        if cb is not None:
+                            cb(msg, t)
+                    fused.cb_map[topic](msg, t)
+                    if options.next_deadline:
+                        deadlines = [m.next_deadline for m in monitors
+                                     if m.next_deadline is not None]
+                        assert fused.next_deadline == (
+                            min(deadlines) if deadlines else None)
+                assert fused.verdicts == tuple(m.verdict for m in monitors)
+                assert fused.witnesses == tuple(m.witness for m in monitors)
+                assert log1 == log2
+
+    def test_batch_callbacks(self):
+        # runs of messages of the same topic at once vs. one by one
+        plain = self.renderer.build_fused_monitor_class(self.hps)
+        for options in (CodeOptions(batch_callbacks=True),
+                        CodeOptions.from_level(3, batch_callbacks=True)):
+            code = self.renderer.render_fused_monitor(self.hps,
+                                                      options=options)
+            assert code.count('    def on_msgs_') == len(TOPICS)
+            assert 'def _on_msg_' not in code
+            assert '_state_p3 = self._state_p3' in code
+            assert 'self._state_p3 = _state_p3 = ' in code
+            assert '        on_violation(3, stamp, self.witness_p3)' in code
+            batched = self.renderer.build_fused_monitor_class(
+                self.hps, options=options)
+            for seed in range(10):
+                expected = plain()
+                fused = batched()
+                expected.on_launch(0.0)
+                fused.on_launch(0.0)
+                trace = random_trace(200, seed=seed)
+                i = 0
+                while i < len(trace):
+                    topic, msg, t = trace[i]
+                    j = i + 1
+                    while topic and j < len(trace) and trace[j][0] == topic:
+                        j += 1
+                    if topic is None:
+                        expected.on_timer(t)
+                        fused.on_timer(t)
+                    else:
+                        for _, msg, t in trace[i:j]:
+                            expected.cb_map[topic](msg, t)
+                        name = 'on_msgs_' + topic.replace('/', '_')
+                        cb = getattr(fused, name)
+                        assert cb([e[1] for e in trace[i:j]],
+                                  [e[2] for e in trace[i:j]]) == j - i
+                    i = j
+                assert fused.verdicts == expected.verdicts
+                assert fused.witnesses == expected.witnesses
+
+    def test_all_types_of_property(self):
+        # every example property fuses (with a copy of itself, since the
+        # examples reuse topics with other types), and keeps its verdicts
+        p = property_parser()
+        for options in (CodeOptions(), CodeOptions(batch_callbacks=True),
+                        CodeOptions.from_level(3, hoist_accessors=True)):
+            for text, traces in all_types_of_property():
+                hp = p.parse(text)
+                cls = self.renderer.build_monitor_class(hp, options=options)
+                fused_class = self.renderer.build_fused_monitor_class(
+                    [hp, hp], options=options)
+                for trace in traces:
+                    m = cls()
+                    fused = fused_class()
+                    m.on_launch(0)
+                    fused.on_launch(0)
+                    for t, event in enumerate(trace, 1):
+                        if event.event == E_TIMER:
+                            m.on_timer(t)
+                            fused.on_timer(t)
+                        else:
+                            m.cb_map[event.topic](event.msg, t)
+                            if options.batch_callbacks:
+                                cb = getattr(fused, 'on_msgs_'
+                                             + event.topic.replace('/', '_'))
+                                cb([event.msg], [t])
+                            else:
+                                fused.cb_map[event.topic](event.msg, t)
+                        assert fused.verdicts == (m.verdict, m.verdict), text
+                        assert fused.witnesses == (m.witness, m.witness), text
+
+    def test_unknown_methods(self):
+        text = self.renderer.render_monitor(self.hps[0])
+        text += '\n\n    def on_msg_other(self, msg, stamp):\n        pass'
+        with self.assertRaises(ValueError):
+            FusedProperty(0, text)
+
+    def test_node_rendering(self):
+        topics = {t: 'geometry_msgs/Point' for t in TOPICS}
+        for options in (None, CodeOptions.from_level(3),
+                        CodeOptions(next_deadline=True)):
+            code = self.renderer.render_rospy_node(self.hps, topics,
+                options=options, fuse_monitors=True)
+            compile(code, '<node>', 'exec')
+            assert code.count('class ') == 2
+            assert 'self.monitor = FusedMonitor()' in code
+            assert 'self.monitors[0].on_msg__a(msg, t)' in code
+        with self.assertRaises(ValueError):
+            self.renderer.render_rospy_node(self.hps, topics,
+                share_predicates=True, fuse_monitors=True)
+        with self.assertRaises(ValueError):
+            self.renderer.render_rospy_node(self.hps, topics,
+                options=CodeOptions(state_routing=True), fuse_monitors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
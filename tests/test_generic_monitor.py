@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, range
+from functools import partial
+import unittest
+
+from hpl.parser import property_parser
+
+from hplrv import ir
+from hplrv.generic_monitor import (
+    MonitorProgram, StateMachineMonitor, compile_expression
+)
+from hplrv.monitors import build_ir
+from hplrv.rendering import TemplateRenderer
+
+from . import common_data as common
+from . import test_monitor_classes as examples
+from .common_data import Msg, random_trace
+from .test_monitor_variants import BuiltMonitorExamples
+
+###############################################################################
+# Test Data
+###############################################################################
+
+# the common properties, with sets, ranges and quantifiers
+PROPERTIES = (
+    'globally: no /a {x in [1 to 3] or y in {2, 4}}',
+) + common.PROPERTIES[1:] + (
+    'globally: no /a {forall i in xs: xs[@i] < 2 implies x > -2}',
+)
+
+
+def new_msg(rng):
+    xs = [rng.randint(0, 2) for _ in range(3)]
+    return Msg(x=rng.randint(-3, 9), y=rng.randint(0, 5), xs=xs)
+
+
+###############################################################################
+# Test Cases
+###############################################################################
+
+class TestStateMachineMonitor(BuiltMonitorExamples,
+                              examples.TestMonitorClasses):
+    def test_examples(self):
+        self._run_examples()
+
+    def test_expressions(self):
+        p = property_parser()
+        msg = Msg(x=3, y=4.0, xs=[1, 2, 3], pose=Msg(position=Msg(x=7)))
+        cases = (
+            ('x + 1 = 4', True),
+            ('-x < 0 and not (y > 5)', True),
+            ('x in [3 to 5] and x in ![1 to 3]!', False),
+            ('x in {1, 2, 3}', True),
+            ('sqrt(y) * 2 = y', True),
+            ('exists i in xs: xs[@i] = x', True),
+            ('forall i in [0 to 2]: xs[@i] > @i', True),
+            ('len(xs) = 3 iff x > 2', True),
+            ('pose.position.x > 6', True),
+        )
+        for text, expected in cases:
+            hp = p.parse('globally: no /a {' + text + '}')
+            data = build_ir(hp)
+            phi = data['on_msg']['/a'][0]['transitions'][0]['predicate']
+            assert compile_expression(phi)(msg, {}) == expected, text
+
+    def test_from_json(self):
+        # programs compile from stored IR, without the `hpl` AST
+        p = property_parser()
+        hp = p.parse(PROPERTIES[3])
+        data = ir.loads(ir.dumps(build_ir(hp)))
+        m = StateMachineMonitor(data)
+        assert m.HPL_PROPERTY == str(hp)
+        assert sorted(m.cb_map) == ['/a', '/b']
+        m.on_launch(0.0)
+        assert m.cb_map['/a'](Msg(x=1), 1.0)
+        assert m.next_deadline == 2.0
+        m.on_timer(2.5)
+        assert m.verdict is False
+        assert [rec.timestamp for rec in m.witness] == [1.0]
+
+    def test_same_behaviour(self):
+        # interpreted monitors vs. generated monitor classes
+        p = property_parser()
+        r = TemplateRenderer()
+        for text in PROPERTIES:
+            hp = p.parse(text)
+            cls = r.build_monitor_class(hp)
+            program = MonitorProgram.from_property(hp)
+            for seed in range(10):
+                m1 = cls()
+                m2 = StateMachineMonitor(program)
+                log1 = []
+                log2 = []
+                for m, log in ((m1, log1), (m2, log2)):
+                    m.on_success = partial(self._log, log, True)
+                    m.on_violation = partial(self._log, log, False)
+                    m.on_launch(0.0)
+                for topic, msg, t in random_trace(100, seed=seed, new_msg=new_msg):
+                    if topic is None:
+                        m1.on_timer(t)
+                        m2.on_timer(t)
+                    elif topic in m1.cb_map:
+                        r1 = m1.cb_map[topic](msg, t)
+                        r2 = m2.cb_map[topic](msg, t)
+                        assert r1 == r2, text
+                    assert m1._state == m2._state, text
+                    assert m1.witness == m2.witness, text
+                assert log1 == log2, text
+
+    def _log(self, log, verdict, stamp, witness):
+        log.append((verdict, stamp, list(witness)))
+
+    def _monitor_factory(self, renderer, hp, options):
+        return partial(StateMachineMonitor, MonitorProgram.from_property(hp))
+
+    def _dispatch_msg(self, m, topic, msg, time):
+        return m.cb_map[topic](msg, time)
+
+
+if __name__ == '__main__':
+    unittest.main()
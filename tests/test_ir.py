@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+from hpl.parser import property_parser
+
+from hplrv import ir
+from hplrv.caching import RenderCache
+from hplrv.constants import STATE_ACTIVE, STATE_FALSE, STATE_SAFE
+from hplrv.monitors import build_ir
+
+from .test_monitor_classes import all_types_of_property
+
+###############################################################################
+# Test Cases
+###############################################################################
+
+class TestIntermediateRepresentation(unittest.TestCase):
+    def setUp(self):
+        self.parser = property_parser()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_round_trip(self):
+        for text, traces in all_types_of_property():
+            data = build_ir(self.parser.parse(text))
+            assert data['version'] == ir.IR_VERSION
+            assert ir.loads(ir.dumps(data)) == data, text
+            for handlers in data['on_msg'].values():
+                for handler in handlers:
+                    assert handler['state'] in data['states']
+                    for t in handler['transitions']:
+                        assert set(t['actions']) <= set(ir.ACTIONS)
+            path = os.path.join(self.tmp_dir, 'ir.json')
+            ir.save(data, path)
+            assert ir.load(path) == data
+
+    def test_prevention_with_reference(self):
+        hp = self.parser.parse(
+            'globally: /a as A forbids /b {x = @A.x} within 100 ms')
+        data = build_ir(hp)
+        assert data['pattern'] == 'prevention'
+        assert data['pool'] == {'size': -1}
+        assert data['timeout'] == 0.1
+        handlers = {h['state']: h['transitions'] for h in data['on_msg']['/b']}
+        t = handlers[STATE_ACTIVE][0]
+        assert t['event'] == 'behaviour'
+        assert t['trigger'] == 'A' and t['pool'] == 'any'
+        assert t['target'] == STATE_FALSE
+        assert t['predicate']['kind'] == 'binary'
+        assert t['predicate']['operator'] == '='
+        timer = data['on_timer'][0]
+        assert timer['clock'] == 'pool' and timer['target'] == STATE_SAFE
+
+    def test_version_check(self):
+        data = build_ir(self.parser.parse('globally: no /a'))
+        data['version'] = ir.IR_VERSION + 1
+        with self.assertRaises(ValueError):
+            ir.loads(ir.dumps(data))
+
+    def test_cache(self):
+        hp = self.parser.parse('globally: /b requires /a {data > 0}')
+        cache = RenderCache(cache_dir=self.tmp_dir)
+        data = build_ir(hp, cache=cache)
+        assert cache.misses == 1 and len(cache) == 1
+        assert [os.path.splitext(name)[1]
+                for name in os.listdir(self.tmp_dir)] == ['.json']
+        cache = RenderCache(cache_dir=self.tmp_dir)
+        key = os.path.splitext(os.listdir(self.tmp_dir)[0])[0]
+        assert cache.contains(key, suffix='.json') and key not in cache
+        assert build_ir(hp, cache=cache) == data
+        assert cache.hits == 1
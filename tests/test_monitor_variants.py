@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Runs the examples of `test_monitor_classes` on classes built in-process
+# (`TemplateRenderer.build_monitor_class`), with and without code options.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function, unicode_literals
+
+from hpl.parser import property_parser
+
+from hplrv.constants import STATE_OFF
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from . import test_monitor_classes as examples
+
+###############################################################################
+# Test Cases
+###############################################################################
+
+class BuiltMonitorExamples(object):
+    # runs the examples on the monitors of `_monitor_factory`, instead of
+    # executing rendered code
+    def _run_examples(self, options=None, renderer=None):
+        n = 0
+        p = property_parser()
+        r = renderer or TemplateRenderer()
+        for text, traces in examples.all_types_of_property():
+            hp = p.parse(text)
+            self.pool_decay = ((hp.pattern.is_requirement
+                    or hp.pattern.is_response
+                    or hp.pattern.is_prevention)
+                and hp.pattern.has_max_time)
+            cls = self._monitor_factory(r, hp, options)
+            m = self._make_monitor(cls)
+            for trace in traces:
+                n += 1
+                self.hpl_string = text
+                self._set_trace_string(trace, n)
+                self._launch(hp, m)
+                time = 0
+                for event in trace:
+                    time += 1
+                    self._dispatch(m, event, time)
+                self._shutdown(m)
+                self._reset()
+        print('Tested {} examples.'.format(n))
+
+    def _make_monitor(self, cls):
+        m = cls()
+        m.on_enter_scope = self._on_enter
+        m.on_exit_scope = self._on_exit
+        m.on_success = self._on_success
+        m.on_violation = self._on_failure
+        self._update_debug_string(m, -1)
+        assert m._state == STATE_OFF, self.debug_string
+        assert m.verdict is None, self.debug_string
+        assert not m.witness, self.debug_string
+        assert m.time_launch < 0, self.debug_string
+        assert m.time_state < 0, self.debug_string
+        assert m.time_shutdown < 0, self.debug_string
+        return m
+
+    def _monitor_factory(self, renderer, hp, options):
+        return renderer.build_monitor_class(hp, options=options)
+
+
+class TestMonitorVariants(BuiltMonitorExamples,
+                         examples.TestMonitorClasses):
+    def test_examples(self):
+        self._run_examples()
+
+    def test_memoized_classes(self):
+        # the examples run twice on the very same classes
+        r = TemplateRenderer()
+        self._run_examples(renderer=r)
+        p = property_parser()
+        for text, _traces in examples.all_types_of_property():
+            hp = p.parse(text)
+            assert r.build_monitor_class(hp) is r.build_monitor_class(hp)
+        self._run_examples(renderer=r)
+
+    def test_examples_with_hoisted_accessors(self):
+        self._run_examples(options=CodeOptions(hoist_accessors=True))
+
+    def test_examples_with_timestamp_pool(self):
+        self._run_examples(options=CodeOptions(timestamp_pool=True))
+
+    def test_examples_with_join_indices(self):
+        self._run_examples(options=CodeOptions(join_indices=True))
+
+    def test_examples_with_opt_levels(self):
+        # the examples check all hooks, none of them can be dropped
+        for level in (1, 3):
+            self._run_examples(options=CodeOptions.from_level(level))
+
+    def test_examples_with_state_dispatch(self):
+        for elide_lock in (False, True):
+            options = CodeOptions(state_dispatch=True, elide_lock=elide_lock)
+            self._run_examples(options=options)
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+# Executes generated ROS nodes, with placeholder `rospy` and message
+# modules, and checks the verdicts that they publish.
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, range
+import sys
+import threading
+import types
+import unittest
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+
+from .common_data import Msg, PROPERTIES, TOPICS, random_trace
+
+###############################################################################
+# Placeholder ROS Modules
+###############################################################################
+
+class ROSInterruptException(Exception):
+    pass
+
+
+class FakeRos(object):
+    # The state behind a placeholder `rospy` module: the clock, and what
+    # the node published and subscribed.
+    # loop: function of the iteration number, called on every iteration
+    #   of the node's `run()` loop; returns whether to stop
+    def __init__(self, loop=None):
+        self.time = 0.0
+        self.verdicts = []    # [(property index, bool)], in order
+        self.subscribers = [] # [Subscriber], including unregistered
+        self.loop = loop or (lambda i: True)
+        self.iterations = 0
+
+    def module(self):
+        ros = self
+        rospy = types.ModuleType(str('rospy'))
+
+        class Publisher(object):
+            def __init__(self, name, msg_type, queue_size=None, latch=False):
+                self.index = int(name[len('~p'):-len('/verdict')])
+
+            def publish(self, value):
+                ros.verdicts.append((self.index, value))
+
+        class Subscriber(object):
+            def __init__(self, topic, msg_type, callback):
+                self.topic = topic
+                self.callback = callback
+                self.active = True
+                ros.subscribers.append(self)
+
+            def unregister(self):
+                self.active = False
+
+        class Rate(object):
+            def __init__(self, hz):
+                pass
+
+            def sleep(self):
+                pass
+
+        def is_shutdown():
+            ros.iterations += 1
+            return ros.loop(ros.iterations)
+
+        rospy.Publisher = Publisher
+        rospy.Subscriber = Subscriber
+        rospy.Rate = Rate
+        rospy.ROSInterruptException = ROSInterruptException
+        rospy.get_time = lambda: ros.time
+        rospy.get_param = lambda name, default=None: default
+        rospy.is_shutdown = is_shutdown
+        return rospy
+
+    def active_topics(self):
+        return sorted(sub.topic for sub in self.subscribers if sub.active)
+
+
+def new_node(code, ros):
+    # executes the code of a node with placeholder modules, which are
+    # removed from `sys.modules` afterwards
+    modules = {'rospy': ros.module()}
+    for pkg in ('std_msgs', 'geometry_msgs'):
+        mod = modules[pkg] = types.ModuleType(str(pkg))
+        msg = modules[pkg + '.msg'] = types.ModuleType(str(pkg + '.msg'))
+        msg.Bool = msg.Point = object
+        mod.msg = msg
+    saved = dict((name, sys.modules.get(name)) for name in modules)
+    sys.modules.update(modules)
+    try:
+        namespace = {'__name__': 'hplrv_node'}
+        exec(compile(code, '<node>', 'exec'), namespace)
+        return namespace['HplMonitorNode']()
+    finally:
+        for name, mod in saved.items():
+            if mod is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = mod
+
+
+def launch(node, ros):
+    # `run()` up to the loop; routing nodes also set up their routes
+    ros.loop = lambda i: True
+    node.run()
+
+
+def deliver(node, ros, trace):
+    # feeds (topic, msg, stamp) events to the node callbacks; timer
+    # events (topic None) call `on_timer` of every monitor
+    for topic, msg, t in trace:
+        ros.time = t
+        if topic is None:
+            for mon in node.monitors:
+                mon.on_timer(t)
+        else:
+            getattr(node, 'on_msg_' + topic.replace('/', '_'))(msg)
+
+
+###############################################################################
+# Test Cases
+###############################################################################
+
+class TestNodes(unittest.TestCase):
+    def setUp(self):
+        self.parser = property_parser()
+        self.renderer = TemplateRenderer()
+
+    def _run(self, texts, trace, **kwargs):
+        # published verdicts of a node over a trace
+        hps = [self.parser.parse(text) for text in texts]
+        topics = dict((topic, 'geometry_msgs/Point') for topic in TOPICS)
+        code = self.renderer.render_rospy_node(hps, topics, **kwargs)
+        ros = FakeRos()
+        node = new_node(code, ros)
+        launch(node, ros)
+        deliver(node, ros, trace)
+        return ros.verdicts
+
+    def test_verdicts(self):
+        texts = ['globally: no /a {x > 5}', 'after /p: some /b {x > 7}']
+        trace = [('/a', Msg(x=1), 1.0), ('/p', Msg(x=0), 2.0),
+                 ('/b', Msg(x=9), 3.0), ('/a', Msg(x=6), 4.0)]
+        assert self._run(texts, trace) == [(1, True), (0, False)]
+
+    def test_options(self):
+        # nodes with other options publish the same verdicts
+        variants = (
+            dict(options=CodeOptions.from_level(3)),
+            dict(options=CodeOptions(timestamp_pool=True)),
+            dict(options=CodeOptions(join_indices=True)),
+            dict(options=CodeOptions(next_deadline=True)),
+            dict(options=CodeOptions(state_routing=True)),
+            dict(options=CodeOptions(state_routing=True,
+                                     subscription_grace=1.0)),
+            dict(share_predicates=True),
+            dict(fuse_monitors=True),
+            dict(fuse_monitors=True, options=CodeOptions.from_level(3)),
+        )
+        for seed in range(5):
+            # no timer events, which nodes poll in their `run()` loop
+            trace = random_trace(100, seed=seed, timers=0.0)
+            expected = self._run(PROPERTIES, trace)
+            assert expected
+            for kwargs in variants:
+                verdicts = self._run(PROPERTIES, trace, **kwargs)
+                assert sorted(verdicts) == sorted(expected), kwargs
+
+    def test_predicate_errors(self):
+        # an error in a shared predicate reaches only the monitors that
+        # test it, as if each had evaluated the predicate on its own
+        texts = [
+            'globally: no /a {x > 5}',
+            'globally: no /a {xs[2] > 0}',
+            'after /p: no /a {xs[2] > 0}',
+        ]
+        hps = [self.parser.parse(text) for text in texts]
+        topics = {'/a': 'geometry_msgs/Point', '/p': 'geometry_msgs/Point'}
+        for share in (False, True):
+            code = self.renderer.render_rospy_node(hps, topics,
+                                                   share_predicates=share)
+            if share:
+                assert 'PredicateError(e)' in code
+            ros = FakeRos()
+            node = new_node(code, ros)
+            launch(node, ros)
+            # monitor 0 runs before the error, monitor 2 is inactive
+            with self.assertRaises(IndexError):
+                node.on_msg__a(Msg(x=9, xs=[]))
+            assert ros.verdicts == [(0, False)]
+            node.on_msg__a(Msg(x=0, xs=[0, 0, 1]))
+            assert ros.verdicts == [(0, False), (1, False)]
+            node.on_msg__p(Msg(x=0))
+            node.on_msg__a(Msg(x=0, xs=[0, 0, 1]))
+            assert ros.verdicts == [(0, False), (1, False), (2, False)]
+
+    def test_next_deadline(self):
+        # messages wake up the loop, which polls monitors at deadlines
+        hps = [self.parser.parse('globally: /a causes /b within 1 s'),
+               self.parser.parse('globally: no /b {x > 5}')]
+        topics = {'/a': 'geometry_msgs/Point', '/b': 'geometry_msgs/Point'}
+        code = self.renderer.render_rospy_node(hps, topics,
+            options=CodeOptions(next_deadline=True))
+        started = threading.Event()
+        woken = threading.Event()
+        def loop(i):
+            if i == 1:
+                started.set()
+            elif i == 2:
+                woken.set()
+                ros.time = 2.0 # after the deadline of the /a message
+            return i > 2
+        ros = FakeRos(loop=loop)
+        node = new_node(code, ros)
+        thread = threading.Thread(target=node.run)
+        thread.start()
+        try:
+            assert started.wait(5.0)
+            # without a deadline, the loop waits for 1 s (wall-clock)
+            ros.time = 0.5
+            node.on_msg__a(Msg(x=0))
+            assert woken.wait(0.9)
+        finally:
+            thread.join(5.0)
+        assert not thread.is_alive()
+        assert ros.verdicts == [(0, False)]
+        # only the monitor of the /b property is not polled
+        assert node.timed_monitors == [node.monitors[0]]
+        node._wakeup.clear()
+        node.on_msg__b(Msg(x=0))
+        assert node._wakeup.is_set()
+
+    def test_state_routing(self):
+        # messages reach only the monitors whose state consumes them
+        hps = [self.parser.parse('after /p until /q: no /a {x > 5}'),
+               self.parser.parse('globally: some /b within 1 s')]
+        topics = dict((topic, 'geometry_msgs/Point') for topic in TOPICS)
+        code = self.renderer.render_rospy_node(hps, topics,
+            options=CodeOptions(state_routing=True))
+        ros = FakeRos()
+        node = new_node(code, ros)
+        launch(node, ros)
+        assert node.routes == {'/a': (), '/b': (1,), '/p': (0,), '/q': ()}
+        assert node.timers == (1,)
+        node.on_msg__p(Msg(x=0))
+        assert node.routes['/a'] == (0,) and node.routes['/q'] == (0,)
+        assert node.routes['/p'] == ()
+        node.on_msg__a(Msg(x=0))
+        node.on_msg__q(Msg(x=0))
+        assert node.routes['/a'] == () and node.routes['/p'] == (0,)
+        node.on_msg__b(Msg(x=0))
+        # with a verdict, the monitor leaves every route and the timers
+        assert ros.verdicts == [(1, True)]
+        assert node.routes['/b'] == () and node.timers == ()
+        node.on_msg__p(Msg(x=0))
+        node.on_msg__a(Msg(x=6))
+        assert ros.verdicts == [(1, True), (0, False)]
+        assert all(not indices for indices in node.routes.values())
+
+    def test_subscription_grace(self):
+        # topics are unsubscribed only after the grace period, and
+        # subscribed again when some monitor state consumes them
+        hps = [self.parser.parse('after /p until /q: no /a {x > 5}')]
+        topics = dict((topic, 'geometry_msgs/Point') for topic in TOPICS)
+        code = self.renderer.render_rospy_node(hps, topics,
+            options=CodeOptions(state_routing=True, subscription_grace=1.0))
+        ros = FakeRos()
+        node = new_node(code, ros)
+        launch(node, ros)
+        assert ros.active_topics() == ['/p']
+        ros.time = 1.0
+        node.on_msg__p(Msg(x=0))
+        assert ros.active_topics() == ['/a', '/p', '/q']
+        ros.time = 2.0
+        node.on_msg__q(Msg(x=0))
+        # within the grace period, the subscriptions stay
+        assert node._unsubscribe_idle(2.5) == 3.0
+        node._update_subscriptions()
+        assert ros.active_topics() == ['/a', '/p', '/q']
+        ros.time = 2.5
+        node.on_msg__p(Msg(x=0))
+        assert len(ros.subscribers) == 3
+        ros.time = 3.0
+        node.on_msg__q(Msg(x=0))
+        assert node._unsubscribe_idle(4.0) == float('inf')
+        node._update_subscriptions()
+        assert ros.active_topics() == ['/p']
+        # the topics are subscribed again
+        ros.time = 5.0
+        node.on_msg__p(Msg(x=0))
+        assert ros.active_topics() == ['/a', '/p', '/q']
+        assert len(ros.subscribers) == 5
+        node.subs['/a'].callback(Msg(x=9))
+        assert ros.verdicts == [(0, False)]
+
+    def test_fused_node(self):
+        # a single monitor publishes the verdicts of every property
+        texts = ['globally: no /a {x > 5}', 'after /p: some /b {x > 7}',
+                 'globally: /a as A causes /b {x > @A.x} within 1 s']
+        hps = [self.parser.parse(text) for text in texts]
+        topics = dict((topic, 'geometry_msgs/Point') for topic in TOPICS)
+        code = self.renderer.render_rospy_node(hps, topics,
+                                               fuse_monitors=True)
+        ros = FakeRos()
+        node = new_node(code, ros)
+        launch(node, ros)
+        assert len(node.monitors) == 1
+        deliver(node, ros, [('/a', Msg(x=1), 1.0), ('/p', Msg(x=0), 1.5),
+                            ('/b', Msg(x=9), 2.0), (None, None, 2.5),
+                            ('/a', Msg(x=3), 3.0), (None, None, 4.5)])
+        assert ros.verdicts == [(1, True), (2, False)]
+        deliver(node, ros, [('/a', Msg(x=6), 5.0)])
+        assert ros.verdicts == [(1, True), (2, False), (0, False)]
+        assert node.monitor.verdicts == (False, True, False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,826 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, range
+from math import isinf
+import unittest
+import weakref
+
+from hpl.parser import property_parser
+
+from hplrv.monitors import new_builder
+from hplrv.optimization import (
+    CodeOptions, HOOKS, comparison_join, equality_join, hoist_accessors,
+    project_records
+)
+from hplrv.rendering import TemplateRenderer
+from hplrv.runtime import np
+
+from . import common_data as common
+from .common_data import E_TIMER, Msg
+from .test_monitor_classes import all_types_of_property
+
+###############################################################################
+# Test Data
+###############################################################################
+
+def new_msg(rng):
+    # small integer fields, so that joins often match
+    return Msg(id=rng.randint(0, 5), x=rng.randint(0, 9))
+
+def random_trace(topics, n, seed=0):
+    return common.random_trace(n, seed=seed, topics=topics, new_msg=new_msg)
+
+def run_trace(cls, trace):
+    # returns the observable behaviour of a monitor over a trace
+    m = cls()
+    m.on_launch(0.0)
+    results = []
+    for topic, msg, t in trace:
+        if topic is None:
+            r = m.on_timer(t)
+        else:
+            cb = m.cb_map.get(topic)
+            r = cb(msg, t) if cb is not None else None
+        results.append((r, m._state, [(rec.topic, rec.timestamp)
+                                      for rec in m.witness]))
+        if m.verdict is not None:
+            break
+    return results
+
+
+###############################################################################
+# Test Cases
+###############################################################################
+
+class TestAccessorHoisting(unittest.TestCase):
+    def test_repeated_chains(self):
+        text = '\n'.join((
+            '    if (msg.pose.orientation.x * msg.pose.orientation.x'
+            ' + msg.pose.orientation.y) > 0:',
+            '        self.witness.append(MsgRecord(\'/a\', stamp, msg))',
+            '    if msg.pose.position.z < 0:',
+            '        return True',
+        ))
+        expected = '\n'.join((
+            '    _f0 = msg.pose',
+            '    _f1 = _f0.orientation',
+            '    _f2 = _f1.x',
+            '    if (_f2 * _f2 + _f1.y) > 0:',
+            '        self.witness.append(MsgRecord(\'/a\', stamp, msg))',
+            '    if _f0.position.z < 0:',
+            '        return True',
+        ))
+        assert hoist_accessors(text) == expected
+        assert hoist_accessors(text, enabled=False) == text
+
+    def test_loops_and_literals(self):
+        text = '\n'.join((
+            'for rec in self._pool:',
+            '    v_A = rec.msg',
+            '    if (msg.id == v_A.id) and ("msg.id" != msg.name):',
+            '        return True',
+        ))
+        expected = '\n'.join((
+            '_f0 = msg.id',
+            '_f1 = msg.name',
+            'for rec in self._pool:',
+            '    v_A = rec.msg',
+            '    if (_f0 == v_A.id) and ("msg.id" != _f1):',
+            '        return True',
+        ))
+        assert hoist_accessors(text) == expected
+
+    def test_single_use(self):
+        text = 'if all((msg.a[v_i] > 0) for v_i in range(len(msg.a))):'
+        expected = '\n'.join((
+            '_f0 = msg.a',
+            'if all((_f0[v_i] > 0) for v_i in range(len(_f0))):',
+        ))
+        assert hoist_accessors(text) == expected
+        text = 'if msg.a.b > 0:'
+        assert hoist_accessors(text) == text
+
+
+@unittest.skipIf(np is None, 'requires numpy')
+class TestVectorizedQuantifiers(unittest.TestCase):
+    def setUp(self):
+        self.parser = property_parser()
+        self.renderer = TemplateRenderer()
+        self.options = CodeOptions(numpy_quantifiers=True)
+
+    def test_rendering(self):
+        supported = [
+            '{forall i in data: data[@i] > 0.1}',
+            '{exists i in data: (abs(data[@i] - x) < 0.5 and data[@i] != 3)}',
+            '{forall i in data: (not (data[@i] < 0) or -data[@i] > x ** 2)}',
+        ]
+        unsupported = [
+            '{forall i in data: data[@i] > @i}',
+            '{forall i in data: items[@i] > 0}',
+            '{forall i in [0 to 2]: data[@i] > 0}',
+        ]
+        for text in supported + unsupported:
+            hp = self.parser.parse('globally: no /a ' + text)
+            plain = self.renderer.render_monitor(hp)
+            code = self.renderer.render_monitor(hp, options=self.options)
+            if text in supported:
+                assert 'np_array(msg.data)' in code
+                assert ' for v_i in ' not in code
+            else:
+                assert code == plain
+
+    def test_same_verdicts(self):
+        texts = [
+            'globally: no /a {forall i in data: data[@i] > 0.1}',
+            'globally: no /a {exists i in data: abs(data[@i] - x) < 0.5}',
+            'globally: /b as B causes /a'
+            ' {forall i in data: data[@i] < @B.x} within 1 s',
+            'globally: /a as A requires /b'
+            ' {exists i in @A.data: @A.data[@i] = x}',
+        ]
+        arrays = [[], [1.0, 2.0], [0.0, 5.0, 7.5], bytearray(b'\x05\x07')]
+        for text in texts:
+            hp = self.parser.parse(text)
+            plain = self.renderer.build_monitor_class(hp)
+            fast = self.renderer.build_monitor_class(hp, options=self.options)
+            for data in arrays:
+                for x in (0.0, 5.0, 7.0):
+                    verdicts = []
+                    for cls in (plain, fast):
+                        m = cls()
+                        m.on_launch(0)
+                        for topic, t in (('_b', 0.5), ('_a', 1)):
+                            cb = getattr(m, 'on_msg_' + topic, None)
+                            if cb is not None:
+                                cb(Msg(x=x, data=data), t)
+                        m.on_timer(2)
+                        verdicts.append(m.verdict)
+                    assert verdicts[0] == verdicts[1], (text, data, x)
+
+
+class TestJoinIndices(unittest.TestCase):
+    def setUp(self):
+        self.parser = property_parser()
+        self.renderer = TemplateRenderer()
+        self.options = CodeOptions(join_indices=True)
+
+    def test_equality_join(self):
+        def join(text):
+            hp = self.parser.parse('globally: /a as A causes /b ' + text)
+            phi = next(iter(hp.pattern.behaviour.simple_events())).predicate
+            j = equality_join(phi, 'A')
+            return j and (str(j[0]), str(j[1]))
+        assert join('{id = @A.id}') == ('id', '@A.id')
+        assert join('{(x > 0 and @A.id = id)}') == ('id', '@A.id')
+        assert join('{(id + 1 = @A.id * 2 and x > @A.x)}') == (
+            '(id + 1)', '(@A.id * 2)')
+        assert join('{(id = @A.id or x > @A.x)}') is None
+        assert join('{id = @A.id + x}') is None
+        assert join('{not id = @A.id}') is None
+
+    def test_comparison_join(self):
+        def join(text):
+            hp = self.parser.parse('globally: /a as A causes /b ' + text)
+            phi = next(iter(hp.pattern.behaviour.simple_events())).predicate
+            j = comparison_join(phi, 'A')
+            return j and (j[0], str(j[1]), str(j[2]))
+        assert join('{x < @A.x}') == ('>', '@A.x', 'x')
+        assert join('{@A.x <= x + 1}') == ('<=', '@A.x', '(x + 1)')
+        assert join('{(x > @A.x and id = @A.id)}') == ('=', '@A.id', 'id')
+        assert join('{(x >= @A.x and y < @A.y)}') == ('<=', '@A.x', 'x')
+        assert join('{x + @A.x > 0}') is None
+        assert join('{@A.x != x}') is None
+
+    def test_response_rendering(self):
+        texts = [
+            'globally: /a as A causes /b {id = @A.id} within 3 s',
+            'globally: /a as A causes (/b {id = @A.id} or /c) within 3 s',
+            'globally: /a as A causes /b {(x > @A.x and id = @A.id)}',
+        ]
+        for text in texts:
+            hp = self.parser.parse(text)
+            code = self.renderer.render_monitor(hp, options=self.options)
+            assert 'KeyedPool()' in code
+            assert 'self._pool.get(msg.id)' in code
+        texts = [
+            'globally: /a as A causes /b {x > @A.x} within 3 s',
+            'globally: /a as A causes (/b {id = @A.id} or /c {x = @A.x})',
+            'globally: /a causes /b within 3 s',
+        ]
+        for text in texts:
+            hp = self.parser.parse(text)
+            code = self.renderer.render_monitor(hp, options=self.options)
+            assert code == self.renderer.render_monitor(hp)
+
+    def test_matched_records_are_released(self):
+        # an unanswered trigger at the head of the pool must not keep the
+        # records of the triggers that are answered after it
+        hp = self.parser.parse('globally: /a as A causes /b {x = @A.x}')
+        cls = self.renderer.build_monitor_class(hp, options=self.options)
+        m = cls()
+        m.on_launch(0.0)
+        m.on_msg__a(Msg(x=-1), 0.5)
+        for i in range(10000):
+            m.on_msg__a(Msg(x=i), i + 1.0)
+            m.on_msg__b(Msg(x=i), i + 1.5)
+        assert len(m._pool) == 1
+        assert len(m._pool._pool) < 100
+
+    def test_same_behaviour(self):
+        texts = [
+            'globally: /a as A causes /b {id = @A.id} within 3 s',
+            'globally: /a as A causes /b {(x > @A.x and id = @A.id)}',
+            'globally: /a as A causes (/b {id = @A.id} or /c) within 5 s',
+            'after /p: /a as A {x > 2} causes /b {id = @A.id} within 3 s',
+            'after /p until /q: /a as A causes /b {@A.id = id} within 3 s',
+        ]
+        topics = ('/a', '/b', '/c', '/p', '/q')
+        for text in texts:
+            hp = self.parser.parse(text)
+            plain = self.renderer.build_monitor_class(hp)
+            fast = self.renderer.build_monitor_class(hp, options=self.options)
+            for seed in range(20):
+                trace = random_trace(topics, 200, seed=seed)
+                assert run_trace(plain, trace) == run_trace(fast, trace), (
+                    text, seed)
+
+    def test_requirement_same_behaviour(self):
+        texts = [
+            'globally: /b as B requires /a {id = @B.id}',
+            'globally: /b as B requires /a {x < @B.x} within 3 s',
+            'globally: /b as B requires /a {(x >= @B.x and id = @B.id)}',
+            'globally: /b as B requires (/a {x <= @B.x} or /c {id = @B.id})',
+            'globally: /b as B requires (/a {x > @B.x} or /c {x > @B.x})',
+            'after /p as P: /b as B requires /a {id = @B.id} within 5 s',
+            'after /p until /q: /b as B requires /a {@B.x > x} within 5 s',
+        ]
+        topics = ('/a', '/b', '/c', '/p', '/q')
+        for text in texts:
+            hp = self.parser.parse(text)
+            plain = self.renderer.build_monitor_class(hp)
+            fast = self.renderer.build_monitor_class(hp, options=self.options)
+            assert 'IndexedPool' in self.renderer.render_monitor(
+                hp, options=self.options)
+            for seed in range(20):
+                trace = random_trace(topics, 200, seed=seed)
+                assert run_trace(plain, trace) == run_trace(fast, trace), (
+                    text, seed)
+
+
+    def test_prevention_same_behaviour(self):
+        # same verdicts, and the same (oldest) trigger in the witness
+        texts = [
+            'globally: /a as A forbids /b {id = @A.id} within 3 s',
+            'globally: /a as A forbids /b {x < @A.x} within 2 s',
+            'globally: /a as A {x > 0} forbids /b {x > 0 and x > @A.x}'
+            ' within 3 s',
+            ('globally: /a as A forbids (/b {(x > @A.x and id = @A.id)}'
+             ' or /c {x + 5 < @A.x}) within 4 s'),
+            ('after /p as P: /a as A forbids /b'
+             ' {(id = @A.id and x > @P.x)} within 3 s'),
+            ('after /p as P {x > 0}: /a as A {x > @P.x} forbids /b'
+             ' {x > @P.x and x > @A.x}'),
+            'after /p until /q: /a as A forbids /b {@A.id = id}',
+        ]
+        topics = ('/a', '/b', '/c', '/p', '/q')
+        for text in texts:
+            hp = self.parser.parse(text)
+            plain = self.renderer.build_monitor_class(hp)
+            fast = self.renderer.build_monitor_class(hp, options=self.options)
+            assert 'IndexedPool' in self.renderer.render_monitor(
+                hp, options=self.options)
+            for seed in range(20):
+                trace = random_trace(topics, 200, seed=seed)
+                assert run_trace(plain, trace) == run_trace(fast, trace), (
+                    text, seed)
+
+    def test_prevention_scan_fallback(self):
+        texts = [
+            'globally: /a as A forbids /b {x + @A.x > 10} within 3 s',
+            'globally: /a as A forbids (/b {id = @A.id} or /c {x != @A.x})',
+        ]
+        for text in texts:
+            hp = self.parser.parse(text)
+            code = self.renderer.render_monitor(hp, options=self.options)
+            assert 'for rec in self._pool:' in code
+
+
+class TestNextDeadline(unittest.TestCase):
+    def setUp(self):
+        self.parser = property_parser()
+        self.renderer = TemplateRenderer()
+        self.options = CodeOptions(next_deadline=True)
+
+    def test_same_behaviour(self):
+        # timers only fire at deadlines, but nothing is lost
+        texts = [
+            'globally: no /a {x > 8}',
+            'after /p: no /a {x > 8} within 2 s',
+            'after /p until /q: some /a {x > 8} within 2 s',
+            'globally: /a {x > 7} causes /b {x > 7} within 1 s',
+            'globally: /a as A causes /b {id = @A.id} within 2 s',
+            'globally: /b requires /a within 1 s',
+            'globally: /b as B requires /a {id = @B.id} within 1 s',
+            'globally: /a as A forbids /b {id = @A.id} within 1 s',
+        ]
+        topics = ('/a', '/b', '/p', '/q')
+        for text in texts:
+            hp = self.parser.parse(text)
+            plain = self.renderer.build_monitor_class(hp)
+            fast = self.renderer.build_monitor_class(hp, options=self.options)
+            if isinf(hp.pattern.max_time):
+                assert fast().next_deadline is None
+            for seed in range(20):
+                m1 = plain()
+                m2 = fast()
+                m1.on_launch(0.0)
+                m2.on_launch(0.0)
+                for topic, msg, t in random_trace(topics, 200, seed=seed):
+                    if topic is None:
+                        m1.on_timer(t)
+                        d = m2.next_deadline
+                        if d is not None and d <= t:
+                            m2.on_timer(t)
+                    elif topic in m1.cb_map:
+                        m1.cb_map[topic](msg, t)
+                        m2.cb_map[topic](msg, t)
+                    assert m1._state == m2._state, (text, seed, t)
+                    assert m1.witness == m2.witness, (text, seed, t)
+
+    def test_node_rendering(self):
+        texts = [
+            'globally: no /a {x > 0}',
+            'globally: /a causes /b within 1 s',
+            'globally: no /c',
+        ]
+        hps = [self.parser.parse(text) for text in texts]
+        topics = {t: 'geometry_msgs/Point' for t in ('/a', '/b', '/c')}
+        plain = self.renderer.render_rospy_node(hps, topics)
+        code = self.renderer.render_rospy_node(hps, topics,
+                                               options=self.options)
+        compile(code, '<node>', 'exec')
+        assert 'rate.sleep()' in plain and 'next_deadline' not in plain
+        assert 'self._wakeup.wait(' in code
+        assert code.count('def next_deadline(self):') == 3
+        assert code.count('self._wakeup.set()') == 2
+        i = code.index('def on_msg__c(self, msg):')
+        assert 'self._wakeup.set()' not in code[i:i+200]
+
+
+class TestOptimizationLevels(unittest.TestCase):
+    def setUp(self):
+        self.parser = property_parser()
+        self.renderer = TemplateRenderer()
+
+    def test_from_level(self):
+        hooks = ('on_exit_scope', 'on_enter_scope')
+        assert CodeOptions.from_level(0, unused_hooks=hooks) == CodeOptions()
+        assert CodeOptions.from_level(1) == CodeOptions(strip_asserts=True)
+        options = CodeOptions.from_level(2, unused_hooks=hooks)
+        assert options.unused_hooks == ('on_enter_scope', 'on_exit_scope')
+        assert options.strip_asserts and not options.elide_lock
+        options = CodeOptions.from_level(3, hoist_accessors=True)
+        assert options.elide_lock and options.hoist_accessors
+        assert CodeOptions.from_level(3) == CodeOptions(
+            strip_asserts=True, elide_lock=True)
+        with self.assertRaises(ValueError):
+            CodeOptions.from_level(4)
+        with self.assertRaises(ValueError):
+            CodeOptions(unused_hooks=('on_timer',))
+
+    def test_elided_code(self):
+        # the templates leave out asserts, hook calls and locks
+        options = CodeOptions.from_level(3, unused_hooks=HOOKS)
+        for text, _traces in all_types_of_property():
+            hp = self.parser.parse(text)
+            plain = self.renderer.render_monitor(hp)
+            code = self.renderer.render_monitor(hp, options=options)
+            compile(code, '<monitor>', 'exec')
+            assert '    with self._lock:\n' in plain
+            for line in ('assert ', '    with self._lock:\n',
+                         'self.on_success(', 'self.on_violation(',
+                         'self.on_enter_scope(', 'self.on_exit_scope('):
+                assert line not in code, (text, line)
+            assert self.renderer.render_monitor(hp, options=2) == (
+                self.renderer.render_monitor(hp, options=1))
+
+    def test_same_behaviour(self):
+        texts = [
+            'after /p until /q: no /a {x > 8} within 2 s',
+            'after /p as P: some /a {x > @P.x} within 2 s',
+            'globally: /a as A causes /b {id = @A.id} within 2 s',
+            'after /p until /q: /b as B requires /a {id = @B.id}',
+            'after /p as P: /a as A forbids /b {(id = @A.id and x > @P.x)}',
+        ]
+        topics = ('/a', '/b', '/p', '/q')
+        hooks = ('on_enter_scope', 'on_exit_scope')
+        for text in texts:
+            hp = self.parser.parse(text)
+            plain = self.renderer.build_monitor_class(hp)
+            for level in (1, 2, 3):
+                fast = self.renderer.build_monitor_class(
+                    hp, options=CodeOptions.from_level(level, hooks))
+                code = self.renderer.render_monitor(hp, options=level)
+                assert 'assert ' not in code
+                locks = code.count('        with self._lock:\n')
+                assert (locks > 0) == (level < 3)
+                for seed in range(10):
+                    trace = random_trace(topics, 100, seed=seed)
+                    assert run_trace(plain, trace) == run_trace(fast, trace)
+
+    def test_node_rendering(self):
+        texts = [
+            'globally: no /a {x > 0}',
+            'after /p: /a causes /b within 1 s',
+        ]
+        hps = [self.parser.parse(text) for text in texts]
+        topics = {t: 'geometry_msgs/Point' for t in ('/a', '/b', '/p')}
+        for options in (CodeOptions.from_level(3),
+                        CodeOptions.from_level(3, next_deadline=True)):
+            code = self.renderer.render_rospy_node(hps, topics,
+                                                   options=options)
+            compile(code, '<node>', 'exec')
+            # only the node locks: launch, timer, shutdown and 3 topics
+            assert code.count('    with self._lock:\n') == 6
+        options = CodeOptions.from_level(2, unused_hooks=('on_violation',))
+        with self.assertRaises(ValueError):
+            self.renderer.render_rospy_node(hps, topics, options=options)
+
+
+class TestFieldProjection(unittest.TestCase):
+    def setUp(self):
+        self.parser = property_parser()
+        self.renderer = TemplateRenderer()
+        self.options = CodeOptions(project_fields=True)
+
+    def test_project_records(self):
+        hp = self.parser.parse('globally: /a as A causes /b'
+            ' {(pose.x > @A.pose.x and data[@A.i] > @A.data[0].y)} within 1 s')
+        builder = project_records(new_builder(hp))
+        assert builder.record_fields == {
+            '/a': ('_Fields0', ['data', 'i', 'pose.x'])}
+        phis = [str(e.predicate) for states in builder.on_msg.values()
+                for events in states.values() for e in events]
+        assert '{ ((pose.x > @A.pose__x) and (data[@A.i] > @A.data[0].y)) }' \
+            in phis
+        # the original property is left untouched
+        assert '@A.pose.x' in str(hp)
+        # records of each trigger hold only the fields of their own topic
+        hp = self.parser.parse('globally: /b as B requires'
+            ' (/a1 {x = @B.x} or /a2 {y.z = @B.y}) within 1 s')
+        builder = project_records(new_builder(hp))
+        assert builder.record_fields == {
+            '/a1': ('_Fields0', ['x']), '/a2': ('_Fields1', ['y.z'])}
+        # records that are never read back hold nothing
+        hp = self.parser.parse('after /p as P: /a causes /b within 1 s')
+        builder = project_records(new_builder(hp))
+        assert builder.record_fields == {'/a': (None, []), '/p': (None, [])}
+        builder = project_records(new_builder(hp), pool_only=True)
+        assert builder.record_fields == {'/a': (None, [])}
+
+    def test_rendering(self):
+        hp = self.parser.parse('globally: /a as A causes /b'
+            ' {(pose.x > @A.pose.x and data[@A.i] > @A.data[0].y)} within 1 s')
+        code = self.renderer.render_monitor(hp, options=self.options)
+        assert ("    _Fields0 = namedtuple('_Fields0',"
+                " ('data', 'i', 'pose__x'))") in code
+        assert ("MsgRecord('/a', stamp,"
+                " self._Fields0(msg.data, msg.i, msg.pose.x))") in code
+        assert 'v_A.pose__x' in code
+        assert 'v_A.pose.x' not in code
+        assert "MsgRecord('/a', stamp, msg)" not in code
+        plain = self.renderer.render_monitor(hp)
+        assert 'namedtuple(' not in plain
+
+    def test_same_behaviour(self):
+        texts = [
+            'after /p as P: no /a {x > @P.x} within 2 s',
+            'after /p as P until /q: some /a {x > @P.x} within 2 s',
+            'globally: /a as A causes /b {(id = @A.id and x > @A.x)} within 2 s',
+            'globally: /a causes /b within 1 s',
+            'after /p as P: /b as B requires /a {(id = @B.id and x > @P.x)}',
+            'globally: /b requires /a within 1 s',
+            'after /p as P: /a as A forbids /b {(id = @A.id and x > @P.x)}',
+        ]
+        topics = ('/a', '/b', '/p', '/q')
+        for text in texts:
+            hp = self.parser.parse(text)
+            plain = self.renderer.build_monitor_class(hp)
+            for options in (self.options, CodeOptions(
+                    project_fields=True, join_indices=True), CodeOptions(
+                    project_fields=True, full_witness=True)):
+                fast = self.renderer.build_monitor_class(hp, options=options)
+                for seed in range(10):
+                    trace = random_trace(topics, 200, seed=seed)
+                    assert run_trace(plain, trace) == run_trace(fast, trace)
+
+    def test_messages_are_released(self):
+        hp = self.parser.parse(
+            'after /p as P: /a as A causes /b {id = @A.id} within 10 s')
+        cls = self.renderer.build_monitor_class(hp, options=self.options)
+        m = cls()
+        m.on_launch(0)
+        msgs = [Msg(id=1, x=2.0), Msg(id=2, x=0.0)]
+        refs = [weakref.ref(msg) for msg in msgs]
+        m.on_msg__p(msgs[0], 1)
+        m.on_msg__a(msgs[1], 2)
+        del msgs
+        assert all(ref() is None for ref in refs)
+        assert m.witness[0].msg is None
+        assert m._pool[0].msg.id == 2
+        m.on_msg__b(Msg(id=2), 3)
+        assert m._state == 3
+
+    def test_full_witness(self):
+        hp = self.parser.parse(
+            'after /p as P: /a as A forbids /b {id = @A.id}')
+        msgs = [Msg(id=1, x=2.0), Msg(id=2, x=0.0), Msg(id=2, x=1.0)]
+        for full in (False, True):
+            options = CodeOptions(project_fields=True, full_witness=full)
+            m = self.renderer.build_monitor_class(hp, options=options)()
+            m.on_launch(0)
+            m.on_msg__p(msgs[0], 1)
+            m.on_msg__a(msgs[1], 2)
+            assert m._pool[0].msg is not msgs[1]
+            m.on_msg__b(msgs[2], 3)
+            assert m.verdict is False
+            assert [r.topic for r in m.witness] == ['/p', '/a', '/b']
+            assert m.witness[0].msg is (msgs[0] if full else None)
+            assert m.witness[1].msg.id == 2
+            assert m.witness[2].msg is msgs[2]
+        with self.assertRaises(ValueError):
+            CodeOptions(full_witness=True)
+
+
+class TestStateDispatch(unittest.TestCase):
+    def setUp(self):
+        self.parser = property_parser()
+        self.renderer = TemplateRenderer()
+        self.options = CodeOptions(state_dispatch=True, elide_lock=True)
+
+    def test_handler_bindings(self):
+        # every transition points the callbacks to the new state
+        hp = self.parser.parse('after /p as P until /q: /a causes /b {x > @P.x}'
+                               ' within 1 s')
+        for options in (self.options, CodeOptions(state_dispatch=True)):
+            lines = self.renderer.render_monitor(hp, options=options)
+            lines = lines.split('\n')
+            n = 0
+            for i, line in enumerate(lines):
+                if line.strip().startswith('self._state = '):
+                    n += 1
+                    for j in range(1, 5):
+                        assert 'self.cb_map[' in lines[i + j], lines[i + j]
+            assert n > 4
+
+    def test_rendering(self):
+        hp = self.parser.parse('after /p as P until /p {x > 5}: '
+                               '/p {x > @P.x} causes /p {x < 0}')
+        code = self.renderer.render_monitor(hp, options=self.options)
+        assert 'def on_msg__p(' not in code
+        assert 'if self._state == 3:' not in code
+        for state in (1, 2, 3):
+            assert 'def _on_msg__p_s{}(self, msg, stamp):'.format(state) in code
+        cls = self.renderer.build_monitor_class(hp, options=self.options)
+        m = cls()
+        assert m.on_msg__p == m._ignore_msg
+        m.on_launch(0.0)
+        assert m.on_msg__p == m._on_msg__p_s1
+        assert m.on_msg__p(Msg(x=1), 1.0)
+        assert m.on_msg__p == m.cb_map['/p'] == m._on_msg__p_s3
+        m.on_shutdown(2.0)
+        assert not m.cb_map['/p'](Msg(x=2), 3.0)
+        # handlers that take the lock or run the timer check the state,
+        # and states without events still run the timer
+        hp = self.parser.parse('globally: /p causes /q within 1 s')
+        for options in (CodeOptions(state_dispatch=True), self.options):
+            code = self.renderer.render_monitor(hp, options=options)
+            assert 'def on_msg__p(' not in code
+            assert '_handle_' not in code
+            assert '_ignore_msg' not in code
+            m = self.renderer.build_monitor_class(hp, options=options)()
+            assert m.on_msg__p == m._on_msg__p_idle
+            m.on_launch(0.0)
+            assert m.cb_map['/p'] == m.on_msg__p == m._on_msg__p_s3
+            assert m.on_msg__p(Msg(), 1.0)
+            assert m.on_msg__q == m._on_msg__q_s2
+            assert m.on_msg__p == m._on_msg__p_s2
+            assert not m.on_msg__p(Msg(), 2.5)
+            assert m.verdict is False and m.on_msg__q == m._on_msg__q_idle
+        # a handler that was looked up before a transition re-dispatches
+        m = self.renderer.build_monitor_class(
+            hp, options=CodeOptions(state_dispatch=True))()
+        m.on_launch(0.0)
+        cb = m.on_msg__q
+        m.on_msg__p(Msg(), 1.0)
+        assert cb(Msg(), 1.5)
+        assert m._state == 3 and m.on_msg__q == m._on_msg__q_idle
+
+    def test_same_behaviour(self):
+        texts = [
+            'after /p until /p {x > 5}: no /p {x > 8}',
+            'after /p as P until /q: some /a {x > @P.x}',
+            'after /p as P until /p {x > 8}: /p {x > @P.x} causes /p {x < 2}',
+            'globally: /a as A causes /b {id = @A.id} within 2 s',
+            'after /p until /q: /b as B requires /a {id = @B.id}',
+            'after /p until /q: /b requires /a within 1 s',
+            'after /p as P: /a as A forbids /b {(id = @A.id and x > @P.x)}',
+        ]
+        topics = ('/a', '/b', '/p', '/q')
+        hooks = ('on_enter_scope', 'on_exit_scope')
+        for text in texts:
+            hp = self.parser.parse(text)
+            plain = self.renderer.build_monitor_class(hp)
+            for options in (self.options, CodeOptions.from_level(
+                    3, hooks, state_dispatch=True, hoist_accessors=True,
+                    project_fields=True), CodeOptions(state_dispatch=True),
+                    CodeOptions(state_dispatch=True, next_deadline=True,
+                                batch_callbacks=True)):
+                fast = self.renderer.build_monitor_class(hp, options=options)
+                for seed in range(10):
+                    trace = random_trace(topics, 200, seed=seed)
+                    assert run_trace(plain, trace) == run_trace(fast, trace)
+
+
+class TestStateRouting(unittest.TestCase):
+    def setUp(self):
+        self.parser = property_parser()
+        self.renderer = TemplateRenderer()
+
+    def test_state_topics(self):
+        hp = self.parser.parse(
+            'after /p as P: /a as A forbids /b {x > @A.x} within 1 s')
+        builder = new_builder(hp)
+        assert builder.state_topics == {1: ['/p'], 2: ['/a', '/b'], 3: ['/a']}
+
+    def test_node_rendering(self):
+        texts = [
+            'globally: no /a {x > 0}',
+            'after /p: /a causes /b within 1 s',
+            'globally: no /b {x > 0}',
+        ]
+        hps = [self.parser.parse(text) for text in texts]
+        topics = {t: 'geometry_msgs/Point' for t in ('/a', '/b', '/p')}
+        plain = self.renderer.render_rospy_node(hps, topics)
+        assert 'self.routes' not in plain
+        for options in (CodeOptions(state_routing=True),
+                        CodeOptions(state_routing=True, next_deadline=True,
+                                    elide_lock=True)):
+            code = self.renderer.render_rospy_node(hps, topics,
+                                                   options=options)
+            compile(code, '<node>', 'exec')
+            assert "3: ('/a',)," in code
+            assert "2: ('/a', '/b')," in code
+            assert code.count("for i in self.routes['") == 3
+            assert code.count('self._reroute(i)') == 5
+            # only the response monitor has a timeout
+            assert 'if i in (1,):' in code
+
+    def test_dynamic_subscriptions(self):
+        with self.assertRaises(ValueError):
+            CodeOptions(subscription_grace=1.0)
+        with self.assertRaises(ValueError):
+            CodeOptions(state_routing=True, subscription_grace=-1.0)
+        hps = [self.parser.parse('after /p until /q: no /a {x > 0}')]
+        topics = {t: 'geometry_msgs/Point' for t in ('/a', '/p', '/q')}
+        plain = self.renderer.render_rospy_node(
+            hps, topics, options=CodeOptions(state_routing=True))
+        assert 'rospy.Subscriber(topic' not in plain
+        for next_deadline in (False, True):
+            options = CodeOptions(state_routing=True, subscription_grace=2.5,
+                                  next_deadline=next_deadline)
+            code = self.renderer.render_rospy_node(hps, topics,
+                                                   options=options)
+            compile(code, '<node>', 'exec')
+            assert code.count('rospy.Subscriber(') == 1
+            assert 'grace = 2.5' in code
+            assert code.count('self._unsubscribe_idle(t)') == 1
+            # subscriptions change only after the lock is released:
+            # at launch, in the timer loop, and in the 3 callbacks
+            method = code[code.index('    def _update_subscriptions('):]
+            method = method[:method.index('\n\n')]
+            assert 'rospy.Subscriber(' in method
+            assert '.unregister()' in method
+            assert code.count('.unregister()') == 1
+            assert code.count('self._update_subscriptions()') == 5
+
+
+class TestBatchCallbacks(unittest.TestCase):
+    def setUp(self):
+        self.parser = property_parser()
+        self.renderer = TemplateRenderer()
+
+    def test_rendering(self):
+        hp = self.parser.parse('globally: /a causes /b within 1 s')
+        plain = self.renderer.render_monitor(hp)
+        assert 'def on_msgs_' not in plain
+        code = self.renderer.render_monitor(
+            hp, options=CodeOptions(batch_callbacks=True))
+        for name in ('_a', '_b'):
+            assert 'def on_msgs_{}(self, msgs, stamps):'.format(name) in code
+        # one loop, with members in locals, and no copy of the callbacks
+        assert 'def _on_msg_' not in code
+        assert code.count('            _state = self._state') == 2
+        assert code.count('            _pool = self._pool') == 2
+        assert 'self._state = _state = ' in code
+        body = code.split('def on_msgs__b(')[1].split('    def ')[0]
+        assert 'return True' not in body and 'return False' not in body
+        code = self.renderer.render_monitor(
+            hp, options=CodeOptions.from_level(
+                3, unused_hooks=('on_success',), batch_callbacks=True))
+        assert 'def _on_msg_' not in code
+        assert 'on_violation = self.on_violation' in code
+        assert 'on_success = self.on_success' not in code
+
+    def test_early_stop(self):
+        hp = self.parser.parse('globally: no /a {x > 5}')
+        cls = self.renderer.build_monitor_class(
+            hp, options=CodeOptions(batch_callbacks=True))
+        m = cls()
+        msgs = [Msg(x=x) for x in (1, 2, 8, 3, 9)]
+        stamps = [1.0, 2.0, 3.0, 4.0, 5.0]
+        assert m.on_msgs__a(msgs, stamps) == 0
+        m.on_launch(0.0)
+        assert m.on_msgs__a(msgs, stamps) == 3
+        assert m.verdict is False
+        assert [rec.timestamp for rec in m.witness] == [3.0]
+        assert m.on_msgs__a(msgs, stamps) == 0
+
+    def test_same_behaviour(self):
+        texts = [
+            'after /p until /p {x > 5}: no /p {x > 8}',
+            'after /p as P until /q: some /a {x > @P.x} within 2 s',
+            'globally: /a as A causes /b {id = @A.id} within 2 s',
+            'after /p until /q: /b as B requires /a {id = @B.id} within 3 s',
+            'after /p as P: /a as A forbids /b {(id = @A.id and x > @P.x)}',
+        ]
+        topics = ('/a', '/b', '/p', '/q')
+        for text in texts:
+            hp = self.parser.parse(text)
+            plain = self.renderer.build_monitor_class(hp)
+            for options in (CodeOptions(batch_callbacks=True),
+                            CodeOptions.from_level(3, batch_callbacks=True,
+                                                   state_dispatch=True),
+                            CodeOptions(batch_callbacks=True,
+                                        state_dispatch=True)):
+                fast = self.renderer.build_monitor_class(hp, options=options)
+                for seed in range(10):
+                    trace = random_trace(topics, 200, seed=seed)
+                    assert (self._run(plain, trace, False)
+                            == self._run(fast, trace, True))
+
+    def test_all_types_of_property(self):
+        # the traces of `test_monitor_classes`, in runs of the same topic
+        for text, traces in all_types_of_property():
+            hp = self.parser.parse(text)
+            plain = self.renderer.build_monitor_class(hp)
+            for options in (CodeOptions(batch_callbacks=True),
+                            CodeOptions(batch_callbacks=True,
+                                        state_dispatch=True),
+                            CodeOptions.from_level(3, batch_callbacks=True,
+                                                   hoist_accessors=True)):
+                fast = self.renderer.build_monitor_class(hp, options=options)
+                for events in traces:
+                    trace = [(None if e.event == E_TIMER else e.topic,
+                              getattr(e, 'msg', None), t)
+                             for t, e in enumerate(events, 1)]
+                    assert (self._run(plain, trace, False)
+                            == self._run(fast, trace, True)), text
+
+    def _run(self, cls, trace, batched):
+        # feeds runs of messages of the same topic at once, or one by one
+        m = cls()
+        m.on_launch(0.0)
+        results = []
+        i = 0
+        while i < len(trace):
+            topic, msg, t = trace[i]
+            j = i + 1
+            while topic and j < len(trace) and trace[j][0] == topic:
+                j += 1
+            if topic is None:
+                m.on_timer(t)
+            elif topic in m.cb_map and batched:
+                cb = getattr(m, 'on_msgs_' + topic.replace('/', '_'))
+                n = cb([e[1] for e in trace[i:j]], [e[2] for e in trace[i:j]])
+                results.append(n)
+            elif topic in m.cb_map:
+                n = 0
+                for _, msg, t in trace[i:j]:
+                    if m.verdict is not None:
+                        break
+                    m.cb_map[topic](msg, t)
+                    n += 1
+                results.append(n)
+            results.append((m._state, [(rec.topic, rec.timestamp)
+                                       for rec in m.witness]))
+            i = j
+        return results
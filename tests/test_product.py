@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, range
+import unittest
+
+from hpl.parser import property_parser
+
+from hplrv.monitors import new_builder
+from hplrv.product import (
+    ComponentAutomaton, ProductSpec, reference_free_properties
+)
+from hplrv.rendering import TemplateRenderer
+
+from .common_data import Msg, TOPICS, random_trace
+
+###############################################################################
+# Test Data
+###############################################################################
+
+PROPERTIES = (
+    'globally: no /a {x > 8}',
+    'after /p until /q: some /b {x > 5}',
+    'until /q {x > 5}: /b requires /a {x > 3}',
+    'after /p until /p {x > 7}: /a {x > 3} causes /b {x > 3}',
+    'after /p: /a {x > 3} forbids /b {x > 3}',
+    'after /p until /p: no /p {x > 8}',
+    'globally: some /b {x > 5}',
+)
+
+WITH_REFERENCES = (
+    'globally: no /a {x > 8} within 2 s',
+    'globally: /b as B requires /a {x = @B.x}',
+    'after /p as P: no /a {x > @P.x}',
+)
+
+
+###############################################################################
+# Test Cases
+###############################################################################
+
+class TestProductMonitor(unittest.TestCase):
+    def setUp(self):
+        p = property_parser()
+        self.renderer = TemplateRenderer()
+        self.hps = [p.parse(text) for text in PROPERTIES]
+        self.refs = [p.parse(text) for text in WITH_REFERENCES]
+
+    def test_eligibility(self):
+        product, others = reference_free_properties(self.hps + self.refs)
+        assert product == self.hps
+        assert others == self.refs
+        for hp in self.refs:
+            with self.assertRaises(ValueError):
+                ProductSpec([hp])
+
+    def test_minimization(self):
+        p = property_parser()
+        # states: active, and a single state for both verdicts
+        hp = p.parse('until /q {x > 0}: /b requires /a {x > 0}')
+        automaton = ComponentAutomaton(new_builder(hp), {})
+        assert automaton.num_states == 2
+        # there is nothing to report, whatever happens
+        hp = p.parse('globally: /a {x > 0} causes /b {x > 0}')
+        automaton = ComponentAutomaton(new_builder(hp), {})
+        assert automaton.num_states == 1
+        spec = ProductSpec([hp])
+        assert spec.components == [[{}, {}]]
+
+    def test_shared_bits(self):
+        spec = ProductSpec(self.hps)
+        topics = dict(spec.predicates)
+        # `x > 3` on /a and /b is one bit for all properties
+        assert [str(phi) for phi in topics['/a']] == [
+            '{ (x > 8) }', '{ (x > 3) }']
+        assert [str(phi) for phi in topics['/b']] == [
+            '{ (x > 5) }', '{ (x > 3) }']
+
+    def test_rendering(self):
+        code = self.renderer.render_product_monitor(self.hps)
+        assert code.startswith('class ProductMonitor(object):')
+        assert code.count('    def on_msg_') == len(TOPICS)
+        assert code.count('.get((s, m))') == len(TOPICS)
+        with self.assertRaises(ValueError):
+            self.renderer.render_product_monitor(self.hps + self.refs)
+
+    def test_same_behaviour(self):
+        # product monitor vs. one monitor per property
+        classes = [self.renderer.build_monitor_class(hp) for hp in self.hps]
+        product_class = self.renderer.build_product_monitor_class(self.hps)
+        for seed in range(20):
+            monitors = [cls() for cls in classes]
+            product = product_class()
+            log1 = []
+            log2 = []
+            for i in range(len(monitors)):
+                monitors[i].on_success = (lambda i: lambda stamp, w:
+                    log1.append((i, True, stamp, w[-1])))(i)
+                monitors[i].on_violation = (lambda i: lambda stamp, w:
+                    log1.append((i, False, stamp, w[-1])))(i)
+                monitors[i].on_launch(0.0)
+            product.on_success = lambda i, stamp, w: log2.append(
+                (i, True, stamp, w[-1]))
+            product.on_violation = lambda i, stamp, w: log2.append(
+                (i, False, stamp, w[-1]))
+            product.on_launch(0.0)
+            for topic, msg, t in random_trace(100, seed=seed, timers=0.0):
+                for m in monitors:
+                    cb = m.cb_map.get(topic)
+                    if cb is not None:
+                        cb(msg, t)
+                product.cb_map[topic](msg, t)
+                assert product.verdicts == tuple(m.verdict for m in monitors)
+            assert log1 == log2
+            for m in monitors:
+                m.on_shutdown(100.0)
+            product.on_shutdown(100.0)
+            assert product.verdicts == tuple(m.verdict for m in monitors)
+
+
+if __name__ == '__main__':
+    unittest.main()
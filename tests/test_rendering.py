@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from hpl.parser import property_parser
+
+from hplrv.caching import CodeCache, RenderCache
+from hplrv.rendering import TemplateRenderer
+
+from .common_data import Msg
+
+###############################################################################
+# Test Cases
+###############################################################################
+
+class TestTemplateRenderer(unittest.TestCase):
+    def setUp(self):
+        self.parser = property_parser()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_shared_environment(self):
+        r1 = TemplateRenderer()
+        r2 = TemplateRenderer()
+        assert r1.jinja_env is r2.jinja_env
+        r3 = TemplateRenderer(bytecode_cache_dir=self.tmp_dir)
+        assert r3.jinja_env is not r1.jinja_env
+
+    def test_bytecode_cache(self):
+        hp = self.parser.parse('globally: /a causes /b within 100 ms')
+        expected = TemplateRenderer().render_monitor(hp)
+        r = TemplateRenderer(bytecode_cache_dir=self.tmp_dir, preload=True)
+        assert os.listdir(self.tmp_dir)
+        assert r.render_monitor(hp) == expected
+
+    def test_render_cache(self):
+        texts = [
+            'globally: no /b {data > 0}',
+            'after /p as P: some /b {data > @P.data} within 1 s',
+            'globally: /a as A causes /b {x = @A.x} within 100 ms',
+        ]
+        hps = [self.parser.parse(text) for text in texts]
+        expected = [TemplateRenderer().render_monitor(hp) for hp in hps]
+        cache = RenderCache(cache_dir=self.tmp_dir)
+        r = TemplateRenderer(render_cache=cache)
+        assert [r.render_monitor(hp) for hp in hps] == expected
+        assert cache.misses == 3 and cache.hits == 0
+        assert [r.render_monitor(hp) for hp in hps] == expected
+        assert cache.hits == 3
+        # options are part of the key
+        text = r.render_monitor(hps[0], class_name='Other')
+        assert 'class Other(object)' in text
+        assert cache.misses == 4
+        # second tier survives the first
+        cache = RenderCache(cache_dir=self.tmp_dir)
+        r = TemplateRenderer(render_cache=cache)
+        assert [r.render_monitor(hp) for hp in hps] == expected
+        assert cache.misses == 0 and cache.hits == 3
+        # entries on disk are replaced
+        cache.put('key', 'old')
+        cache.put('key', 'new')
+        assert RenderCache(cache_dir=self.tmp_dir).get('key') == 'new'
+
+    def test_render_many(self):
+        texts = [
+            'globally: no /b {data > 0}',
+            'after /p as P: some /b {data > @P.data} within 1 s',
+            'globally: /a as A causes /b {x = @A.x} within 100 ms',
+            'globally: /b as B requires /a {x < @B.x}',
+        ]
+        hps = [self.parser.parse(text) for text in texts]
+        hps[1].pattern.pattern_type = -1 # not a valid pattern
+        r = TemplateRenderer()
+        for jobs in (1, 2):
+            results = r.render_many(hps, jobs=jobs)
+            assert len(results) == len(hps)
+            for i in (0, 2, 3):
+                assert results[i].error is None
+                assert results[i].code == r.render_monitor(hps[i])
+            assert results[1].code is None
+            assert isinstance(results[1].error, Exception)
+
+    def test_stream_rospy_node(self):
+        texts = [
+            'globally: no /a {x > 0}',
+            'after /p: /a causes /b within 1 s',
+            'globally: /b as B requires /a {x < @B.x}',
+        ]
+        hps = [self.parser.parse(text) for text in texts]
+        topics = {
+            '/a': 'geometry_msgs/Point',
+            '/b': 'geometry_msgs/Point',
+            '/p': 'std_msgs/Empty',
+        }
+        r = TemplateRenderer()
+        expected = r.render_rospy_node(hps, topics)
+        sink = io.StringIO()
+        r.stream_rospy_node(hps, topics, sink)
+        assert sink.getvalue() == expected
+        sink = io.BytesIO()
+        r.stream_rospy_node(hps, topics, sink, encoding='utf-8')
+        assert sink.getvalue() == expected.encode('utf-8')
+
+    def test_share_predicates(self):
+        texts = [
+            'globally: no /a {x > 0}',
+            'after /a {x > 0}: some /b within 1 s',
+            'globally: /a {x > 0} causes /b within 1 s',
+            'globally: no /b {x > 0}',
+            'globally: /b as B requires /a {x < @B.x}',
+        ]
+        hps = [self.parser.parse(text) for text in texts]
+        topics = {
+            '/a': 'geometry_msgs/Point',
+            '/b': 'geometry_msgs/Point',
+        }
+        r = TemplateRenderer(render_cache=RenderCache())
+        plain = r.render_rospy_node(hps, topics)
+        code = r.render_rospy_node(hps, topics, share_predicates=True)
+        assert code != plain
+        compile(code, '<node>', 'exec')
+        # evaluated once in the node, instead of once in each monitor
+        assert plain.count('(msg.x > 0)') == 4
+        assert code.count('(msg.x > 0)') == 2
+        assert code.count('preds[0]') == 3
+        # errors reach only the monitors that test the predicate
+        assert 'class PredicateError(object):' not in plain
+        assert 'class PredicateError(object):' in code
+        assert code.count('pred_0 = PredicateError(e)') == 1
+        assert 'preds = (pred_0,)' in code
+        assert 'self.monitors[0].on_msg__a(msg, t, preds)' in code
+        assert 'self.monitors[4].on_msg__a(msg, t)' in code
+        # '/b {x > 0}' only appears once, it is not shared
+        assert 'self.monitors[3].on_msg__b(msg, t)' in code
+        sink = io.StringIO()
+        r.stream_rospy_node(hps, topics, sink, share_predicates=True)
+        assert sink.getvalue() == code
+        assert r.render_rospy_node(hps, topics, jobs=2,
+                                   share_predicates=True) == code
+
+    def test_build_monitor_class(self):
+        hp = self.parser.parse('#id: my_prop\nglobally: no /a {x > 0}')
+        cache = CodeCache(cache_dir=self.tmp_dir)
+        r = TemplateRenderer(code_cache=cache)
+        cls = r.build_monitor_class(hp)
+        assert cls.__name__ == 'MyPropMonitor'
+        assert len(cache) == 1
+        m = cls()
+        m.on_launch(0)
+        assert m.on_msg__a(Msg(x=1), 1)
+        assert m.verdict is False
+        assert m.witness[0].msg.x == 1
+        assert r.build_monitor_class(hp, class_name='Other').__name__ == 'Other'
+        assert len(cache) == 2
+        # compiled code is loaded from disk
+        cache = CodeCache(cache_dir=self.tmp_dir)
+        r = TemplateRenderer(code_cache=cache)
+        code = cache.compile(r.render_monitor(hp), '<hplrv:MyPropMonitor>')
+        assert code.co_filename == '<hplrv:MyPropMonitor>'
+        cls = r.build_monitor_class(hp)
+        assert len(cache) == 1
+        assert cls().verdict is None
+
+    def test_class_memo(self):
+        hp = self.parser.parse('globally: no /a {x > 0}')
+        r = TemplateRenderer(max_classes=2)
+        cls = r.build_monitor_class(hp)
+        assert r.build_monitor_class(hp) is cls
+        assert r.build_monitor_class(self.parser.parse(
+            'globally: no /a {x > 0}')) is cls
+        other = r.build_monitor_class(hp, options=3)
+        assert other is not cls
+        assert r.build_monitor_class(hp, class_name='Other') is not cls
+        # least recently used first
+        assert r.build_monitor_class(hp, options=3) is other
+        assert r.build_monitor_class(hp) is not cls
+        r = TemplateRenderer(max_classes=0)
+        assert r.build_monitor_class(hp) is not r.build_monitor_class(hp)
+        with self.assertRaises(ValueError):
+            TemplateRenderer(max_classes=-1)
+
+    def test_code_cache_lru(self):
+        cache = CodeCache(max_size=2)
+        a = cache.compile('a = 1')
+        b = cache.compile('b = 1')
+        assert cache.compile('a = 1') is a
+        cache.compile('c = 1')
+        assert len(cache) == 2
+        assert cache.compile('a = 1') is a
+        assert cache.compile('b = 1') is not b
+        with self.assertRaises(ValueError):
+            CodeCache(max_size=0)
+
+    def test_render_cache_lru(self):
+        cache = RenderCache(max_size=2)
+        cache.put('a', 'A')
+        cache.put('b', 'B')
+        assert cache.get('a') == 'A'
+        cache.put('c', 'C')
+        assert cache.get('b') is None
+        assert cache.get('a') == 'A'
+        assert cache.get('c') == 'C'
+        assert len(cache) == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
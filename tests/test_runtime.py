@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import range
+import random
+import unittest
+
+from hplrv.runtime import (
+    IndexedPool, KeyedPool, MsgRecord, PredicateError, ProductAutomaton,
+    TimestampPool
+)
+
+###############################################################################
+# Test Cases
+###############################################################################
+
+class TestTimestampPool(unittest.TestCase):
+    def test_ordered_insert(self):
+        pool = TimestampPool()
+        for t in (3, 1, 4, 1, 5, 9, 2, 6):
+            pool.add(MsgRecord('/a', t, t * 10))
+        assert [rec.timestamp for rec in pool] == [1, 1, 2, 3, 4, 5, 6, 9]
+        assert pool[0].timestamp == 1 and pool[-1].timestamp == 9
+        assert len(pool) == 8
+        assert pool.popleft().timestamp == 1
+        assert pool.pop().timestamp == 9
+        assert [rec.timestamp for rec in pool] == [1, 2, 3, 4, 5, 6]
+        # equal timestamps keep their arrival order
+        pool.add(MsgRecord('/b', 3, None))
+        assert [rec.topic for rec in pool][3] == '/b'
+
+    def test_expire(self):
+        pool = TimestampPool(MsgRecord('/a', t, None) for t in range(100))
+        assert pool.expire(50.5, 10) == 41
+        assert pool[0].timestamp == 41
+        assert len(pool) == 59
+        assert pool.expire(50.5, 10) == 0
+        pool.add(MsgRecord('/a', 45, None))
+        assert [rec.timestamp for rec in pool][:6] == [41, 42, 43, 44, 45, 45]
+        assert pool.expire(1000, 10) == 60
+        assert not pool and len(pool) == 0
+        with self.assertRaises(IndexError):
+            pool[0]
+        with self.assertRaises(IndexError):
+            pool.popleft()
+
+    def test_drain(self):
+        pool = TimestampPool(MsgRecord('/a', t, None) for t in range(1000))
+        for t in range(1000):
+            assert pool.popleft().timestamp == t
+            assert len(pool) == 999 - t
+        assert not pool
+        pool.add(MsgRecord('/a', 1, None))
+        assert pool.pop().timestamp == 1
+        assert not pool
+
+    def test_late_records(self):
+        # out of order records go to a heap, without shifting the list
+        rng = random.Random(0)
+        pool = TimestampPool()
+        ref = [] # (timestamp, arrival, MsgRecord)
+        for i in range(2000):
+            op = rng.random()
+            if op < 0.7 or not ref:
+                rec = MsgRecord('/a', rng.randint(0, 50) + i // 20, i)
+                pool.add(rec)
+                ref.append((rec.timestamp, i, rec))
+                ref.sort(key=lambda e: e[:2])
+            elif op < 0.8:
+                assert pool.popleft() is ref.pop(0)[2]
+            elif op < 0.85:
+                assert pool.pop() is ref.pop()[2]
+            elif op < 0.95:
+                stamp = i // 20 + rng.randint(0, 30)
+                n = len([e for e in ref if stamp - e[0] >= 10])
+                assert pool.expire(stamp, 10) == n
+                ref = ref[n:]
+            else:
+                j = rng.randint(0, len(ref) - 1)
+                assert pool[j] is ref[j][2]
+            assert len(pool) == len(ref)
+            assert [rec.msg for rec in pool] == [e[1] for e in ref]
+            if ref:
+                assert pool[0] is ref[0][2] and pool[-1] is ref[-1][2]
+        assert pool._late
+
+    def test_late_expire(self):
+        pool = TimestampPool(MsgRecord('/a', t, None) for t in range(10, 20))
+        for t in range(10):
+            pool.add(MsgRecord('/b', t, None))
+        assert len(pool._records) == 10 and len(pool._late) == 10
+        expired = pool._expire(15, 10, True)
+        assert [rec.timestamp for rec in expired] == [0, 1, 2, 3, 4, 5]
+        assert pool.expire(25, 10) == 10
+        assert [rec.timestamp for rec in pool] == [16, 17, 18, 19]
+        assert not pool._late
+
+
+
+class TestKeyedPool(unittest.TestCase):
+    def test_index(self):
+        pool = KeyedPool()
+        recs = [MsgRecord('/a', t, t % 3) for t in (5, 1, 4, 2, 3, 0)]
+        for rec in recs:
+            pool.add(rec, rec.msg)
+        assert [rec.timestamp for rec in pool] == [0, 1, 2, 3, 4, 5]
+        assert [rec.timestamp for rec in pool.get(1)] == [1, 4]
+        assert pool.get(7) == ()
+        for rec in pool.get(0):
+            pool.discard(rec)
+        assert [rec.timestamp for rec in pool] == [1, 2, 4, 5]
+        assert len(pool) == 4 and pool[0].timestamp == 1
+        with self.assertRaises(IndexError):
+            pool[1]
+        pool.discard(recs[0])
+        assert [rec.timestamp for rec in pool] == [1, 2, 4]
+        assert pool.popleft().timestamp == 1
+        assert [rec.timestamp for rec in pool.get(1)] == [4]
+        assert pool[0].timestamp == 2
+        pool.clear()
+        assert not pool and pool.get(1) == ()
+
+    def test_equal_records(self):
+        # records are compared by identity, not by value
+        pool = KeyedPool()
+        a = MsgRecord('/a', 1, 'x')
+        b = MsgRecord('/a', 1, 'x')
+        pool.add(a, 'k')
+        pool.add(b, 'k')
+        pool.discard(b)
+        assert pool.get('k')[0] is a
+        assert pool.popleft() is a
+        assert not pool
+
+    def test_dead_records(self):
+        # records removed behind a live head do not pile up
+        pool = KeyedPool()
+        pool.add(MsgRecord('/a', 0, None), 'old')
+        for t in range(1, 1000):
+            rec = MsgRecord('/a', t, None)
+            pool.add(rec, t)
+            pool.discard(rec)
+            assert len(pool._pool) <= 2 * 33
+        assert len(pool) == 1 and [r.timestamp for r in pool] == [0]
+
+
+
+class TestIndexedPool(unittest.TestCase):
+    def test_queries(self):
+        pool = IndexedPool(('hash', 'sorted'))
+        for t in range(10):
+            # id repeats every 3 records, x decreases
+            pool.add(MsgRecord('/a', t, None), (t % 3, 10 - t))
+        pool.add(MsgRecord('/b', 10, None), (None, float('nan')))
+        stamps = lambda recs: sorted(rec.timestamp for rec in recs)
+        assert stamps(pool.equal(0, 1)) == [1, 4, 7]
+        assert stamps(pool.equal(0, 5)) == []
+        assert stamps(pool.below(1, 3)) == [8, 9]
+        assert stamps(pool.below(1, 3, True)) == [7, 8, 9]
+        assert stamps(pool.above(1, 8)) == [0, 1]
+        assert stamps(pool.above(1, 8, True)) == [0, 1, 2]
+        assert stamps(pool.above(1, float('nan'))) == []
+        assert len(pool) == 11
+
+    def test_first(self):
+        # the oldest record, and the first one inserted among equal stamps
+        pool = IndexedPool(('sorted',))
+        recs = [MsgRecord('/a', t, i) for i, t in enumerate((3, 1, 2, 1))]
+        for rec in recs:
+            pool.add(rec, (rec.msg,))
+        assert pool.first(list(pool.above(0, 0))) is recs[1]
+        assert pool.first([recs[3], recs[2]]) is recs[3]
+        assert pool.first([recs[0]]) is recs[0]
+        # among late records, too
+        late = [MsgRecord('/b', 0, i) for i in range(3)]
+        for rec in late:
+            pool.add(rec, (rec.msg,))
+        assert pool.first([late[2], late[1], recs[1]]) is late[1]
+        assert pool.first(list(pool.above(0, -1))) is late[0]
+
+    def test_expire(self):
+        pool = IndexedPool(('hash', 'sorted'))
+        for t in range(10):
+            pool.add(MsgRecord('/a', t, None), (t % 3, t % 4))
+        assert pool.expire(10, 5) == 6
+        assert [rec.timestamp for rec in pool] == [6, 7, 8, 9]
+        stamps = lambda recs: sorted(rec.timestamp for rec in recs)
+        assert stamps(pool.equal(0, 0)) == [6, 9]
+        assert stamps(pool.below(1, 2)) == [8, 9]
+        assert pool.popleft().timestamp == 6
+        assert stamps(pool.equal(0, 0)) == [9]
+        assert stamps(pool.above(1, 0)) == [7, 9]
+        pool.clear()
+        assert not pool and stamps(pool.equal(0, 0)) == []
+
+    def test_batch_expire(self):
+        # expiring many records at once rebuilds the sorted index
+        rng = random.Random(0)
+        batch = IndexedPool(('hash', 'sorted'))
+        single = IndexedPool(('hash', 'sorted'))
+        for t in range(200):
+            keys = (rng.randint(0, 5), rng.choice((rng.random(), None)))
+            batch.add(MsgRecord('/a', t, None), keys)
+            single.add(MsgRecord('/a', t, None), keys)
+        assert batch.expire(100, 1) == 100
+        for t in range(1, 101):
+            assert single.expire(t, 1) == 1
+        stamps = lambda recs: [rec.timestamp for rec in recs]
+        for pool in (batch, single):
+            assert stamps(pool) == list(range(100, 200))
+            assert len(pool._keys) == 100
+        for key in range(6):
+            assert stamps(batch.equal(0, key)) == stamps(single.equal(0, key))
+        assert batch._indices[1][0] == single._indices[1][0]
+        assert stamps(batch.above(1, 0.5)) == stamps(single.above(1, 0.5))
+
+
+class TestProductAutomaton(unittest.TestCase):
+    def test_step(self):
+        # one topic; property 0 fails on bit 1, property 1 waits for bit 2
+        # and then succeeds on any message
+        dfa = ProductAutomaton([
+            [{0: ((1, 1, False),)}],
+            [{0: ((2, 1, None),), 1: ((0, 2, True),)}],
+        ], (0, 0), (2,))
+        s = dfa.initial
+        assert dfa.care[0][s] == (True, True)
+        s1, verdicts = dfa.step(0, s, 2)
+        assert verdicts == ()
+        assert dfa.care[0][s1] == (True, False)
+        s2, verdicts = dfa.step(0, s1, 1)
+        assert verdicts == ((0, False), (1, True))
+        assert dfa.care[0][s2] == (False, False)
+        assert dfa.delta[0][(s1, 1)] == (s2, verdicts)
+        assert dfa.step(0, s2, 0) == (s2, ())
+        assert len(dfa.states) == 3
+
+
+class TestPredicateError(unittest.TestCase):
+    def test_raise_on_test(self):
+        msg = object()
+        try:
+            value = msg.data[3] > 0
+        except Exception as e:
+            value = PredicateError(e)
+        preds = (value, True)
+        # the other predicates are unaffected
+        assert preds[1]
+        with self.assertRaises(AttributeError):
+            if preds[0]:
+                pass
+        with self.assertRaises(AttributeError):
+            not preds[0]
+
+
+if __name__ == '__main__':
+    unittest.main()
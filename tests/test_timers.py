@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# SPDX-License-Identifier: MIT
+# Copyright © 2021 André Santos
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import unicode_literals
+from builtins import object, range
+import random
+import unittest
+
+from hpl.parser import property_parser
+
+from hplrv.optimization import CodeOptions
+from hplrv.rendering import TemplateRenderer
+from hplrv.timers import TimerScheduler
+
+from .common_data import Msg, TIMED_PROPERTIES
+
+###############################################################################
+# Test Cases
+###############################################################################
+
+class TestTimerScheduler(unittest.TestCase):
+    def setUp(self):
+        p = property_parser()
+        r = TemplateRenderer()
+        hps = [p.parse(text) for text in TIMED_PROPERTIES]
+        self.plain = [r.build_monitor_class(hp) for hp in hps]
+        options = CodeOptions(next_deadline=True)
+        self.timed = [r.build_monitor_class(hp, options=options) for hp in hps]
+
+    def test_same_behaviour(self):
+        # polling every monitor on every tick vs. firing only deadlines
+        rng = random.Random(0)
+        n = 200
+        polled = [self.plain[i % len(self.plain)]() for i in range(n)]
+        scheduled = [self.timed[i % len(self.timed)]() for i in range(n)]
+        clock = [0.0]
+        scheduler = TimerScheduler(clock=lambda: clock[0])
+        for m1, m2 in zip(polled, scheduled):
+            m1.on_launch(0.0)
+            m2.on_launch(0.0)
+            scheduler.add(m2)
+        assert len(scheduler) == n and scheduled[0] in scheduler
+        assert scheduler.next_deadline is None
+        total = 0
+        for _ in range(2000):
+            clock[0] += rng.choice((0.01, 0.1, 0.25))
+            t = clock[0]
+            if rng.random() < 0.5:
+                for m in polled:
+                    m.on_timer(t)
+                fired = scheduler.tick()
+                assert fired <= n
+                total += fired
+            else:
+                i = rng.randrange(n)
+                topic = rng.choice(('/a', '/b', '/p'))
+                msg = Msg(x=rng.randint(0, 9))
+                for m in (polled[i], scheduled[i]):
+                    cb = m.cb_map.get(topic)
+                    if cb is not None:
+                        cb(msg, t)
+                scheduler.update(scheduled[i])
+        for m1, m2 in zip(polled, scheduled):
+            assert m1._state == m2._state
+            assert m1.witness == m2.witness
+        # far fewer calls than polling
+        assert 0 < total < 1000 * n // 10
+
+    def test_deadlines(self):
+        cls = self.timed[0]
+        m1 = cls()
+        m2 = cls()
+        scheduler = TimerScheduler()
+        for m in (m1, m2):
+            m.on_launch(0.0)
+            scheduler.add(m)
+        m1.on_msg__a(Msg(), 1.0)
+        scheduler.update(m1)
+        m2.on_msg__a(Msg(), 0.5)
+        scheduler.update(m2)
+        assert scheduler.next_deadline == 1.5
+        assert scheduler.tick(1.0) == 0
+        # behaviour arrives in time, the stale entry is skipped
+        m2.on_msg__b(Msg(), 1.2)
+        scheduler.update(m2)
+        assert scheduler.next_deadline == 2.0
+        assert scheduler.tick(1.9) == 0
+        assert scheduler.tick(2.0) == 1
+        assert m1.verdict is False and m2.verdict is None
+        assert scheduler.next_deadline is None
+        # removed monitors are not fired
+        m2.on_msg__a(Msg(), 3.0)
+        scheduler.update(m2)
+        scheduler.remove(m2)
+        assert m2 not in scheduler
+        assert scheduler.tick(10.0) == 0
+        assert m2.verdict is None
+
+
+if __name__ == '__main__':
+    unittest.main()